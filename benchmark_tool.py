@@ -0,0 +1,202 @@
+import io
+import os
+import re
+import sys
+import logging
+import argparse
+import contextlib
+import subprocess
+import time
+
+# 启动路径上的模块：采集、导出和主菜单都不应加载分析依赖
+STARTUP_MODULES = [
+    'main',
+    'src.db_handler',
+    'src.exporter',
+    'src.message_writer',
+    'src.data_analyzer',
+]
+
+# 只允许在分析功能内部按需导入的重量级依赖
+HEAVY_MODULES = [
+    'pandas',
+    'numpy',
+    'matplotlib',
+    'seaborn',
+    'wordcloud',
+    'networkx',
+    'graphviz',
+    'sklearn',
+    'pyarrow',
+    'jieba.analyse',
+    'jieba.posseg',
+]
+
+_IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$')
+
+def measure_import(module):
+    """用 python -X importtime 在新进程中导入模块
+
+    Returns:
+        tuple: (总耗时毫秒, 已导入模块集合, 错误信息)
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=root,
+        capture_output=True,
+        text=True
+    )
+
+    total_us = 0
+    imported = set()
+    errors = []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if not match:
+            errors.append(line)
+            continue
+        cumulative, indent, name = int(match.group(2)), match.group(3), match.group(4)
+        imported.add(name)
+        if len(indent) == 1:  # 顶层导入，累计耗时已包含其子模块
+            total_us += cumulative
+
+    error = '\n'.join(errors[-5:]) if result.returncode != 0 else None
+    return total_us / 1000, imported, error
+
+def check_imports(modules, budget_ms):
+    """检查启动模块的导入耗时和依赖，全部通过时返回True"""
+    print("=== 启动导入检查 ===")
+    failed = False
+    for module in modules:
+        elapsed, imported, error = measure_import(module)
+        if error:
+            print(f"{module}: 导入失败\n{error}")
+            failed = True
+            continue
+
+        heavy = [name for name in HEAVY_MODULES if name in imported]
+        over_budget = elapsed > budget_ms
+        status = '失败' if heavy or over_budget else '通过'
+        print(f"{module}: {elapsed:.1f} ms ({status})")
+        if heavy:
+            print(f"  启动时不应导入: {', '.join(heavy)}")
+        if over_budget:
+            print(f"  超出导入耗时上限 {budget_ms:.0f} ms")
+        failed = failed or bool(heavy) or over_budget
+    return not failed
+
+def bench_parse(recording, rounds):
+    """用录制的消息控件树测量 _parse_message 的解析吞吐"""
+    from src.wx_monitor import WeChatMonitor
+    from src.ui_replay import load_recording, benchmark_parse
+
+    scans = load_recording(recording)
+    monitor = WeChatMonitor()
+    # 解析过程中的日志和调试输出不计入结果展示
+    logging.disable(logging.CRITICAL)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            metrics = benchmark_parse(monitor, scans, rounds=rounds)
+    finally:
+        logging.disable(logging.NOTSET)
+
+    print("=== 消息解析基准 ===")
+    print(f"录制文件: {recording} ({len(scans)} 次扫描)")
+    print(f"列表项数: {metrics['items']}")
+    print(f"最快一轮: {metrics['seconds'] * 1000:.1f} ms")
+    print(f"吞吐: {metrics['items_per_sec']:.0f} 条/秒")
+    return True
+
+# 改为单个预编译正则之前的逐个匹配方式，作为时间匹配基准的对照
+_LEGACY_TIME_PATTERNS = [
+    r'^\d{2}:\d{2}$',
+    r'^星期[一二三四五六日] \d{2}:\d{2}$',
+    r'^\d{4}年\d{2}月\d{2}日 \d{2}:\d{2}$',
+    r'^昨天 \d{2}:\d{2}$',
+]
+
+def _collect_names(node, names):
+    if node.get('Name'):
+        names.append(node['Name'])
+    for child in node.get('children', []):
+        _collect_names(child, names)
+
+def _best_of(func, rounds):
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def bench_times(recording, rounds):
+    """比较逐个正则匹配和预编译合并正则+按日缓存解析的时间识别耗时"""
+    from datetime import datetime
+    from src.wx_monitor import WeChatMonitor, match_time
+    from src.ui_replay import load_recording
+
+    scans = load_recording(recording)
+    names = []
+    for scan in scans:
+        for item in scan['items']:
+            _collect_names(item, names)
+    anchor = scans[0]['captured_at'] if scans else datetime.now()
+
+    def legacy():
+        for name in names:
+            if any(re.match(pattern, name) for pattern in _LEGACY_TIME_PATTERNS):
+                # 旧的 _parse_time 会按同样的顺序再匹配一遍后解析
+                for pattern in _LEGACY_TIME_PATTERNS:
+                    if re.match(pattern, name):
+                        break
+
+    monitor = WeChatMonitor()
+    monitor.clock = lambda: anchor
+    logging.disable(logging.CRITICAL)
+    try:
+        def current():
+            for name in names:
+                if match_time(name):
+                    monitor._parse_time(name)
+        legacy_seconds = _best_of(legacy, rounds)
+        current_seconds = _best_of(current, rounds)
+    finally:
+        logging.disable(logging.NOTSET)
+
+    print("=== 时间匹配基准 ===")
+    print(f"控件名称数: {len(names)}")
+    print(f"逐个正则匹配: {legacy_seconds * 1000:.2f} ms")
+    print(f"合并正则+缓存解析: {current_seconds * 1000:.2f} ms")
+    if current_seconds:
+        print(f"加速比: {legacy_seconds / current_seconds:.1f}x")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description='性能检查工具')
+    subparsers = parser.add_subparsers(dest='command')
+
+    imports_parser = subparsers.add_parser('imports', help='检查启动路径的导入耗时和依赖（默认）')
+    imports_parser.add_argument('--budget-ms', type=float, default=500, help='单个模块导入耗时上限（毫秒）')
+    imports_parser.add_argument('modules', nargs='*', default=STARTUP_MODULES, help='要检查的模块')
+
+    parse_parser = subparsers.add_parser('parse', help='回放录制的消息控件树，测量解析吞吐')
+    parse_parser.add_argument('recording', help='采集时录制的JSONL文件')
+    parse_parser.add_argument('--rounds', type=int, default=3, help='重复轮数，取最快一轮')
+
+    times_parser = subparsers.add_parser('times', help='用录制的控件名称比较时间格式识别的耗时')
+    times_parser.add_argument('recording', help='采集时录制的JSONL文件')
+    times_parser.add_argument('--rounds', type=int, default=5, help='重复轮数，取最快一轮')
+
+    args = parser.parse_args()
+    if args.command == 'parse':
+        ok = bench_parse(args.recording, args.rounds)
+    elif args.command == 'times':
+        ok = bench_times(args.recording, args.rounds)
+    else:
+        ok = check_imports(getattr(args, 'modules', STARTUP_MODULES), getattr(args, 'budget_ms', 500))
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,7 @@
-from src.wx_monitor import WeChatMonitor
-from src.db_handler import DatabaseHandler
-from src.data_analyzer import DataAnalyzer
-from src.dict_manager import DictManager
-import uiautomation as auto
 import time
 import sys
+import argparse
+import multiprocessing
 from datetime import datetime, timedelta
 import os
 
@@ -210,44 +207,92 @@ def collect_data(monitor, db):
         if last_time:
             print(f"将从 {last_time} 开始获取新消息")
         
+        # 后台写入线程，采集与落库并行
+        from src.message_writer import MessageWriter
+        writer = MessageWriter(db)
+        writer.start()
+        chat_title = monitor.get_chat_title()
+        chat_id = None
+        if chat_title:
+            chat_id = db.get_chat_id(chat_title, chat['chat_type'], chat['chat_name'])
+            # 向上翻页补采离线期间的消息，翻到已入库的记录为止
+            from src.backfill import Backfill
+            backfill = Backfill(monitor, db, max_pages=monitor.max_scroll)
+            newest = backfill.run(chat_id, writer)
+            print(f"补采 {backfill.last_stats['new']} 条新消息 (翻页 {backfill.last_stats['pages']} 次)")
+            if newest and (not last_time or newest > last_time):
+                last_time = newest
+        
         try:
+            print("消息列表有变化时立即采集，按 Ctrl+C 停止监控")
             while True:
                 # 获取当前聊天窗口标题
-                chat_title = monitor.get_chat_title()
-                if not chat_title:
+                current_title = monitor.get_chat_title()
+                if not current_title:
                     print("未检测到聊天窗口，请确保正确的聊天窗口处于活动状态")
                     time.sleep(2)
                     continue
                 
-                # 获取新消息
-                messages = monitor.get_messages(last_time)
-                if messages:
-                    # 使用用户输入的名称或自动获取的名称
+                # 使用用户输入的名称或自动获取的名称
+                if current_title != chat_title:
+                    chat_title = current_title
                     chat_id = db.get_chat_id(chat_title, chat['chat_type'], chat['chat_name'])
-                    
-                    # 保存息，过滤未知发送者
-                    saved_count = 0
-                    for msg in messages:
-                        if msg['sender_name'] and msg['sender_name'].strip():
-                            db.save_message(chat_id, msg)
-                            last_time = msg['send_time']
-                            saved_count += 1
-                    print(f"已保存 {saved_count} 条新消息")
-                    if saved_count < len(messages):
-                        print(f"已过滤 {len(messages) - saved_count} 条未知发送者的消息")
-                else:
-                    print("本次扫描未发现新消息")
                 
-                time.sleep(1)  # 等待1秒
+                # 解析出的消息直接推入写入队列，过滤未知发送者
+                def enqueue(msg):
+                    if msg['sender_name'] and msg['sender_name'].strip():
+                        writer.put(chat_id, msg)
                 
-                # 每次扫描后询问用户是否继续
-                choice = input("\n是否继续获取消息？(y/n): ")
-                if choice.lower() != 'y':
-                    print("\n停止获取消息")
-                    return
+                # 每段采集结束后重新确认当前聊天，防止手动切换聊天后消息记到错误的聊天
+                before = writer.get_metrics()['enqueued']
+                last_time = monitor.watch_messages(enqueue, last_time, duration=30)
+                submitted = writer.get_metrics()['enqueued'] - before
+                
+                metrics = writer.get_metrics()
+                watch = monitor.watcher.get_metrics()
+                if submitted:
+                    print(f"已提交 {submitted} 条新消息 (队列待写入 {metrics['queue_depth']} 条, 累计新增 {metrics['inserted']} 条)")
+                    print(f"最近交付延迟: {watch['latency_ms']:.0f} ms, 解析耗时: 平均 {monitor.get_parse_metrics()['last_scan_ms']:.2f} ms/条")
+                else:
+                    print("最近30秒未发现新消息")
                 
         except KeyboardInterrupt:
             print("\n停止监控")
+        finally:
+            # 写完队列中剩余的消息再退出
+            writer.stop()
+            metrics = writer.get_metrics()
+            print(f"写入完成: 新增 {metrics['inserted']} 条, 重复 {metrics['skipped']} 条, 失败 {metrics['failed']} 条")
+
+def collect_daemon(chat_names, duration=None, metrics_interval=60, max_staleness=300):
+    """无人值守采集：按消息频率轮转采集多个聊天，不显示菜单"""
+    from src.db_handler import DatabaseHandler
+    from src.wx_monitor import WeChatMonitor
+    from src.message_writer import MessageWriter
+    from src.scheduler import ChatScheduler
+    
+    db = DatabaseHandler()
+    monitor = WeChatMonitor()
+    if not monitor.find_wechat():
+        print("未找到微信窗口，请确保微信已登录")
+        db.close()
+        return False
+    
+    writer = MessageWriter(db)
+    writer.start()
+    scheduler = ChatScheduler(monitor, db, writer, chat_names, max_staleness=max_staleness)
+    print(f"开始轮转采集 {len(chat_names)} 个聊天: {', '.join(chat_names)}，按 Ctrl+C 停止")
+    try:
+        scheduler.run(duration=duration, metrics_interval=metrics_interval)
+    except KeyboardInterrupt:
+        print("\n停止采集")
+    finally:
+        writer.stop()
+        scheduler.log_metrics()
+        metrics = writer.get_metrics()
+        print(f"写入完成: 新增 {metrics['inserted']} 条, 重复 {metrics['skipped']} 条, 失败 {metrics['failed']} 条")
+        db.close()
+    return True
 
 def analyze_data(analyzer, db, dict_manager):
     """数据分析功能"""
@@ -508,8 +553,11 @@ def export_data(analyzer, export_path=None):
             
         try:
             # 选择导出格式
-            format_type = input("\n请选择导出格式(1:CSV 2:JSON): ").strip()
-            format_type = 'csv' if format_type == '1' else 'json'
+            format_type = input("\n请选择导出格式(1:CSV 2:JSON 3:NDJSON 4:Parquet快照): ").strip()
+            format_type = {'1': 'csv', '3': 'ndjson', '4': 'parquet'}.get(format_type, 'json')
+            compression = None
+            if format_type != 'parquet':
+                compression = 'gzip' if input("是否gzip压缩(y/n): ").strip().lower() == 'y' else None
             
             # 使用配置的导出路径或默认路径
             output_path = export_path or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'exports')
@@ -518,14 +566,31 @@ def export_data(analyzer, export_path=None):
             # 获取时间范围
             start_time, end_time = get_time_range()
             
+            def show_progress(done, total):
+                print(f"\r已导出 {done}/{total} 条", end='', flush=True)
+            
             # 执行导出
-            analyzer.export_chat(
-                output_path,
-                start_time=start_time,
-                end_time=end_time,
-                format=format_type
-            )
-            print(f"\n数据已导出到: {output_path}")
+            original_export_path = analyzer.export_path
+            analyzer.export_path = output_path
+            try:
+                if format_type == 'parquet':
+                    # 快照目录可在分析时通过snapshot参数直接读取
+                    export_file = analyzer.export_snapshot(
+                        start_time=start_time,
+                        end_time=end_time,
+                        progress_callback=show_progress
+                    )
+                else:
+                    export_file = analyzer.export_chat(
+                        start_time=start_time,
+                        end_time=end_time,
+                        format=format_type,
+                        compression=compression,
+                        progress_callback=show_progress
+                    )
+            finally:
+                analyzer.export_path = original_export_path
+            print(f"\n数据已导出到: {export_file}")
                 
         except Exception as e:
             print(f"导出失败: {e}")
@@ -612,7 +677,7 @@ def clean_data(analyzer):
         
         input("\n按回车键继续...")
 
-def manage_dict(dict_manager, db):
+def manage_dict(dict_manager, db, segmenter=None):
     """词典管理功能"""
     while True:
         choice = show_dict_menu()
@@ -655,7 +720,7 @@ def manage_dict(dict_manager, db):
         elif choice == '4':
             # 更新词频
             print("正在从聊天记录计算词频...")
-            success, msg = dict_manager.update_frequencies(db)
+            success, msg = dict_manager.update_frequencies(db, segmenter=segmenter)
             print(msg)
             
         elif choice == '5':
@@ -746,21 +811,32 @@ def search_messages(analyzer):
     if end_time is not None:
         conditions['end_time'] = end_time.strftime('%Y-%m-%d %H:%M:%S')
     
-    # 执行搜索
-    results = analyzer.search_messages(conditions)
-    
-    if not results:
-        print("\n未找到匹配的聊天记录")
-        return
+    # 执行搜索，分页显示
+    page_size = 20
+    cursor = None
+    shown = 0
+    while True:
+        results, cursor = analyzer.search_messages_page(conditions, page_size=page_size, cursor=cursor)
         
-    print(f"\n找到 {len(results)} 条匹配记录：")
-    print("-" * 60)
-    
-    for msg in results:
-        time_str = msg['time'].split('.')[0]  # 移除毫秒部分
-        print(f"[{time_str}] {msg['chat_name']} - {msg['sender']}:")
-        print(f"    {msg['content']}")
+        if not results and shown == 0:
+            print("\n未找到匹配的聊天记录")
+            return
+            
+        print(f"\n第 {shown + 1}-{shown + len(results)} 条匹配记录：")
         print("-" * 60)
+        
+        for msg in results:
+            time_str = str(msg['time']).split('.')[0]  # 移除毫秒部分
+            print(f"[{time_str}] {msg['chat_name']} - {msg['sender']}:")
+            print(f"    {msg['snippet']}")
+            print("-" * 60)
+        shown += len(results)
+        
+        if cursor is None:
+            print(f"\n共找到 {shown} 条匹配记录")
+            return
+        if input("\n按回车查看下一页，输入q结束: ").strip().lower() == 'q':
+            return
 
 def get_time_range():
     """统一的时间范围选择函数"""
@@ -812,20 +888,22 @@ def manage_config(config):
     """配置管理功能"""
     while True:
         print("\n=== 配置选项 ===")
-        print(f"1. 最大滚动次数 (当前: {config['max_scroll']})")
+        print(f"1. 补采最大翻页数 (当前: {config['max_scroll']})")
         print(f"2. 导出文件默认路径 (当前: {config['export_path']})")
+        print(f"3. 分词进程数 (当前: {config['segment_workers'] or '自动'})")
+        print(f"4. 录制消息控件树 (当前: {config['record_path'] or '关闭'})")
         print("0. 返回主菜单")
         
-        choice = input("\n请选择(0-2): ")
+        choice = input("\n请选择(0-4): ")
         
         if choice == '0':
             break
             
         elif choice == '1':
-            scroll_input = input("请输入最大滚动次数: ").strip()
+            scroll_input = input("请输入补采最大翻页数: ").strip()
             if scroll_input.isdigit() and int(scroll_input) > 0:
                 config['max_scroll'] = int(scroll_input)
-                print(f"\n已更新最大滚动次数为: {config['max_scroll']}")
+                print(f"\n已更新补采最大翻页数为: {config['max_scroll']}")
             else:
                 print("\n输入无效，请输入正整数")
                 
@@ -838,19 +916,55 @@ def manage_config(config):
                     print(f"\n已更新导出路径为: {config['export_path']}")
                 except Exception as e:
                     print(f"\n路径设置失败: {e}")
+                    
+        elif choice == '3':
+            workers_input = input("请输入分词进程数(0表示按CPU核数自动设置): ").strip()
+            if workers_input.isdigit():
+                config['segment_workers'] = int(workers_input) or None
+                print(f"\n已更新分词进程数为: {config['segment_workers'] or '自动'}")
+            else:
+                print("\n输入无效，请输入非负整数")
+        
+        elif choice == '4':
+            record_path = input("请输入录制文件路径(.jsonl，直接回车关闭录制): ").strip()
+            config['record_path'] = record_path or None
+            print(f"\n已{'开启录制: ' + record_path if record_path else '关闭录制'}")
+
+def parse_args(argv=None):
+    """命令行参数，不带参数时进入交互菜单"""
+    parser = argparse.ArgumentParser(description='微信聊天记录分析工具')
+    subparsers = parser.add_subparsers(dest='command')
+    
+    collect_parser = subparsers.add_parser('collect', help='采集数据')
+    collect_parser.add_argument('--daemon', action='store_true', help='无人值守轮转采集，需要同时指定 --chats')
+    collect_parser.add_argument('--chats', help='要采集的聊天名称，用逗号分隔，如 a,b,c')
+    collect_parser.add_argument('--duration', type=float, help='采集时长（秒），默认一直采集')
+    collect_parser.add_argument('--metrics-interval', type=float, default=60, help='输出各聊天延迟统计的间隔（秒）')
+    collect_parser.add_argument('--max-staleness', type=float, default=300, help='每个聊天两次访问之间的最长间隔（秒）')
+    
+    args = parser.parse_args(argv)
+    if args.command == 'collect' and args.daemon:
+        args.chats = [name.strip() for name in (args.chats or '').split(',') if name.strip()]
+        if not args.chats:
+            parser.error('--daemon 需要通过 --chats 指定聊天名称')
+    return args
 
 def main():
     """主函数"""
-    # 延迟导入，提升启动速度
+    args = parse_args()
+    if args.command == 'collect' and args.daemon:
+        ok = collect_daemon(args.chats, args.duration, args.metrics_interval, args.max_staleness)
+        sys.exit(0 if ok else 1)
+    
+    # 延迟导入，提升启动速度：采集只需要数据库和微信监控，分析相关模块在首次使用时才导入
     from src.db_handler import DatabaseHandler
-    from src.wx_monitor import WeChatMonitor
-    from src.data_analyzer import DataAnalyzer
-    from src.dict_manager import DictManager
     
     # 初始化配置
     config = {
-        'max_scroll': 5,
-        'export_path': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'exports')
+        'max_scroll': 100,  # 补采历史消息时最多向上翻页的次数
+        'export_path': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'exports'),
+        'segment_workers': None,  # 分词进程数，None表示按CPU核数
+        'record_path': None  # 采集时录制消息控件树的JSONL文件，用于离线回放
     }
     
     # 懒加载组件
@@ -859,29 +973,40 @@ def main():
     analyzer = None
     dict_manager = None
     
-    def init_components():
-        """按需初始化组件"""
+    def init_components(choice):
+        """按菜单选项初始化需要的组件"""
         nonlocal db, monitor, analyzer, dict_manager
         if db is None:
             db = DatabaseHandler()
-        if monitor is None:
-            monitor = WeChatMonitor()
-            monitor.max_scroll = config['max_scroll']
+        if choice == '1':
+            if monitor is None:
+                from src.wx_monitor import WeChatMonitor
+                monitor = WeChatMonitor()
+                monitor.max_scroll = config['max_scroll']
+                if config['record_path']:
+                    monitor.start_recording(config['record_path'])
+            return
         if analyzer is None:
-            analyzer = DataAnalyzer(db)
-        if dict_manager is None:
+            from src.data_analyzer import DataAnalyzer
+            analyzer = DataAnalyzer(db, segment_workers=config['segment_workers'])
+        if dict_manager is None and choice in ['2', '5']:
+            from src.dict_manager import DictManager
             dict_manager = DictManager()
     
+    # collect 不带 --daemon 时直接进入交互采集
+    start_choice = '1' if args.command == 'collect' else None
+    
     while True:
         try:
-            choice = show_main_menu()
+            choice = start_choice or show_main_menu()
+            start_choice = None
             
             if choice == '0':
                 break
                 
             # 根据用户选择初始化需要的组件
             if choice in ['1', '2', '3', '4', '5', '6']:
-                init_components()
+                init_components(choice)
                 
                 if choice == '1':
                     # 检查微信窗口
@@ -896,13 +1021,20 @@ def main():
                 elif choice == '4':
                     clean_data(analyzer)
                 elif choice == '5':
-                    manage_dict(dict_manager, db)
+                    manage_dict(dict_manager, db, analyzer.segmenter)
                 elif choice == '6':
                     search_messages(analyzer)
             elif choice == '7':
                 manage_config(config)
                 if monitor:  # 如果监控器已初始化，更新其配置
                     monitor.max_scroll = config['max_scroll']
+                    if config['record_path']:
+                        monitor.start_recording(config['record_path'])
+                    else:
+                        monitor.stop_recording()
+                if analyzer:  # 分词进程数变化后下次使用时重新创建分析器
+                    analyzer.close()
+                    analyzer = None
             else:
                 print("无效的选择")
                 
@@ -911,7 +1043,12 @@ def main():
             print("请重试或选择其他功能")
             continue
     
+    if analyzer is not None:
+        analyzer.close()
+    if db is not None:
+        db.close()
     print("\n程序已退出")
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # 打包后分词子进程需要
     main() 
\ No newline at end of file
@@ -0,0 +1,170 @@
+import time
+import logging
+from src.wx_monitor import match_time
+
+class Backfill:
+    """向上翻页补采聊天记录，翻到已入库的历史为止
+
+    打开聊天后先解析当前屏幕，然后反复向上滚动：
+    - 滚动后不固定等待，而是轮询列表第一项的指纹，第一项变化并稳定后即开始解析，
+      超时仍无变化说明已到聊天开头
+    - 每页只解析列表开头新加载的项；新加载部分第一个时间分隔之前的项属于更早的时间段，
+      留到下一页与其时间分隔一起解析
+    - 每页解析完立即入库，页中有消息已经入库、或最早的消息不晚于库中最新消息时停止
+    """
+
+    def __init__(self, monitor, db, wheel_times=3, max_pages=100, change_timeout=2.0,
+                 poll_interval=0.05):
+        """
+        :param monitor: WeChatMonitor实例
+        :param db: DatabaseHandler实例
+        :param wheel_times: 每页滚动的滚轮格数
+        :param max_pages: 最多翻页数，防止异常情况下无限翻页
+        :param change_timeout: 滚动后等待列表变化的最长时间（秒）
+        :param poll_interval: 检查列表变化的间隔（秒）
+        """
+        self.monitor = monitor
+        self.db = db
+        self.wheel_times = wheel_times
+        self.max_pages = max_pages
+        self.change_timeout = change_timeout
+        self.poll_interval = poll_interval
+        self.logger = logging.getLogger(__name__)
+        self.last_stats = {}
+
+    def _first_key(self, message_list):
+        try:
+            first = message_list.GetFirstChildControl()
+        except Exception:
+            return None
+        return self.monitor.viewport.fingerprint(first) if first else None
+
+    def _wait_for_change(self, message_list, before):
+        """等待列表第一项变化并稳定
+
+        Returns:
+            bool: 列表是否有变化，超时无变化时为False
+        """
+        deadline = time.monotonic() + self.change_timeout
+        current = before
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            latest = self._first_key(message_list)
+            if latest != before and latest == current:
+                return True  # 已变化且连续两次相同，新内容加载完毕
+            current = latest
+        return current != before
+
+    def _new_items(self, children, keys, boundary, at_top):
+        """本页需要解析的列表项及新的边界
+
+        Args:
+            children: 当前全部列表项
+            keys: 对应的指纹
+            boundary: 已解析部分第一项的指纹，None表示还没有解析过
+            at_top: 是否已到聊天开头
+
+        Returns:
+            tuple: (需要解析的列表项, 新边界的指纹)
+        """
+        end = keys.index(boundary) if boundary in keys else len(children)
+        start = 0
+        if not at_top:
+            # 第一个时间分隔之前的项要等下一页加载出它们的时间后再解析
+            start = next(
+                (i for i in range(end) if children[i].Name and match_time(children[i].Name)),
+                end
+            )
+        if start == end:
+            return [], boundary
+        return children[start:end], keys[start]
+
+    def _parse_page(self, items):
+        """按顺序解析一页，过滤掉没有发送者或时间的项"""
+        self.monitor.last_time = None
+        messages = []
+        for item in items:
+            message = self.monitor._parse_message(item)
+            if message and message['send_time'] and message['sender_name'] and message['sender_name'].strip():
+                messages.append(message)
+        return messages
+
+    def run(self, chat_id, writer=None):
+        """补采当前打开的聊天
+
+        Args:
+            chat_id: 聊天ID
+            writer: 可选的MessageWriter，提供时每页提交到写入队列，否则直接批量写库
+
+        Returns:
+            datetime: 补采到的最新消息时间，没有补采到消息时为None
+        """
+        monitor = self.monitor
+        stats = {'pages': 0, 'messages': 0, 'new': 0, 'reason': None}
+        self.last_stats = stats
+        if not monitor.wx_window:
+            stats['reason'] = 'no_window'
+            return None
+        message_list = monitor.wx_window.ListControl(Name="消息")
+        if not message_list.Exists(maxSearchSeconds=2):
+            self.logger.warning("未找到消息列表")
+            stats['reason'] = 'no_list'
+            return None
+
+        stored_latest = self.db.get_last_message_time(chat_id)
+        newest = None
+        boundary = None
+        at_top = False
+        started = time.perf_counter()
+        monitor._scan_anchor = monitor.clock()
+        try:
+            while True:
+                children = message_list.GetChildren()
+                keys = [monitor.viewport.fingerprint(child) for child in children]
+                items, boundary = self._new_items(children, keys, boundary, at_top)
+                messages = self._parse_page(items)
+                if messages:
+                    stored = self.db.count_stored_messages(chat_id, messages)
+                    if writer:
+                        writer.put_many(chat_id, messages)
+                    else:
+                        self.db.save_messages(chat_id, messages)
+                    stats['messages'] += len(messages)
+                    stats['new'] += len(messages) - stored
+                    page_newest = max(message['send_time'] for message in messages)
+                    newest = page_newest if newest is None else max(newest, page_newest)
+
+                    if stored:
+                        stats['reason'] = 'overlap'
+                        break
+                    oldest = min(message['send_time'] for message in messages)
+                    if stored_latest and oldest <= stored_latest:
+                        stats['reason'] = 'reached_stored'
+                        break
+
+                if at_top:
+                    stats['reason'] = 'top'
+                    break
+                if stats['pages'] >= self.max_pages:
+                    stats['reason'] = 'max_pages'
+                    break
+
+                before = self._first_key(message_list)
+                message_list.WheelUp(wheelTimes=self.wheel_times)
+                stats['pages'] += 1
+                # 没有变化说明已到聊天开头，再解析一次剩下的项
+                at_top = not self._wait_for_change(message_list, before)
+        except Exception as e:
+            self.logger.error(f"补采聊天记录失败: {e}")
+            stats['reason'] = 'error'
+        finally:
+            monitor._scan_anchor = None
+            # 列表位置已经变化，下次扫描重新解析整屏
+            monitor.viewport.reset()
+
+        stats['seconds'] = time.perf_counter() - started
+        self.logger.info(
+            f"补采完成: 翻页 {stats['pages']} 次, 解析 {stats['messages']} 条消息 (新消息 {stats['new']} 条), "
+            f"耗时 {stats['seconds']:.1f}s, 停止原因: {stats['reason']}"
+        )
+        return newest
@@ -1,33 +1,39 @@
-import pandas as pd
 import json
 from datetime import datetime, timedelta
 import os
 import logging
 from collections import Counter
 import jieba
-import sqlite3
-import matplotlib.pyplot as plt
-from wordcloud import WordCloud
-import seaborn as sns
 from collections import defaultdict
-import jieba.analyse
-import numpy as np
-import networkx as nx
-import graphviz
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.decomposition import LatentDirichletAllocation
 import re
-from src.dict_manager import DictManager
+from src.db_handler import to_epoch_ms, from_epoch_ms
+from src.search_index import SearchIndex
+from src.token_store import TokenStore, normalize_text, extract_tags_from_tokens, textrank_from_tokens
+from src.segmenter import ParallelSegmenter
+from src.word_discovery import WordDiscovery
+from src.exporter import StreamingExporter
+from src.snapshot import ParquetSnapshot
+from src.result_cache import ResultCache
+from src.graph_renderer import MindMapGraph
 
-plt.rcParams['font.sans-serif'] = ['SimHei']  # 用来正常显示中文标签
-plt.rcParams['axes.unicode_minus'] = False  # 用来正常显示负号
+# pandas、numpy、matplotlib、wordcloud 等分析依赖在用到的方法内导入，
+# 采集、导出和搜索不需要加载整个分析栈
+
+def _pyplot():
+    """导入matplotlib并设置中文字体"""
+    import matplotlib.pyplot as plt
+    plt.rcParams['font.sans-serif'] = ['SimHei']  # 用来正常显示中文标签
+    plt.rcParams['axes.unicode_minus'] = False  # 用来正常显示负号
+    return plt
 
 class DataAnalyzer:
-    def __init__(self, db, export_path="exports"):
+    def __init__(self, db, export_path="exports", segment_workers=None, segment_chunk_size=500):
         """
         初始化数据分析器
         :param db: DatabaseHandler实例
         :param export_path: 导出文件路径
+        :param segment_workers: 分词进程数，默认为CPU核数，设为1时在当前进程分词
+        :param segment_chunk_size: 每个分词任务包含的消息条数
         """
         self.db = db
         self.export_path = export_path
@@ -36,12 +42,35 @@ class DataAnalyzer:
         # 设置日志
         self.logger = logging.getLogger(__name__)
         
-    def export_chat(self, chat_id=None, start_time=None, end_time=None, format='csv'):
-        """导出聊天记录"""
+        # 分词缓存，未命中的消息交给多进程分词
+        self.segmenter = None
+        if segment_workers != 1:
+            self.segmenter = ParallelSegmenter(workers=segment_workers, chunk_size=segment_chunk_size)
+        self.token_store = TokenStore(db, segmenter=self.segmenter)
+        
+        # 全文索引，与分词缓存使用同一版本的词典
+        self.search_index = SearchIndex(db, self.token_store)
+        
+        # 分析结果缓存，消息范围和词典都没有变化时直接返回上次的结果
+        self.result_cache = ResultCache(db, version_func=self.token_store.dict_version)
+    
+    def close(self):
+        """释放分词进程池"""
+        if self.segmenter:
+            self.segmenter.close()
+        
+    def export_chat(self, chat_id=None, start_time=None, end_time=None, format='csv',
+                    compression=None, progress_callback=None, chunk_size=5000):
+        """导出聊天记录
+        :param format: 'csv' / 'json' / 'ndjson'
+        :param compression: None / 'gzip' / 'zstd'
+        :param progress_callback: 进度回调 callback(已导出条数, 总条数)
+        :param chunk_size: 每批读取的条数，导出过程的内存占用与总条数无关
+        """
         # 确保导出目录存在
         os.makedirs(self.export_path, exist_ok=True)
         
-        conn = sqlite3.connect(self.db.db_path)
+        conn = self.db.get_connection()
         
         # 构建查询条件
         conditions = []
@@ -50,11 +79,11 @@ class DataAnalyzer:
             conditions.append("m.chat_id = ?")
             params.append(chat_id)
         if start_time:
-            conditions.append("m.send_time >= ?")
-            params.append(start_time)
+            conditions.append("m.send_ts >= ?")
+            params.append(to_epoch_ms(start_time))
         if end_time:
-            conditions.append("m.send_time <= ?")
-            params.append(end_time)
+            conditions.append("m.send_ts <= ?")
+            params.append(to_epoch_ms(end_time))
             
         where_clause = " AND ".join(conditions) if conditions else "1=1"
         
@@ -72,81 +101,101 @@ class DataAnalyzer:
         FROM messages m
         JOIN chats c ON m.chat_id = c.chat_id
         WHERE {where_clause}
-        ORDER BY m.send_time
+        ORDER BY m.send_ts
         """
         
+        columns = ['msg_id', 'chat_id', 'chat_name', 'chat_type', 'msg_type', 'content', 'sender_name', 'send_time']
+        
         try:
-            df = pd.read_sql_query(query, conn, params=params)
+            exporter = StreamingExporter(
+                chunk_size=chunk_size,
+                compression=compression,
+                progress_callback=progress_callback
+            )
+            
+            # 总条数从汇总表获取，只用于显示进度
+            total = None
+            if progress_callback:
+                rollup_sql, rollup_params = self.db.rollup_query(
+                    chat_id,
+                    to_epoch_ms(start_time) if start_time else None,
+                    to_epoch_ms(end_time) if end_time else None
+                )
+                total = conn.execute(
+                    f"SELECT COALESCE(SUM(msg_count), 0) FROM ({rollup_sql})", rollup_params
+                ).fetchone()[0]
             
             # 导出文件
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"chat_export_{timestamp}"
+            export_file = exporter.build_path(self.export_path, f"chat_export_{timestamp}", format)
             
-            if format == 'csv':
-                export_file = os.path.join(self.export_path, f"{filename}.csv")
-                df.to_csv(export_file, index=False, encoding='utf-8-sig')
-            else:
-                export_file = os.path.join(self.export_path, f"{filename}.json")
-                df.to_json(export_file, orient='records', force_ascii=False, indent=2)
-                
-            self.logger.info(f"导出完成: {export_file}")
+            cursor = conn.execute(query, params)
+            exporter.export(cursor, columns, export_file, format=format, total=total)
             return export_file
             
         except Exception as e:
             self.logger.error(f"导出失败: {e}")
             raise
         finally:
-            conn.close()
+            self.db.release_connection(conn)
     
-    def analyze_chat(self, chat_id=None, days=30):
-        """分析聊天记录"""
-        conn = sqlite3.connect(self.db.db_path)
+    def analyze_chat(self, chat_id=None, days=30, reply_gap=None):
+        """分析聊天记录
+        :param chat_id: 聊天ID，为None时分析所有聊天
+        :param days: 分析最近多少天
+        :param reply_gap: 回复关系的最大时间间隔（秒），为None时不限制
+        """
+        conn = self.db.get_connection()
         cursor = conn.cursor()
         
         start_time = datetime.now() - timedelta(days=days)
         
         # 基础查询条件
-        conditions = ["send_time >= ?"]
-        params = [start_time]
+        conditions = ["send_ts >= ?"]
+        params = [to_epoch_ms(start_time)]
         if chat_id:
             conditions.append("chat_id = ?")
             params.append(chat_id)
             
         where_clause = " AND ".join(conditions)
         
+        # 计数类统计从小时汇总表读取
+        rollup_sql, rollup_params = self.db.rollup_query(chat_id, params[0])
+        rollup = f"WITH rollup AS ({rollup_sql})"
+        
         # 1. 消息统计
         cursor.execute(f"""
+        {rollup}
         SELECT 
-            COUNT(*) as total_messages,
-            COUNT(DISTINCT sender_name) as unique_senders,
-            COUNT(DISTINCT date(send_time)) as active_days,
-            AVG(LENGTH(content)) as avg_length
-        FROM messages
-        WHERE {where_clause}
-        """, params)
+            COALESCE(SUM(msg_count), 0) as total_messages,
+            COUNT(DISTINCT NULLIF(sender_name, '')) as unique_senders,
+            COUNT(DISTINCT day) as active_days,
+            CAST(SUM(content_length) AS REAL) / SUM(msg_count) as avg_length
+        FROM rollup
+        """, rollup_params)
         
         stats = dict(zip(['total_messages', 'unique_senders', 'active_days', 'avg_length'], 
                         cursor.fetchone()))
         
         # 2. 活跃用户排名
         cursor.execute(f"""
-        SELECT sender_name, COUNT(*) as msg_count
-        FROM messages
-        WHERE {where_clause}
+        {rollup}
+        SELECT sender_name, SUM(msg_count) as msg_count
+        FROM rollup
         GROUP BY sender_name
         ORDER BY msg_count DESC
         LIMIT 10
-        """, params)
+        """, rollup_params)
         
         active_users = [dict(zip(['name', 'count'], row)) for row in cursor.fetchall()]
         
         # 3. 消息类型分布
         cursor.execute(f"""
-        SELECT msg_type, COUNT(*) as type_count
-        FROM messages
-        WHERE {where_clause}
+        {rollup}
+        SELECT msg_type, SUM(msg_count) as type_count
+        FROM rollup
         GROUP BY msg_type
-        """, params)
+        """, rollup_params)
         
         msg_types = {
             1: '文本',
@@ -159,80 +208,84 @@ class DataAnalyzer:
         
         # 4. 关键词提取（仅处理文本消息）
         cursor.execute(f"""
-        SELECT content
+        SELECT msg_id, content
         FROM messages
         WHERE {where_clause} AND msg_type = 1
         """, params)
         
-        all_text = ' '.join(row[0] for row in cursor.fetchall() if row[0])
-        words = jieba.cut(all_text)
-        word_count = Counter(w for w in words if len(w) > 1)
+        word_count = Counter(
+            w for tokens in self.token_store.iter_tokens(cursor.fetchall())
+            for w in tokens if len(w) > 1
+        )
         top_keywords = dict(word_count.most_common(20))
         
         # 5. 时间分布
         cursor.execute(f"""
-        SELECT strftime('%H', send_time) as hour, COUNT(*) as count
-        FROM messages
-        WHERE {where_clause}
+        {rollup}
+        SELECT printf('%02d', hour) as hour_label, SUM(msg_count) as count
+        FROM rollup
         GROUP BY hour
         ORDER BY hour
-        """, params)
+        """, rollup_params)
         
         time_dist = dict(cursor.fetchall())
         
         # 新增：每日消息趋势
         cursor.execute(f"""
-        SELECT date(send_time) as date, COUNT(*) as count
-        FROM messages
-        WHERE {where_clause}
-        GROUP BY date
-        ORDER BY date
-        """, params)
+        {rollup}
+        SELECT day, SUM(msg_count) as count
+        FROM rollup
+        GROUP BY day
+        ORDER BY day
+        """, rollup_params)
         daily_trend = dict(cursor.fetchall())
         
         # 新增：互动分析（回复关系）
+        # 按(chat_id, send_ts)顺序扫描一遍，用LAG取同一会话中的上一条消息
+        gap_ms = reply_gap * 1000 if reply_gap is not None else None
         cursor.execute(f"""
-        SELECT m1.sender_name as from_user, 
-               m2.sender_name as to_user,
-               COUNT(*) as interaction_count
-        FROM messages m1
-        JOIN messages m2 ON m2.msg_id = (
-            SELECT msg_id 
-            FROM messages 
-            WHERE send_time > m1.send_time 
-            AND chat_id = m1.chat_id
-            LIMIT 1
+        WITH ordered AS (
+            SELECT sender_name,
+                   send_ts,
+                   LAG(sender_name) OVER w as prev_sender,
+                   LAG(send_ts) OVER w as prev_ts
+            FROM messages
+            WHERE {where_clause}
+            WINDOW w AS (PARTITION BY chat_id ORDER BY send_ts, rowid)
         )
-        WHERE {where_clause.replace('send_time', 'm1.send_time')}
+        SELECT prev_sender as from_user, 
+               sender_name as to_user,
+               COUNT(*) as interaction_count
+        FROM ordered
+        WHERE prev_sender IS NOT NULL
+        AND (? IS NULL OR send_ts - prev_ts <= ?)
         GROUP BY from_user, to_user
         HAVING interaction_count >= 5
         ORDER BY interaction_count DESC
         LIMIT 20
-        """, params)
+        """, params + [gap_ms, gap_ms])
         interactions = [dict(zip(['from_user', 'to_user', 'count'], row)) 
                        for row in cursor.fetchall()]
         
         # 新增：消息长度分布
         cursor.execute(f"""
-        SELECT 
-            CASE 
-                WHEN LENGTH(content) <= 10 THEN '短消息(≤10)'
-                WHEN LENGTH(content) <= 50 THEN '中等(11-50)'
-                WHEN LENGTH(content) <= 200 THEN '长消息(51-200)'
-                ELSE '超长消息(>200)'
-            END as length_category,
-            COUNT(*) as count
-        FROM messages
-        WHERE {where_clause} AND msg_type = 1
-        GROUP BY length_category
-        ORDER BY count DESC
-        """, params)
-        length_dist = dict(cursor.fetchall())
+        {rollup}
+        SELECT SUM(len_short), SUM(len_medium), SUM(len_long), SUM(len_xlong)
+        FROM rollup
+        WHERE msg_type = 1
+        """, rollup_params)
+        length_labels = ['短消息(≤10)', '中等(11-50)', '长消息(51-200)', '超长消息(>200)']
+        length_dist = dict(sorted(
+            ((label, count) for label, count in zip(length_labels, cursor.fetchone()) if count),
+            key=lambda x: x[1],
+            reverse=True
+        ))
         
         # 新增：每周活跃度分析
         cursor.execute(f"""
+        {rollup}
         SELECT 
-            CASE strftime('%w', send_time)
+            CASE strftime('%w', day)
                 WHEN '0' THEN '周日'
                 WHEN '1' THEN '周一'
                 WHEN '2' THEN '周二'
@@ -241,12 +294,11 @@ class DataAnalyzer:
                 WHEN '5' THEN '周五'
                 WHEN '6' THEN '周六'
             END as weekday,
-            COUNT(*) as count
-        FROM messages
-        WHERE {where_clause}
+            SUM(msg_count) as count
+        FROM rollup
         GROUP BY weekday
-        ORDER BY strftime('%w', send_time)
-        """, params)
+        ORDER BY strftime('%w', day)
+        """, rollup_params)
         weekly_activity = dict(cursor.fetchall())
         
         # 新增：表情符号使用统计
@@ -280,15 +332,15 @@ class DataAnalyzer:
     
     def clean_data(self, before_date=None, chat_id=None):
         """清理聊天记录"""
-        conn = sqlite3.connect(self.db.db_path)
+        conn = self.db.get_connection()
         cursor = conn.cursor()
         
         conditions = []
         params = []
         
         if before_date:
-            conditions.append("send_time < ?")
-            params.append(before_date)
+            conditions.append("send_ts < ?")
+            params.append(to_epoch_ms(before_date))
         if chat_id:
             conditions.append("chat_id = ?")
             params.append(chat_id)
@@ -300,7 +352,7 @@ class DataAnalyzer:
             cursor.execute(f"SELECT COUNT(*) FROM messages WHERE {where_clause}", params)
             count = cursor.fetchone()[0]
             
-            # 删除消息
+            # 删除消息，汇总表、全文索引和分词缓存由messages表上的删除触发器同步
             cursor.execute(f"DELETE FROM messages WHERE {where_clause}", params)
             
             # 清理无关联消息的chat记录
@@ -323,11 +375,11 @@ class DataAnalyzer:
             conn.rollback()
             return 0
         finally:
-            conn.close() 
+            self.db.release_connection(conn) 
     
     def query_messages(self, chat_id=None, start_time=None, end_time=None, limit=100):
         """查询聊天记录"""
-        conn = sqlite3.connect(self.db.db_path)
+        conn = self.db.get_connection()
         cursor = conn.cursor()
         
         conditions = []
@@ -337,11 +389,11 @@ class DataAnalyzer:
             conditions.append("m.chat_id = ?")
             params.append(chat_id)
         if start_time:
-            conditions.append("m.send_time >= ?")
-            params.append(start_time)
+            conditions.append("m.send_ts >= ?")
+            params.append(to_epoch_ms(start_time))
         if end_time:
-            conditions.append("m.send_time <= ?")
-            params.append(end_time)
+            conditions.append("m.send_ts <= ?")
+            params.append(to_epoch_ms(end_time))
             
         where_clause = " AND ".join(conditions) if conditions else "1=1"
         
@@ -352,11 +404,11 @@ class DataAnalyzer:
             m.msg_type,
             m.content,
             m.sender_name,
-            m.send_time
+            m.send_ts
         FROM messages m
         JOIN chats c ON m.chat_id = c.chat_id
         WHERE {where_clause}
-        ORDER BY m.send_time DESC
+        ORDER BY m.send_ts DESC
         LIMIT ?
         """
         params.append(limit)
@@ -366,23 +418,9 @@ class DataAnalyzer:
             messages = []
             for row in cursor.fetchall():
                 try:
-                    # 尝试多种时间格式
-                    time_formats = [
-                        '%Y-%m-%d %H:%M:%S.%f',  # 带微秒
-                        '%Y-%m-%d %H:%M:%S',     # 不带微秒
-                        '%Y-%m-%d %H:%M'         # 只有分钟
-                    ]
-                    
-                    send_time = None
-                    for time_format in time_formats:
-                        try:
-                            send_time = datetime.strptime(row[5], time_format)
-                            break
-                        except ValueError:
-                            continue
-                    
+                    send_time = from_epoch_ms(row[5])
                     if send_time is None:
-                        self.logger.warning(f"无法解析时间格式: {row[5]}")
+                        self.logger.warning(f"消息缺少send_ts: {row[0]}")
                         continue
                     
                     messages.append({
@@ -403,11 +441,11 @@ class DataAnalyzer:
             self.logger.error(f"查询消息失败: {e}")
             raise
         finally:
-            conn.close()
+            self.db.release_connection(conn)
     
     def get_all_chats(self):
         """获取所有聊天对象"""
-        conn = sqlite3.connect(self.db.db_path)
+        conn = self.db.get_connection()
         cursor = conn.cursor()
         
         try:
@@ -431,11 +469,11 @@ class DataAnalyzer:
                 })
             return chats
         finally:
-            conn.close() 
+            self.db.release_connection(conn) 
     
     def get_basic_stats(self):
         """获取基础统计信息"""
-        conn = sqlite3.connect(self.db.db_path)
+        conn = self.db.get_connection()
         cursor = conn.cursor()
         
         try:
@@ -443,13 +481,16 @@ class DataAnalyzer:
             cursor.execute("SELECT COUNT(*) FROM chats")
             chat_count = cursor.fetchone()[0]
             
-            # 获取总消息数
-            cursor.execute("SELECT COUNT(*) FROM messages")
-            message_count = cursor.fetchone()[0]
+            # 从汇总表获取总消息数和活跃用户数（不重复的sender_name）
+            def compute():
+                rollup_sql, rollup_params = self.db.rollup_query()
+                cursor.execute(f"""
+                SELECT COALESCE(SUM(msg_count), 0), COUNT(DISTINCT NULLIF(sender_name, ''))
+                FROM ({rollup_sql})
+                """, rollup_params)
+                return cursor.fetchone()
             
-            # 获取活跃用户数（不重复的sender_name）
-            cursor.execute("SELECT COUNT(DISTINCT sender_name) FROM messages")
-            user_count = cursor.fetchone()[0]
+            message_count, user_count = self.result_cache.get('basic_stats', compute)
             
             return {
                 'chat_count': chat_count,
@@ -465,16 +506,16 @@ class DataAnalyzer:
                 'user_count': 0
             }
         finally:
-            conn.close() 
+            self.db.release_connection(conn) 
     
     def query_by_time(self, start_date=None, end_date=None):
         """按时间范围查询信息"""
-        conn = sqlite3.connect(self.db.db_path)
+        conn = self.db.get_connection()
         cursor = conn.cursor()
         
         try:
             query = """
-            SELECT m.msg_id, m.sender_name, m.content, m.send_time, m.msg_type, c.chat_name
+            SELECT m.msg_id, m.sender_name, m.content, m.send_ts, m.msg_type, c.chat_name
             FROM messages m
             JOIN chats c ON m.chat_id = c.chat_id
             WHERE 1=1
@@ -486,8 +527,8 @@ class DataAnalyzer:
                     start_time = datetime.strptime(start_date, '%Y-%m-%d')
                     # 设置为当天的开时刻
                     start_time = start_time.replace(hour=0, minute=0, second=0, microsecond=0)
-                    query += " AND m.send_time >= ?"
-                    params.append(start_time.strftime('%Y-%m-%d %H:%M:%S.%f'))
+                    query += " AND m.send_ts >= ?"
+                    params.append(to_epoch_ms(start_time))
                 except ValueError:
                     raise ValueError("开始日期格式错误，请使用YYYY-MM-DD格式")
                     
@@ -496,25 +537,20 @@ class DataAnalyzer:
                     end_time = datetime.strptime(end_date, '%Y-%m-%d')
                     # 设置为当天的最后一刻
                     end_time = end_time.replace(hour=23, minute=59, second=59, microsecond=999999)
-                    query += " AND m.send_time <= ?"
-                    params.append(end_time.strftime('%Y-%m-%d %H:%M:%S.%f'))
+                    query += " AND m.send_ts <= ?"
+                    params.append(to_epoch_ms(end_time))
                 except ValueError:
                     raise ValueError("结束日期格式错误，请使用YYYY-MM-DD格式")
                     
-            query += " ORDER BY m.send_time DESC"
+            query += " ORDER BY m.send_ts DESC"
             
             cursor.execute(query, params)
             messages = []
             for row in cursor.fetchall():
-                try:
-                    send_time = datetime.strptime(row[3], '%Y-%m-%d %H:%M:%S.%f')
-                except ValueError:
-                    # 如果时间格式不匹配尝试其他常见格式
-                    try:
-                        send_time = datetime.strptime(row[3], '%Y-%m-%d %H:%M:%S')
-                    except ValueError:
-                        self.logger.warning(f"无法解析时间格式: {row[3]}")
-                        continue
+                send_time = from_epoch_ms(row[3])
+                if send_time is None:
+                    self.logger.warning(f"消息缺少send_ts: {row[0]}")
+                    continue
                     
                 messages.append({
                     'msg_id': row[0],
@@ -531,7 +567,7 @@ class DataAnalyzer:
             self.logger.error(f"按时间范围查询消息失败: {e}")
             raise
         finally:
-            conn.close() 
+            self.db.release_connection(conn) 
     
     def query_by_chat(self, chat_id, limit=100):
         """按聊天ID查询消息"""
@@ -548,7 +584,7 @@ class DataAnalyzer:
             self.logger.error(f"按聊天ID查询消息失败: {e}")
             raise 
     
-    def export_all(self, export_path, is_csv=True):
+    def export_all(self, export_path, is_csv=True, compression=None, progress_callback=None):
         """导出所有聊天记录"""
         try:
             # 设置并创建导出路径
@@ -561,7 +597,9 @@ class DataAnalyzer:
                 chat_id=None,
                 start_time=None,
                 end_time=None,
-                format='csv' if is_csv else 'json'
+                format='csv' if is_csv else 'json',
+                compression=compression,
+                progress_callback=progress_callback
             )
             
             # 恢复原始导出路径
@@ -572,7 +610,7 @@ class DataAnalyzer:
             self.logger.error(f"导出所有数据失败: {e}")
             raise
     
-    def export_by_time(self, export_path, start_date, end_date, is_csv=True):
+    def export_by_time(self, export_path, start_date, end_date, is_csv=True, compression=None, progress_callback=None):
         """按时间范围导出聊天记录"""
         try:
             # 设置并创建导出路径
@@ -589,7 +627,9 @@ class DataAnalyzer:
                 chat_id=None,
                 start_time=start_time,
                 end_time=end_time,
-                format='csv' if is_csv else 'json'
+                format='csv' if is_csv else 'json',
+                compression=compression,
+                progress_callback=progress_callback
             )
             
             # 恢复原始导出路径
@@ -600,7 +640,7 @@ class DataAnalyzer:
             self.logger.error(f"按时间范围导出数据失败: {e}")
             raise
     
-    def export_by_chat(self, export_path, chat_id, is_csv=True):
+    def export_by_chat(self, export_path, chat_id, is_csv=True, compression=None, progress_callback=None):
         """按聊天ID导出记录"""
         try:
             # 设置并创建导出路径
@@ -613,7 +653,9 @@ class DataAnalyzer:
                 chat_id=chat_id,
                 start_time=None,
                 end_time=None,
-                format='csv' if is_csv else 'json'
+                format='csv' if is_csv else 'json',
+                compression=compression,
+                progress_callback=progress_callback
             )
             
             # 恢复原始导出路径
@@ -624,53 +666,196 @@ class DataAnalyzer:
             self.logger.error(f"导出指定聊天记录失败: {e}")
             raise 
     
-    def analyze_and_visualize(self, chat_id=None, start_time=None, end_time=None, output_dir=None):
-        """分析可视化聊天数据"""
+    def export_snapshot(self, chat_id=None, start_time=None, end_time=None, output_dir=None,
+                        progress_callback=None, chunk_size=50000):
+        """导出按chat_id和月份分区的Parquet快照，供 load_frame 和离线分析使用
+        
+        Returns:
+            str: 快照目录
+        """
+        if output_dir is None:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            output_dir = os.path.join(self.export_path, f"chat_snapshot_{timestamp}")
+        
+        conditions = []
+        params = []
+        if chat_id:
+            conditions.append("m.chat_id = ?")
+            params.append(chat_id)
+        if start_time:
+            conditions.append("m.send_ts >= ?")
+            params.append(to_epoch_ms(start_time))
+        if end_time:
+            conditions.append("m.send_ts <= ?")
+            params.append(to_epoch_ms(end_time))
+        query = ParquetSnapshot.QUERY + ''.join(f" AND {c}" for c in conditions)
+        
+        conn = self.db.get_connection()
+        try:
+            cursor = conn.execute(query, params)
+            ParquetSnapshot(output_dir).write(cursor, chunk_size=chunk_size, progress_callback=progress_callback)
+            return output_dir
+        except Exception as e:
+            self.logger.error(f"导出Parquet快照失败: {e}")
+            raise
+        finally:
+            self.db.release_connection(conn)
+    
+    def load_frame(self, snapshot_dir, chat_id=None, start_time=None, end_time=None, columns=None):
+        """以内存映射方式读取Parquet快照，返回与数据库查询结构一致的DataFrame
+        
+        sender_name 和 chat_name 为category类型，send_time 为datetime64类型。
+        """
+        return ParquetSnapshot(snapshot_dir).read(
+            chat_id=chat_id,
+            start_ts=to_epoch_ms(start_time) if start_time else None,
+            end_ts=to_epoch_ms(end_time) if end_time else None,
+            columns=columns
+        )
+    
+    def _rollup_from_frame(self, messages):
+        """由消息明细计算与 _load_rollup 相同维度的汇总数据（不含bucket_ts），用于快照分析"""
+        import pandas as pd
+        lengths = messages['content'].str.len()
+        frame = pd.DataFrame({
+            'chat_id': messages['chat_id'].astype(str),
+            'day': messages['send_time'].dt.strftime('%Y-%m-%d'),
+            'hour': messages['send_time'].dt.hour,
+            'sender_name': messages['sender_name'].astype(object).fillna(''),
+            'msg_type': messages['msg_type'].fillna(0).astype(int),
+            'msg_count': 1,
+            'content_length': lengths.fillna(0).astype(int),
+            'len_short': (lengths <= 10).astype(int),
+            'len_medium': ((lengths > 10) & (lengths <= 50)).astype(int),
+            'len_long': ((lengths > 50) & (lengths <= 200)).astype(int),
+            'len_xlong': ~(lengths <= 200),
+        })
+        frame['len_xlong'] = frame['len_xlong'].astype(int)
+        return frame.groupby(
+            ['chat_id', 'day', 'hour', 'sender_name', 'msg_type'], as_index=False
+        ).sum()
+    
+    def _read_messages_frame(self, chat_id=None, start_time=None, end_time=None):
+        """按时间顺序读取消息明细为DataFrame，附带会话名称、类型和send_time列"""
+        import pandas as pd
+        start_ts = to_epoch_ms(start_time) if start_time else None
+        end_ts = to_epoch_ms(end_time) if end_time else None
+        params = [chat_id, chat_id, start_ts, start_ts, end_ts, end_ts]
+        
+        query = """
+            SELECT 
+                m.msg_id,
+                m.chat_id,
+                m.sender_name,
+                m.content,
+                m.msg_type,
+                m.send_ts,
+                c.chat_name,
+                c.chat_type
+            FROM messages m
+            JOIN chats c ON m.chat_id = c.chat_id
+            WHERE (? IS NULL OR m.chat_id = ?)
+            AND (? IS NULL OR m.send_ts >= ?)
+            AND (? IS NULL OR m.send_ts <= ?)
+            ORDER BY m.send_ts
+        """
+        
+        conn = self.db.get_connection()
+        try:
+            messages = pd.read_sql_query(query, conn, params=params)
+        finally:
+            self.db.release_connection(conn)
+        
+        if messages.empty:
+            raise ValueError("未找到符合条件的消息记录")
+        
+        # 转换时间列
+        messages['send_time'] = pd.to_datetime(messages['send_ts'], unit='ms')
+        return messages
+    
+    def _iter_text_rows(self, chat_id=None, start_time=None, end_time=None, batch_size=5000):
+        """分批读取文本消息的 (msg_id, content)，供分词缓存流式处理"""
+        conditions = ["msg_type = 1"]
+        params = []
+        if chat_id:
+            conditions.append("chat_id = ?")
+            params.append(chat_id)
+        if start_time:
+            conditions.append("send_ts >= ?")
+            params.append(to_epoch_ms(start_time))
+        if end_time:
+            conditions.append("send_ts <= ?")
+            params.append(to_epoch_ms(end_time))
+        
+        conn = self.db.get_connection()
+        try:
+            cursor = conn.execute(
+                f"SELECT msg_id, content FROM messages WHERE {' AND '.join(conditions)}",
+                params
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            self.db.release_connection(conn)
+    
+    def _load_rollup(self, chat_id=None, start_time=None, end_time=None):
+        """读取指定范围内的小时汇总数据，列见 message_rollup 表"""
+        import pandas as pd
+        start_ts = to_epoch_ms(start_time) if start_time else None
+        end_ts = to_epoch_ms(end_time) if end_time else None
+        rollup_sql, params = self.db.rollup_query(chat_id, start_ts, end_ts)
+        
+        conn = self.db.get_connection()
+        try:
+            return pd.read_sql_query(rollup_sql, conn, params=params)
+        finally:
+            self.db.release_connection(conn)
+    
+    def _cache_range(self, start_time, end_time):
+        """结果缓存使用的时间范围"""
+        return (
+            to_epoch_ms(start_time) if start_time else None,
+            to_epoch_ms(end_time) if end_time else None
+        )
+    
+    def analyze_and_visualize(self, chat_id=None, start_time=None, end_time=None, output_dir=None, snapshot=None):
+        """分析可视化聊天数据
+        :param snapshot: Parquet快照目录，指定时只读取快照，不访问数据库
+        """
+        if snapshot:
+            return self._analyze_and_visualize(chat_id, start_time, end_time, output_dir, snapshot)
+        
+        # 消息没有变化且图表仍在时不重新绘制
+        start_ts, end_ts = self._cache_range(start_time, end_time)
+        return self.result_cache.get(
+            'analyze_and_visualize',
+            lambda: self._analyze_and_visualize(chat_id, start_time, end_time, output_dir),
+            chat_id, start_ts, end_ts,
+            extra=output_dir,
+            validate=lambda path: path is None or os.path.isdir(path)
+        )
+    
+    def _analyze_and_visualize(self, chat_id=None, start_time=None, end_time=None, output_dir=None, snapshot=None):
+        """分析可视化聊天数据的实际计算"""
+        plt = _pyplot()
         try:
             if output_dir:
                 os.makedirs(output_dir, exist_ok=True)
             
-            # 构建查询参数
-            params = [chat_id, chat_id]
-            if start_time:
-                params.extend([start_time.strftime('%Y-%m-%d %H:%M:%S'), start_time.strftime('%Y-%m-%d %H:%M:%S')])
-            else:
-                params.extend([None, None])
-            if end_time:
-                params.extend([end_time.strftime('%Y-%m-%d %H:%M:%S'), end_time.strftime('%Y-%m-%d %H:%M:%S')])
+            if snapshot:
+                messages = self.load_frame(snapshot, chat_id, start_time, end_time)
+                if messages.empty:
+                    raise ValueError("未找到符合条件的消息记录")
+                rollup = self._rollup_from_frame(messages)
             else:
-                params.extend([None, None])
-            
-            conn = sqlite3.connect(self.db.db_path)
-            query = """
-                SELECT 
-                    m.msg_id,
-                    m.chat_id,
-                    m.sender_name,
-                    m.content,
-                    m.msg_type,
-                    strftime('%Y-%m-%d %H:%M:%S', m.send_time) as send_time,
-                    c.chat_name,
-                    c.chat_type
-                FROM messages m
-                JOIN chats c ON m.chat_id = c.chat_id
-                WHERE (? IS NULL OR m.chat_id = ?)
-                AND (? IS NULL OR m.send_time >= ?)
-                AND (? IS NULL OR m.send_time <= ?)
-                ORDER BY m.send_time
-            """
-            
-            messages = pd.read_sql_query(query, conn, params=params)
-            conn.close()
-            
-            if messages.empty:
-                raise ValueError("未找到符合条件的消息记录")
-            
-            # 转换时间列
-            messages['send_time'] = pd.to_datetime(messages['send_time'], format='%Y-%m-%d %H:%M:%S')
+                messages = self._read_messages_frame(chat_id, start_time, end_time)
+                rollup = self._load_rollup(chat_id, start_time, end_time)
             
             # 1. 时间维度分析
-            self._analyze_time_patterns(messages, output_dir)
+            self._analyze_time_patterns(rollup, output_dir)
             
             # 2. 用户维度分析
             self._analyze_user_patterns(messages, output_dir)
@@ -689,16 +874,20 @@ class DataAnalyzer:
             self.logger.error(f"分析可视化失败: {str(e)}")
             raise ValueError(f"分析失败: {str(e)}")
     
-    def _analyze_time_patterns(self, messages, output_dir):
-        """分析时间模式"""
+    def _analyze_time_patterns(self, rollup, output_dir):
+        """分析时间模式
+        :param rollup: _load_rollup 返回的小时汇总数据
+        """
+        import pandas as pd
+        import numpy as np
+        plt = _pyplot()
         try:
-            # 转换为numpy数组进行处理
-            messages_np = messages.to_numpy()
-            times = pd.to_datetime(messages_np[:, messages.columns.get_loc('send_time')])
+            rollup = rollup.dropna(subset=['day'])
+            counts = rollup['msg_count'].to_numpy()
             
             # 1. 按小时统计
-            hours = np.array([t.hour for t in times])
-            hour_counts = np.bincount(hours, minlength=24)
+            hours = rollup['hour'].to_numpy().astype(int)
+            hour_counts = np.bincount(hours, weights=counts, minlength=24)
             
             plt.figure(figsize=(12, 6))
             plt.bar(np.arange(24), hour_counts)
@@ -709,9 +898,10 @@ class DataAnalyzer:
             plt.savefig(os.path.join(output_dir, 'hourly_dist.png'))
             plt.close()
             
-            # 2. 按星期统计
-            weekdays = np.array([t.weekday() for t in times])
-            weekday_counts = np.bincount(weekdays, minlength=7)
+            # 2. 按星期统计（day固定为YYYY-MM-DD，指定格式避免逐行推断）
+            days = pd.to_datetime(rollup['day'], format='%Y-%m-%d')
+            weekdays = days.dt.weekday.to_numpy()
+            weekday_counts = np.bincount(weekdays, weights=counts, minlength=7)
             weekday_labels = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
             
             plt.figure(figsize=(10, 6))
@@ -723,9 +913,9 @@ class DataAnalyzer:
             plt.close()
             
             # 3. 按日期统计
-            dates = np.array([t.date() for t in times])
-            unique_dates = np.unique(dates)
-            date_counts = np.array([np.sum(dates == d) for d in unique_dates])
+            date_series = rollup['msg_count'].groupby(days.to_numpy()).sum()
+            unique_dates = date_series.index.to_numpy()
+            date_counts = date_series.to_numpy()
             
             plt.figure(figsize=(15, 6))
             plt.plot(unique_dates, date_counts)
@@ -743,17 +933,13 @@ class DataAnalyzer:
     
     def _analyze_user_patterns(self, messages, output_dir):
         """分析用户模式"""
+        plt = _pyplot()
         try:
-            # 转换为numpy数组
-            messages_np = messages.to_numpy()
-            senders = messages_np[:, messages.columns.get_loc('sender_name')]
-            
-            # 1. 用户发言频率
-            unique_senders, sender_counts = np.unique(senders, return_counts=True)
-            sort_idx = np.argsort(sender_counts)[::-1]
+            # 1. 用户发言频率（哈希计数，不需要对发送者排序）
+            sender_counts = messages['sender_name'].value_counts().head(10)
             
             plt.figure(figsize=(12, 6))
-            plt.bar(unique_senders[sort_idx][:10], sender_counts[sort_idx][:10])
+            plt.bar(sender_counts.index.astype(str), sender_counts.to_numpy())
             plt.title('用户发言频率（前10名）')
             plt.xticks(rotation=45, ha='right')
             plt.tight_layout()
@@ -766,25 +952,23 @@ class DataAnalyzer:
     
     def _analyze_content_patterns(self, messages, output_dir):
         """分析内容模式"""
+        plt = _pyplot()
         try:
-            # 转换为numpy数组
-            messages_np = messages.to_numpy()
-            contents = messages_np[:, messages.columns.get_loc('content')]
-            msg_types = messages_np[:, messages.columns.get_loc('msg_type')]
-            
             # 1. 消息类型分布
-            unique_types, type_counts = np.unique(msg_types, return_counts=True)
+            type_series = messages['msg_type'].dropna().astype(int).value_counts().sort_index()
+            unique_types = type_series.index.to_numpy()
+            type_counts = type_series.to_numpy()
             type_labels = ['文本', '图片', '语音', '视频', '文件', '其他']
             
             plt.figure(figsize=(8, 8))
-            plt.pie(type_counts, labels=[type_labels[t-1] if t-1 < len(type_labels) else '其他' for t in unique_types],
+            plt.pie(type_counts, labels=[type_labels[t-1] if 0 < t <= len(type_labels) else '其他' for t in unique_types],
                     autopct='%1.1f%%')
             plt.title('消息类型分布')
             plt.savefig(os.path.join(output_dir, 'msg_types.png'))
             plt.close()
             
-            # 2. 文本长度分布
-            text_lengths = np.array([len(str(c)) for c in contents if isinstance(c, str)])
+            # 2. 文本长度分布（非字符串内容的长度为NaN，直接丢弃）
+            text_lengths = messages['content'].str.len().dropna().to_numpy()
             
             plt.figure(figsize=(10, 6))
             plt.hist(text_lengths, bins=30)
@@ -800,6 +984,7 @@ class DataAnalyzer:
     
     def _analyze_group_patterns(self, messages, output_dir):
         """分析群组维度模式"""
+        plt = _pyplot()
         # 1. 群成员活跃度变化
         daily_user_counts = messages.groupby([messages['send_time'].dt.date, 'sender_name']).size().unstack(fill_value=0)
         plt.figure(figsize=(15, 8))
@@ -812,111 +997,125 @@ class DataAnalyzer:
         plt.savefig(os.path.join(output_dir, 'group_activity.png'))
         plt.close() 
     
-    def custom_analyze(self, dimensions, chat_id=None, start_time=None, end_time=None):
-        """自定义分析"""
+    def _interaction_counts(self, senders, reply_window=1):
+        """统计用户互动次数
+        
+        每条消息与它前面reply_window条消息的发送者各记一次互动（同一条消息对同一个人只记一次），
+        发送者对按名字排序后合并，自己和自己不算互动。
+        
+        Args:
+            senders: 按时间排序的发送者Series
+            reply_window: 回看的消息条数
+        
+        Returns:
+            Series: 以(用户A, 用户B)为索引的互动次数，按次数降序
+        """
+        import pandas as pd
+        import numpy as np
+        current = senders.reset_index(drop=True)
+        pairs = []
+        for lag in range(1, max(1, reply_window) + 1):
+            previous = current.shift(lag)
+            mask = (current.notna() & previous.notna() & (current != previous)).to_numpy()
+            cur = current.to_numpy()[mask]
+            prev = previous.to_numpy()[mask]
+            swap = cur > prev
+            pairs.append(pd.DataFrame({
+                'msg': np.flatnonzero(mask),
+                'first': np.where(swap, prev, cur),
+                'second': np.where(swap, cur, prev),
+            }))
+        
+        pairs = pd.concat(pairs, ignore_index=True)
+        if reply_window > 1:
+            pairs = pairs.drop_duplicates()
+        return pairs.groupby(['first', 'second']).size().sort_values(ascending=False, kind='mergesort')
+    
+    def custom_analyze(self, dimensions, chat_id=None, start_time=None, end_time=None, snapshot=None,
+                       reply_window=1):
+        """自定义分析
+        
+        时间、用户和消息类型统计来自小时汇总表，关键词和群组互动才需要读取消息明细。
+        指定snapshot（Parquet快照目录）时所有数据都从快照读取，不访问数据库。
+        :param reply_window: 群组互动统计时，每条消息与前面多少条消息的发送者计为互动
+        """
+        import pandas as pd
         try:
-            conn = sqlite3.connect(self.db.db_path)
-            
-            # 优化SQL查询，避免重复列名
-            query = """
-                SELECT 
-                    m.msg_id,
-                    m.chat_id,
-                    m.sender_name,
-                    m.content,
-                    m.msg_type,
-                    m.send_time,
-                    c.chat_name,
-                    c.chat_type
-                FROM messages m
-                JOIN chats c ON m.chat_id = c.chat_id
-                WHERE (? IS NULL OR m.chat_id = ?)
-                AND (? IS NULL OR m.send_time >= ?)
-                AND (? IS NULL OR m.send_time <= ?)
-                ORDER BY m.send_time
-            """
-            
-            params = [
-                chat_id, chat_id,
-                start_time.strftime('%Y-%m-%d %H:%M:%S') if start_time else None,
-                start_time.strftime('%Y-%m-%d %H:%M:%S') if start_time else None,
-                end_time.strftime('%Y-%m-%d %H:%M:%S') if end_time else None,
-                end_time.strftime('%Y-%m-%d %H:%M:%S') if end_time else None
-            ]
-            
-            messages = pd.read_sql_query(query, conn, params=params)
-            conn.close()
-            
-            if messages.empty:
+            snapshot_messages = None
+            if snapshot:
+                snapshot_messages = self.load_frame(snapshot, chat_id, start_time, end_time)
+                rollup = self._rollup_from_frame(snapshot_messages)
+            else:
+                rollup = self._load_rollup(chat_id, start_time, end_time)
+            if rollup.empty:
                 raise ValueError("未找到符合条件的消息记录")
-            
-            # 转换时间列
-            messages['send_time'] = pd.to_datetime(messages['send_time'])
+            total = rollup['msg_count'].sum()
             results = {}
             
             # 时间维度分析
             if '1' in dimensions:
-                daily_counts = messages.groupby(messages['send_time'].dt.date).size()
-                hourly_counts = messages.groupby(messages['send_time'].dt.hour).size()
-                weekday_counts = messages['send_time'].dt.dayofweek.value_counts()
+                timed = rollup.dropna(subset=['day'])
+                daily_counts = timed.groupby('day')['msg_count'].sum()
+                hourly_counts = timed.groupby(timed['hour'].astype(int))['msg_count'].sum()
+                weekday_counts = timed.groupby(pd.to_datetime(timed['day']).dt.dayofweek)['msg_count'].sum()
                 
                 results['time'] = {
                     'daily_avg': daily_counts.mean(),
                     'peak_hour': hourly_counts.idxmax(),
                     'lowest_hour': hourly_counts.idxmin(),
-                    'weekday_ratio': weekday_counts[weekday_counts.index < 5].sum() / len(messages),
-                    'weekend_ratio': weekday_counts[weekday_counts.index >= 5].sum() / len(messages)
+                    'weekday_ratio': weekday_counts[weekday_counts.index < 5].sum() / total,
+                    'weekend_ratio': weekday_counts[weekday_counts.index >= 5].sum() / total
                 }
             
             # 用户维度分析
             if '2' in dimensions:
-                user_counts = messages.groupby('sender_name').size()
+                user_counts = rollup[rollup['sender_name'] != ''].groupby('sender_name')['msg_count'].sum()
                 results['user'] = {
                     'top_users': [{'name': name, 'count': int(count)} 
                                  for name, count in user_counts.nlargest(5).items()],
-                    'avg_messages': float(len(messages) / user_counts.size)
+                    'avg_messages': float(total / user_counts.size)
                 }
             
             # 内容维度分析
             if '3' in dimensions:
-                type_counts = messages['msg_type'].value_counts()
-                text = ' '.join(messages[messages['msg_type'] == 1]['content'].astype(str))
-                keywords = jieba.analyse.extract_tags(text, topK=10, withWeight=True)
+                type_counts = rollup.groupby('msg_type')['msg_count'].sum()
+                if snapshot_messages is not None:
+                    # 快照模式下直接分词，不使用数据库中的分词缓存
+                    texts = snapshot_messages.loc[snapshot_messages['msg_type'] == 1, 'content'].astype(str)
+                    token_lists = (self.token_store.segment(text) for text in texts)
+                else:
+                    token_lists = self.token_store.iter_tokens(
+                        self._iter_text_rows(chat_id, start_time, end_time)
+                    )
+                keywords = extract_tags_from_tokens(token_lists, top_k=10, with_weight=True)
                 
                 results['content'] = {
-                    'type_ratio': {str(k): float(v/len(messages)) for k, v in type_counts.items()},
+                    'type_ratio': {str(k): float(v/total) for k, v in type_counts.items()},
                     'keywords': [(word, float(weight)) for word, weight in keywords]
                 }
             
-            # 群组维度分析
+            # 群组维度分析（需要按时间顺序的消息明细）
             if '4' in dimensions and chat_id:
-                active_users = messages['sender_name'].unique()
+                if snapshot_messages is not None:
+                    messages = snapshot_messages
+                else:
+                    messages = self._read_messages_frame(chat_id, start_time, end_time)
+                sender_counts = messages['sender_name'].value_counts()
                 
                 # 计算用户互动
-                interactions = defaultdict(int)
-                prev_msg = None
-                for _, msg in messages.iterrows():
-                    if prev_msg is not None:
-                        pair = tuple(sorted([prev_msg['sender_name'], msg['sender_name']]))
-                        if pair[0] != pair[1]:  # 排除自己和自己动
-                            interactions[pair] += 1
-                    prev_msg = msg
-                
-                top_interactions = sorted(
-                    [{'users': f"{pair[0]}-{pair[1]}", 'count': count}
-                     for pair, count in interactions.items()],
-                    key=lambda x: x['count'],
-                    reverse=True
-                )[:5]
+                interactions = self._interaction_counts(messages['sender_name'], reply_window)
+                top_interactions = [
+                    {'users': f"{first}-{second}", 'count': int(count)}
+                    for (first, second), count in interactions.head(5).items()
+                ]
                 
                 time_range = (messages['send_time'].max() - messages['send_time'].min()).total_seconds() / 86400
                 if time_range == 0:
                     time_range = 1  # 避免除以零
                 
                 results['group'] = {
-                    'member_count': int(len(active_users)),
-                    'active_member_count': int(len([u for u in active_users 
-                        if len(messages[messages['sender_name'] == u]) > 5])),
+                    'member_count': int((sender_counts > 0).sum()),
+                    'active_member_count': int((sender_counts > 5).sum()),
                     'activity_score': float(len(messages) / time_range),
                     'top_interactions': top_interactions
                 }
@@ -928,55 +1127,20 @@ class DataAnalyzer:
             raise ValueError(f"分析失败: {str(e)}") 
     
     def generate_mind_map(self, chat_id=None, start_time=None, end_time=None, output_dir=None):
-        """生成聊天内容思维导图"""
+        """生成聊天内容思维导图，消息和词典没有变化时直接返回上次生成的图片"""
+        start_ts, end_ts = self._cache_range(start_time, end_time)
+        return self.result_cache.get(
+            'generate_mind_map',
+            lambda: self._generate_mind_map(chat_id, start_time, end_time, output_dir),
+            chat_id, start_ts, end_ts,
+            extra=output_dir,
+            validate=os.path.exists
+        )
+    
+    def _generate_mind_map(self, chat_id=None, start_time=None, end_time=None, output_dir=None):
+        """生成思维导图的实际计算"""
+        from src.dict_manager import DictManager
         try:
-            # 检查Graphviz是否可用
-            try:
-                import graphviz
-                # 测试dot命令是否可用
-                test_graph = graphviz.Digraph()
-                test_graph.node('test', 'test')
-                try:
-                    test_graph.render('test', format='png', cleanup=True)
-                    if os.path.exists('test.png'):
-                        os.remove('test.png')  # 清理测试文件
-                except Exception as e:
-                    # 如果默认路径不可用，尝试常见的安装路径
-                    common_paths = [
-                        r'C:\Program Files\Graphviz\bin',
-                        r'C:\Program Files (x86)\Graphviz\bin',
-                        r'C:\Graphviz\bin'
-                    ]
-                    
-                    graphviz_found = False
-                    original_path = os.environ.get("PATH", "")
-                    
-                    for path in common_paths:
-                        if os.path.exists(os.path.join(path, 'dot.exe')):
-                            os.environ["PATH"] = path + os.pathsep + original_path
-                            try:
-                                test_graph.render('test', format='png', cleanup=True)
-                                if os.path.exists('test.png'):
-                                    os.remove('test.png')
-                                graphviz_found = True
-                                self.logger.info(f"找到Graphviz路径: {path}")
-                                break
-                            except:
-                                continue
-                    
-                    if not graphviz_found:
-                        raise ValueError(
-                            "Graphviz未正确安装或未添加到系统PATH中。\n"
-                            "请按照以下步骤检查：\n"
-                            "1. 确认Graphviz已正确安装: https://graphviz.org/download/\n"
-                            "2. 检查系统环境变量PATH中是否包含Graphviz的bin目录\n"
-                            "3. 重启电脑后重试\n"
-                            "4. 如果问题仍然存在，请手动将Graphviz安装目录添加到PATH中"
-                        )
-                    
-            except ImportError:
-                raise ValueError("请先安装graphviz包：pip install graphviz")
-            
             if output_dir:
                 os.makedirs(output_dir, exist_ok=True)
             else:
@@ -989,25 +1153,20 @@ class DataAnalyzer:
             if not messages:
                 raise ValueError("未找到符合条件的消息记录")
             
-            # 加载并验证自定义词典
+            # 验证自定义词典，分词缓存会按词典版本自动加载
             dict_manager = DictManager()
             valid, msg = dict_manager.validate_dict()
-            if valid:
-                jieba.load_userdict(dict_manager.dict_path)
-                self.logger.info("已加载自定义词典")
-            else:
-                self.logger.warning(f"加载自定义词典失败: {msg}")
+            if not valid:
+                self.logger.warning(f"自定义词典格式有误: {msg}")
             
-            # 提取所有文本内容并预处理
+            # 提取所有文本内容并预处理（移除URL、表情符号等）
+            text_rows = []
             texts = []
             for msg in messages:
-                if msg['content'] and isinstance(msg['content'], str):
-                    # 移除URL、表情符号等
-                    text = re.sub(r'http[s]?://\S+', '', msg['content'])
-                    text = re.sub(r'\[.*?\]', '', text)
-                    text = text.strip()
-                    if text:
-                        texts.append(text)
+                text = normalize_text(msg['content'])
+                if text:
+                    text_rows.append((msg['msg_id'], msg['content']))
+                    texts.append(text)
             
             if not texts:
                 raise ValueError("没有可分析的文本内容")
@@ -1019,10 +1178,10 @@ class DataAnalyzer:
             self._update_custom_dict(texts, dict_manager)
             
             # 3. 使用多种算法提取关键词
-            keywords = self._extract_keywords_multi_algorithm(texts)
+            keywords = self._extract_keywords_multi_algorithm(text_rows)
             
             # 创建思维导图
-            dot = graphviz.Digraph(comment='Chat Content Mind Map', encoding='utf-8')
+            dot = MindMapGraph(comment='Chat Content Mind Map')
             dot.attr(rankdir='TB')
             
             # 设置节点和边的样式
@@ -1067,10 +1226,8 @@ class DataAnalyzer:
                 output_dir = "analysis_results"
             os.makedirs(output_dir, exist_ok=True)
             
-            output_path = os.path.join(output_dir, 'mind_map')
-            dot.render(output_path, format='png', cleanup=True)
-            
-            return f"{output_path}.png"
+            # 没有Graphviz时输出进程内布局的SVG和DOT源文件
+            return dot.render(os.path.join(output_dir, 'mind_map'), format='png')
             
         except Exception as e:
             self.logger.error(f"生成思维导图失败: {str(e)}")
@@ -1103,46 +1260,27 @@ class DataAnalyzer:
             self.logger.error(f"提取高频短语失败: {str(e)}")
             return {}
     
-    def _update_custom_dict(self, texts, dict_manager):
-        """动态更新自定义词典"""
+    def _update_custom_dict(self, texts, dict_manager, max_new_words=50):
+        """动态更新自定义词典：用频数、凝固度和左右熵发现新词，一次性写入词典"""
         try:
-            # 1. 统计词频
-            word_freq = defaultdict(int)
-            for text in texts:
-                words = jieba.cut(text)
-                for word in words:
-                    word_freq[word] += 1
-            
-            # 2. 使用统计信息识别新词
-            new_words = set()
-            for i in range(len(texts)):
-                for j in range(i+1, len(texts)):
-                    common_substrings = self._find_common_substrings(texts[i], texts[j])
-                    for substr in common_substrings:
-                        if len(substr) >= 2 and word_freq[substr] >= 3:
-                            new_words.add(substr)
+            # 1. 统计n-gram并筛选候选新词
+            candidates = WordDiscovery().fit(texts).candidates(top_k=max_new_words)
             
-            # 3. 更新词典
-            for word in new_words:
-                if not dict_manager.has_word(word):
-                    dict_manager.add_word(word, word_freq[word])
+            # 2. 批量更新词典
+            added = dict_manager.add_words([(c['word'], c['freq']) for c in candidates])
+            if added:
+                self.logger.info(f"自定义词典新增 {added} 个新词")
             
         except Exception as e:
             self.logger.error(f"更新自定义词典失败: {str(e)}")
     
-    def _extract_keywords_multi_algorithm(self, texts, top_k=20):
-        """使用多种算法提取关键词"""
+    def _extract_keywords_multi_algorithm(self, text_rows, top_k=20):
+        """使用多种算法提取关键词
+        :param text_rows: (msg_id, content) 列表，分词和词性取自分词缓存
+        """
         try:
-            # 1. 预处理文本
-            processed_texts = []
-            for text in texts:
-                # 移除特殊字符和标点
-                text = re.sub(r'[^\u4e00-\u9fa5a-zA-Z0-9]', ' ', text)
-                text = re.sub(r'\s+', ' ', text).strip()
-                if text:
-                    processed_texts.append(text)
-            
-            combined_text = '\n'.join(processed_texts)
+            # 1. 取出缓存的词性标注，标点等非词内容由词性过滤掉
+            pos_lists = self.token_store.get_tokens(text_rows, with_pos=True)
             
             # 定义要保留的词性
             valid_pos = {
@@ -1157,27 +1295,26 @@ class DataAnalyzer:
             
             # 2. 使用多种分词算法
             # 2.1 TF-IDF
-            tfidf_keywords = set(jieba.analyse.extract_tags(
-                combined_text,
-                topK=top_k * 2,
-                withWeight=True,
-                allowPOS=tuple(valid_pos)  # 只允许特定词性
+            tfidf_keywords = set(extract_tags_from_tokens(
+                pos_lists,
+                top_k=top_k * 2,
+                with_weight=True,
+                allow_pos=tuple(valid_pos)  # 只允许特定词性
             ))
             
             # 2.2 TextRank
-            textrank_keywords = set(jieba.analyse.textrank(
-                combined_text,
-                topK=top_k * 2,
-                withWeight=True,
-                allowPOS=tuple(valid_pos)  # 只允许特定词性
+            textrank_keywords = set(textrank_from_tokens(
+                pos_lists,
+                top_k=top_k * 2,
+                with_weight=True,
+                allow_pos=tuple(valid_pos)  # 只允许特定词性
             ))
             
             # 2.3 基于词频和词性的分析
             words_with_flags = []
-            for text in processed_texts:
+            for pairs in pos_lists:
                 # 只保留指定词性的词
-                words = jieba.posseg.cut(text)
-                words_with_flags.extend([(word, flag) for word, flag in words if flag in valid_pos])
+                words_with_flags.extend([(word, flag) for word, flag in pairs if flag in valid_pos])
             
             # 统计词频和词性
             word_stats = defaultdict(lambda: {'freq': 0, 'pos': defaultdict(int)})
@@ -1244,16 +1381,6 @@ class DataAnalyzer:
             self.logger.error(f"计算上下文相关性失败: {str(e)}")
             return 0
     
-    def _find_common_substrings(self, str1, str2, min_length=2):
-        """查找两个字符串的公共子串"""
-        common = set()
-        for i in range(len(str1)-min_length+1):
-            for j in range(i+min_length, len(str1)+1):
-                substr = str1[i:j]
-                if substr in str2 and len(substr) >= min_length:
-                    common.add(substr)
-        return common
-    
     def _get_high_freq_words(self, texts, top_k=20):
         """获取高频词"""
         word_freq = defaultdict(int)
@@ -1289,55 +1416,64 @@ class DataAnalyzer:
         :param chat_id: 指定聊天对象的ID
         :return: 预览信息字典
         """
-        conn = sqlite3.connect(self.db.db_path)
+        conn = self.db.get_connection()
         cursor = conn.cursor()
         
         conditions = []
         params = []
         
+        before_ts = to_epoch_ms(before_date) if before_date else None
         if before_date:
-            conditions.append("m.send_time < ?")
-            params.append(before_date)
+            conditions.append("send_ts < ?")
+            params.append(before_ts)
         if chat_id:
-            conditions.append("m.chat_id = ?")
+            conditions.append("chat_id = ?")
             params.append(chat_id)
             
         where_clause = " AND ".join(conditions) if conditions else "1=1"
         
+        # 删除条件为 send_ts < before_ts，对应汇总范围的结束时间为 before_ts - 1
+        rollup_sql, rollup_params = self.db.rollup_query(
+            chat_id, end_ts=before_ts - 1 if before_ts is not None else None
+        )
+        
         try:
-            # 获取基本统计信息
+            # 获取基本统计信息，数量来自汇总表，最早/最晚时间走send_ts索引
             cursor.execute(f"""
                 SELECT 
-                    COUNT(*) as msg_count,
-                    MIN(m.send_time) as earliest_time,
-                    MAX(m.send_time) as latest_time,
-                    COUNT(DISTINCT m.chat_id) as chat_count,
-                    COUNT(DISTINCT m.sender_name) as user_count
-                FROM messages m
-                WHERE {where_clause}
-            """, params)
+                    COALESCE(SUM(msg_count), 0) as msg_count,
+                    COUNT(DISTINCT chat_id) as chat_count,
+                    COUNT(DISTINCT NULLIF(sender_name, '')) as user_count
+                FROM ({rollup_sql})
+            """, rollup_params)
             
             stats = cursor.fetchone()
             
+            cursor.execute(f"SELECT MIN(send_ts) FROM messages WHERE {where_clause}", params)
+            earliest_ts = cursor.fetchone()[0]
+            cursor.execute(f"SELECT MAX(send_ts) FROM messages WHERE {where_clause}", params)
+            latest_ts = cursor.fetchone()[0]
+            
             # 获取涉及的聊天对象信息
             cursor.execute(f"""
-                SELECT DISTINCT 
+                SELECT 
                     c.chat_name,
-                    COUNT(*) as count
-                FROM messages m
-                JOIN chats c ON m.chat_id = c.chat_id
-                WHERE {where_clause}
+                    SUM(r.msg_count) as count
+                FROM ({rollup_sql}) r
+                JOIN chats c ON r.chat_id = c.chat_id
                 GROUP BY c.chat_name
-            """, params)
+            """, rollup_params)
             
             chats = cursor.fetchall()
             
+            earliest_time = from_epoch_ms(earliest_ts)
+            latest_time = from_epoch_ms(latest_ts)
             return {
                 'msg_count': stats[0],
-                'earliest_time': stats[1],
-                'latest_time': stats[2],
-                'chat_count': stats[3],
-                'user_count': stats[4],
+                'earliest_time': earliest_time.strftime('%Y-%m-%d %H:%M:%S') if earliest_time else None,
+                'latest_time': latest_time.strftime('%Y-%m-%d %H:%M:%S') if latest_time else None,
+                'chat_count': stats[1],
+                'user_count': stats[2],
                 'chats': [{'name': chat[0], 'count': chat[1]} for chat in chats]
             }
             
@@ -1345,12 +1481,12 @@ class DataAnalyzer:
             self.logger.error(f"预览清理数据失败: {e}")
             raise
         finally:
-            conn.close() 
+            self.db.release_connection(conn) 
     
     def _get_messages(self, chat_id=None, start_time=None, end_time=None):
         """获取聊天记录"""
         try:
-            conn = sqlite3.connect(self.db.db_path)
+            conn = self.db.get_connection()
             
             # 构建查询条件
             conditions = []
@@ -1361,18 +1497,12 @@ class DataAnalyzer:
                 params.append(chat_id)
                 
             if start_time:
-                conditions.append("m.send_time >= ?")
-                if isinstance(start_time, datetime):
-                    params.append(start_time.strftime('%Y-%m-%d %H:%M:%S'))
-                else:
-                    params.append(start_time)
+                conditions.append("m.send_ts >= ?")
+                params.append(to_epoch_ms(start_time))
                     
             if end_time:
-                conditions.append("m.send_time <= ?")
-                if isinstance(end_time, datetime):
-                    params.append(end_time.strftime('%Y-%m-%d %H:%M:%S'))
-                else:
-                    params.append(end_time)
+                conditions.append("m.send_ts <= ?")
+                params.append(to_epoch_ms(end_time))
             
             # 构建WHERE子句
             where_clause = " AND ".join(conditions) if conditions else "1=1"
@@ -1382,13 +1512,13 @@ class DataAnalyzer:
                     m.msg_id,
                     m.sender_name,
                     m.content,
-                    m.send_time,
+                    m.send_ts,
                     m.msg_type,
                     c.chat_name
                 FROM messages m
                 JOIN chats c ON m.chat_id = c.chat_id
                 WHERE {where_clause}
-                ORDER BY m.send_time
+                ORDER BY m.send_ts
             """
             
             cursor = conn.cursor()
@@ -1397,38 +1527,9 @@ class DataAnalyzer:
             
             for row in cursor.fetchall():
                 try:
-                    # 尝试解析时间
-                    send_time = None
-                    time_str = row[3]
-                    
-                    # 标准化时间字符串格式
-                    time_str = time_str.replace('/', '-')  # 将斜杠替换为横杠
-                    
-                    # 处理年份缩写
-                    if len(time_str) >= 2 and time_str[2] == '-':  # 如果年份是缩写格式(如 24-12-18)
-                        time_str = '20' + time_str  # 添加世纪前缀
-                    
-                    # 支持更多时间格式
-                    time_formats = [
-                        '%Y-%m-%d %H:%M:%S.%f',  # 2024-12-18 09:09:00.000
-                        '%Y-%m-%d %H:%M:%S',     # 2024-12-18 09:09:00
-                        '%Y-%m-%d %H:%M',        # 2024-12-18 09:09
-                        '%Y-%m-%d %H:%M:%S',     # 2024/12/18 09:09:00
-                        '%Y-%m-%d %H:%M',        # 2024/12/18 09:09
-                        '%Y-%m-%d %I:%M %p'      # 2024-12-18 09:09 AM/PM
-                    ]
-                    
-                    # 尝试所有可能的时间格式
-                    for fmt in time_formats:
-                        try:
-                            send_time = datetime.strptime(time_str, fmt)
-                            break
-                        except ValueError:
-                            continue
-                    
+                    send_time = from_epoch_ms(row[3])
                     if send_time is None:
-                        self.logger.warning(f"无法解析时间格式: {row[3]} -> {time_str}")
-                        # 如果无法解析，跳过该消息
+                        self.logger.warning(f"消息缺少send_ts: {row[0]}")
                         continue
                     
                     messages.append({
@@ -1441,7 +1542,7 @@ class DataAnalyzer:
                     })
                     
                 except Exception as e:
-                    self.logger.warning(f"处理消息记录失败: {str(e)}, 原始时间: {row[3]}")
+                    self.logger.warning(f"处理消息记录失败: {str(e)}, send_ts: {row[3]}")
                     continue
                 
             return messages
@@ -1459,7 +1560,7 @@ class DataAnalyzer:
         Returns:
             str: 聊天名称
         """
-        conn = sqlite3.connect(self.db.db_path)
+        conn = self.db.get_connection()
         cursor = conn.cursor()
         
         try:
@@ -1470,73 +1571,141 @@ class DataAnalyzer:
             self.logger.error(f"获取聊天名称失败: {e}")
             return "未知聊天"
         finally:
-            conn.close() 
+            self.db.release_connection(conn) 
     
-    def search_messages(self, conditions=None):
-        """搜索聊天记录"""
-        conn = sqlite3.connect(self.db.db_path)
-        cursor = conn.cursor()
+    def search_messages(self, conditions=None, limit=None):
+        """搜索聊天记录，逐页取出全部匹配结果
+        :param conditions: 搜索条件，见search_messages_page
+        :param limit: 最多返回条数，None表示不限制
+        """
+        results = []
+        cursor = None
+        while True:
+            page_size = 500 if limit is None else min(500, limit - len(results))
+            page, cursor = self.search_messages_page(conditions, page_size=page_size, cursor=cursor)
+            results.extend(page)
+            if cursor is None or (limit is not None and len(results) >= limit):
+                return results
+    
+    def search_messages_page(self, conditions=None, page_size=50, cursor=None):
+        """分页搜索聊天记录
         
+        有关键词或@提及时走全文索引，按bm25相关度排序并返回高亮摘要；
+        否则按时间倒序。分页使用键集游标，翻页代价与页码无关。
+        
+        Args:
+            conditions: 搜索条件字典，可包含 keyword/mention/sender/chat_name/start_time/end_time
+            page_size: 每页条数
+            cursor: 上一页返回的游标，None表示第一页
+            
+        Returns:
+            tuple: (结果列表, 下一页游标)，没有更多结果时游标为None
+        """
+        conditions = conditions or {}
         where_clauses = []
         params = []
+        match_terms = []
         
-        if conditions:
-            if 'sender' in conditions:
-                where_clauses.append("m.sender_name LIKE ?")
-                params.append(f"%{conditions['sender']}%")
-                
-            if 'keyword' in conditions:
+        if 'sender' in conditions:
+            where_clauses.append("m.sender_name LIKE ?")
+            params.append(f"%{conditions['sender']}%")
+            
+        if 'keyword' in conditions:
+            match_query = self.search_index.build_match_query(conditions['keyword'])
+            if match_query:
+                match_terms.append(match_query)
+            else:
+                # 纯符号等无法分词的关键词退回模糊匹配
                 where_clauses.append("m.content LIKE ?")
                 params.append(f"%{conditions['keyword']}%")
-                
-            if 'mention' in conditions:
-                where_clauses.append("m.content LIKE ?")
-                params.append(f"%@{conditions['mention']}%")
-                
-            if 'start_time' in conditions:
-                where_clauses.append("m.send_time >= ?")
-                params.append(conditions['start_time'])
-                
-            if 'end_time' in conditions:
-                where_clauses.append("m.send_time <= ?")
-                params.append(conditions['end_time'])
-                
-            if 'chat_name' in conditions:
-                where_clauses.append("c.chat_name LIKE ?")
-                params.append(f"%{conditions['chat_name']}%")
+            
+        if 'mention' in conditions:
+            match_query = self.search_index.build_match_query(conditions['mention'])
+            if match_query:
+                match_terms.append(match_query)
+            # 索引只能定位包含该名字的消息，再确认前面带@
+            where_clauses.append("m.content LIKE ?")
+            params.append(f"%@{conditions['mention']}%")
+            
+        if 'start_time' in conditions:
+            where_clauses.append("m.send_ts >= ?")
+            params.append(to_epoch_ms(conditions['start_time']))
+            
+        if 'end_time' in conditions:
+            where_clauses.append("m.send_ts <= ?")
+            params.append(to_epoch_ms(conditions['end_time']))
+            
+        if 'chat_name' in conditions:
+            where_clauses.append("c.chat_name LIKE ?")
+            params.append(f"%{conditions['chat_name']}%")
+        
+        if match_terms:
+            self.search_index.sync()
+            from_clause = """messages_fts f
+                JOIN messages m ON m.rowid = f.rowid
+                LEFT JOIN chats c ON m.chat_id = c.chat_id"""
+            where_clauses.insert(0, "messages_fts MATCH ?")
+            params.insert(0, ' '.join(match_terms))
+            # bm25越小越相关
+            sort_key = "bm25(messages_fts)"
+            snippet = "snippet(messages_fts, 0, '【', '】', '…', 16)"
+            order_by = f"{sort_key}, m.rowid"
+            if cursor:
+                where_clauses.append(f"({sort_key} > ? OR ({sort_key} = ? AND m.rowid > ?))")
+                params.extend([cursor[0], cursor[0], cursor[1]])
+        else:
+            from_clause = """messages m
+                LEFT JOIN chats c ON m.chat_id = c.chat_id"""
+            sort_key = "COALESCE(m.send_ts, 0)"
+            snippet = "NULL"
+            order_by = f"{sort_key} DESC, m.rowid DESC"
+            if cursor:
+                where_clauses.append(f"({sort_key} < ? OR ({sort_key} = ? AND m.rowid < ?))")
+                params.extend([cursor[0], cursor[0], cursor[1]])
         
         where_clause = " AND ".join(where_clauses) if where_clauses else "1=1"
         
+        conn = self.db.get_connection()
+        db_cursor = conn.cursor()
+        
         try:
-            cursor.execute(f"""
-                SELECT m.msg_id, m.chat_id, c.chat_name, m.sender_name, m.content, m.send_time, m.msg_type
-                FROM messages m
-                LEFT JOIN chats c ON m.chat_id = c.chat_id
+            # 多取一条判断是否还有下一页
+            db_cursor.execute(f"""
+                SELECT m.msg_id, m.chat_id, c.chat_name, m.sender_name, m.content, m.send_time, m.msg_type,
+                       {snippet}, {sort_key}, m.rowid
+                FROM {from_clause}
                 WHERE {where_clause}
-                ORDER BY m.send_time DESC
-                LIMIT 1000
-            """, params)
-            
-            results = cursor.fetchall()
-            return [{
+                ORDER BY {order_by}
+                LIMIT ?
+            """, params + [page_size + 1])
+            
+            rows = db_cursor.fetchall()
+            has_more = len(rows) > page_size
+            rows = rows[:page_size]
+            results = [{
                 'msg_id': row[0],
                 'chat_id': row[1],
                 'chat_name': row[2],
                 'sender': row[3],
                 'content': row[4],
                 'time': row[5],
-                'type': row[6]
-            } for row in results]
+                'type': row[6],
+                'snippet': SearchIndex.clean_snippet(row[7]) if row[7] is not None else row[4],
+                'score': row[8] if match_terms else None
+            } for row in rows]
+            
+            next_cursor = (rows[-1][8], rows[-1][9]) if has_more and rows else None
+            return results, next_cursor
             
         except Exception as e:
             self.logger.error(f"搜索消息失败: {e}")
-            return []
+            return [], None
         finally:
-            conn.close() 
+            self.db.release_connection(conn) 
     
     def get_all_senders(self):
         """获取所有去重后的发送者列表"""
-        conn = sqlite3.connect(self.db.db_path)
+        conn = self.db.get_connection()
         cursor = conn.cursor()
         
         try:
@@ -1549,11 +1718,11 @@ class DataAnalyzer:
             """)
             return [row[0] for row in cursor.fetchall()]
         finally:
-            conn.close() 
+            self.db.release_connection(conn) 
     
     def get_all_mentions(self):
         """获取所有被@提及的用户列表"""
-        conn = sqlite3.connect(self.db.db_path)
+        conn = self.db.get_connection()
         cursor = conn.cursor()
         
         try:
@@ -1572,10 +1741,12 @@ class DataAnalyzer:
                     mentions.append(mention.group(1))
             return list(set(mentions))  # 去重
         finally:
-            conn.close() 
+            self.db.release_connection(conn) 
     
     def plot_activity_by_time(self, data, output_path):
         """绘制活跃度时间分布图"""
+        import numpy as np
+        plt = _pyplot()
         try:
             # 转换为numpy数组进行处理
             hour_data = np.array(data['hour_dist'])
@@ -1607,6 +1778,8 @@ class DataAnalyzer:
     
     def plot_user_activity(self, data, output_path):
         """绘制用户活跃度图"""
+        import numpy as np
+        plt = _pyplot()
         try:
             # 转换为numpy数组
             users = np.array(list(data['user_activity'].keys()))
@@ -1638,6 +1811,8 @@ class DataAnalyzer:
     
     def plot_message_types(self, data, output_path):
         """绘制消息类型分布图"""
+        import numpy as np
+        plt = _pyplot()
         try:
             types = np.array(list(data['msg_types'].keys()))
             counts = np.array(list(data['msg_types'].values()))
@@ -1653,63 +1828,89 @@ class DataAnalyzer:
             self.logger.error(f"绘制消息类型分布图失败: {e}")
             raise 
     
-    def analyze_word_frequency(self, chat_id=None, start_time=None, end_time=None, output_dir=None):
-        """分析词频"""
+    def _count_word_frequency(self, chat_id=None, start_ts=None, end_ts=None, after_rowid=None, until_rowid=None):
+        """统计文本消息的词频，可只统计rowid在 (after_rowid, until_rowid] 内的消息"""
+        conn = self.db.get_connection()
         try:
-            conn = sqlite3.connect(self.db.db_path)
-            
             # 构建查询条件
             conditions = ["msg_type = 1"]  # 只分析文本消息
             params = []
             if chat_id:
                 conditions.append("chat_id = ?")
                 params.append(chat_id)
-            if start_time:
-                conditions.append("send_time >= ?")
-                # 确保时间格式正确
-                if isinstance(start_time, datetime):
-                    params.append(start_time.strftime('%Y-%m-%d %H:%M:%S'))
-                else:
-                    params.append(start_time)
-            if end_time:
-                conditions.append("send_time <= ?")
-                if isinstance(end_time, datetime):
-                    params.append(end_time.strftime('%Y-%m-%d %H:%M:%S'))
-                else:
-                    params.append(end_time)
+            if start_ts is not None:
+                conditions.append("send_ts >= ?")
+                params.append(start_ts)
+            if end_ts is not None:
+                conditions.append("send_ts <= ?")
+                params.append(end_ts)
+            if after_rowid is not None:
+                conditions.append("rowid > ?")
+                params.append(after_rowid)
+            if until_rowid is not None:
+                conditions.append("rowid <= ?")
+                params.append(until_rowid)
             
             where_clause = " AND ".join(conditions)
             
             # 获取文本消息
             query = f"""
-            SELECT content
+            SELECT msg_id, content
             FROM messages
             WHERE {where_clause}
             """
+            rows = conn.execute(query, params).fetchall()
+        finally:
+            self.db.release_connection(conn)
+        
+        # 分词统计（分词结果取自缓存，未命中时按当前自定义词典分词）
+        word_freq = Counter()
+        for words in self.token_store.iter_tokens(rows):
+            for word in words:
+                if len(word.strip()) > 1:  # 过滤单字词
+                    word_freq[word] += 1
+        return word_freq
+    
+    def analyze_word_frequency(self, chat_id=None, start_time=None, end_time=None, output_dir=None):
+        """分析词频
+        
+        词频结果按消息范围缓存，只有新追加的消息时只对新增部分分词后合并；
+        词频没有变化且报告仍在时直接返回上次的报告。
+        """
+        try:
+            start_ts, end_ts = self._cache_range(start_time, end_time)
+            word_freq, _ = self.result_cache.aggregate(
+                'word_frequency',
+                lambda after, until: self._count_word_frequency(chat_id, start_ts, end_ts, after, until),
+                lambda old, delta: old + delta,
+                chat_id, start_ts, end_ts
+            )
             
-            df = pd.read_sql_query(query, conn, params=params)
-            conn.close()
-            
-            if df.empty:
+            if not word_freq:
                 raise ValueError("未找到符合条件的文本消息")
             
             # 创建输出目录
             if output_dir is None:
                 output_dir = "analysis_results"
-            os.makedirs(output_dir, exist_ok=True)
             
-            # 加载自定义词典
-            dict_manager = DictManager()
-            jieba.load_userdict(dict_manager.dict_path)
+            return self.result_cache.get(
+                'word_frequency_report',
+                lambda: self._write_word_frequency_report(word_freq, output_dir),
+                chat_id, start_ts, end_ts,
+                extra=output_dir,
+                validate=os.path.exists
+            )
             
-            # 分词统计
-            word_freq = defaultdict(int)
-            for text in df['content']:
-                if isinstance(text, str):
-                    words = jieba.cut(text)
-                    for word in words:
-                        if len(word.strip()) > 1:  # 过滤单字词
-                            word_freq[word] += 1
+        except Exception as e:
+            self.logger.error(f"词频分析失败: {str(e)}")
+            raise 
+    
+    def _write_word_frequency_report(self, word_freq, output_dir):
+        """生成词频报告、词云图和柱状图，返回报告路径"""
+        plt = _pyplot()
+        from wordcloud import WordCloud
+        try:
+            os.makedirs(output_dir, exist_ok=True)
             
             # 生成词频报告
             sorted_words = sorted(word_freq.items(), key=lambda x: x[1], reverse=True)
@@ -1758,11 +1959,20 @@ class DataAnalyzer:
             return report_path
             
         except Exception as e:
-            self.logger.error(f"词频分析失败: {str(e)}")
+            self.logger.error(f"生成词频报告失败: {str(e)}")
             raise 
     
     def generate_story(self, chat_id=None, start_time=None, end_time=None):
-        """根据时间线生成用户故事"""
+        """根据时间线生成用户故事，消息和词典没有变化时直接返回上次的结果"""
+        start_ts, end_ts = self._cache_range(start_time, end_time)
+        return self.result_cache.get(
+            'generate_story',
+            lambda: self._generate_story(chat_id, start_time, end_time),
+            chat_id, start_ts, end_ts
+        )
+    
+    def _generate_story(self, chat_id=None, start_time=None, end_time=None):
+        """生成用户故事的实际计算"""
         try:
             # 获取消息记录
             messages = self._get_messages(chat_id, start_time, end_time)
@@ -1839,24 +2049,20 @@ class DataAnalyzer:
         """提取每日关键事件"""
         try:
             # 提取当天所有文本
-            texts = []
-            for msg in messages:
-                if msg['content'] and isinstance(msg['content'], str):
-                    text = re.sub(r'http[s]?://\S+', '', msg['content'])
-                    text = re.sub(r'\[.*?\]', '', text)
-                    text = text.strip()
-                    if text:
-                        texts.append(text)
+            text_rows = [
+                (msg['msg_id'], msg['content'])
+                for msg in messages if normalize_text(msg['content'])
+            ]
             
-            if not texts:
+            if not text_rows:
                 return None
             
             # 使用TF-IDF提取关键词
-            keywords = jieba.analyse.extract_tags(
-                '\n'.join(texts),
-                topK=5,
-                withWeight=True,
-                allowPOS=('n', 'v', 'vn')  # 只保留名词和动词
+            keywords = extract_tags_from_tokens(
+                self.token_store.get_tokens(text_rows, with_pos=True),
+                top_k=5,
+                with_weight=True,
+                allow_pos=('n', 'v', 'vn')  # 只保留名词和动词
             )
             
             # 选择最具代表性的消息
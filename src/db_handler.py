@@ -1,13 +1,106 @@
 import sqlite3
 import hashlib
-from datetime import datetime
+from datetime import datetime, date, timedelta
 import os
 import logging
 import uuid
-import csv
+import threading
+from src.exporter import StreamingExporter
+
+# send_ts 为本地挂钟时间按UTC换算的毫秒数（不做时区转换），
+# SQLite 的 datetime(send_ts / 1000, 'unixepoch') 和 pandas 的 unit='ms' 可直接还原
+_EPOCH = datetime(1970, 1, 1)
+
+# 历史数据中出现过的send_time文本格式
+_TIME_FORMATS = [
+    '%Y-%m-%d %H:%M:%S.%f',  # 2024-12-18 09:09:00.000
+    '%Y-%m-%d %H:%M:%S',     # 2024-12-18 09:09:00
+    '%Y-%m-%d %H:%M',        # 2024-12-18 09:09
+    '%Y-%m-%d %I:%M %p',     # 2024-12-18 09:09 AM/PM
+    '%Y-%m-%d',              # 2024-12-18
+]
+
+def parse_send_time(value):
+    """把send_time文本解析为datetime，无法解析时返回None"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone().replace(tzinfo=None)
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    
+    # 标准化时间字符串格式
+    time_str = str(value).strip().replace('/', '-')
+    
+    # 处理年份缩写(如 24-12-18)
+    if len(time_str) >= 3 and time_str[2] == '-':
+        time_str = '20' + time_str
+    
+    for fmt in _TIME_FORMATS:
+        try:
+            return datetime.strptime(time_str, fmt)
+        except ValueError:
+            continue
+    return None
+
+def to_epoch_ms(value):
+    """datetime或时间文本转换为send_ts毫秒数，无法解析时返回None"""
+    dt = parse_send_time(value)
+    if dt is None:
+        return None
+    return (dt - _EPOCH) // timedelta(milliseconds=1)
+
+def from_epoch_ms(ms):
+    """send_ts毫秒数还原为datetime"""
+    if ms is None:
+        return None
+    return _EPOCH + timedelta(milliseconds=ms)
+
+# 汇总表按小时分桶
+_BUCKET_MS = 3600000
+
+# 汇总表的列：前6列为维度，后6列为计数
+_ROLLUP_COLUMNS = [
+    'chat_id', 'bucket_ts', 'day', 'hour', 'sender_name', 'msg_type',
+    'msg_count', 'content_length', 'len_short', 'len_medium', 'len_long', 'len_xlong',
+]
+
+def _rollup_exprs(row=''):
+    """单条消息对应的汇总列取值表达式，row为触发器中的 'new.'/'old.' 前缀"""
+    length = f"LENGTH({row}content)"
+    return [
+        f"{row}chat_id",
+        f"{row}send_ts - {row}send_ts % {_BUCKET_MS}",
+        f"date({row}send_ts / 1000, 'unixepoch')",
+        f"CAST(strftime('%H', {row}send_ts / 1000, 'unixepoch') AS INTEGER)",
+        f"COALESCE({row}sender_name, '')",
+        f"COALESCE({row}msg_type, 0)",
+        "1",
+        f"COALESCE({length}, 0)",
+        # 长度分档与analyze_chat的消息长度分布一致，content为空时计入超长
+        f"CASE WHEN {length} <= 10 THEN 1 ELSE 0 END",
+        f"CASE WHEN {length} > 10 AND {length} <= 50 THEN 1 ELSE 0 END",
+        f"CASE WHEN {length} > 50 AND {length} <= 200 THEN 1 ELSE 0 END",
+        f"CASE WHEN {length} <= 200 THEN 0 ELSE 1 END",
+    ]
 
 class DatabaseHandler:
-    def __init__(self, db_path="data/wx_chat.db"):
+    # 默认连接参数，可通过构造函数的pragmas参数覆盖
+    DEFAULT_PRAGMAS = {
+        'journal_mode': 'WAL',      # 读写互不阻塞
+        'synchronous': 'NORMAL',    # WAL模式下兼顾安全与写入速度
+        'cache_size': -20000,       # 负数表示KB，约20MB页缓存
+        'mmap_size': 268435456,     # 256MB内存映射
+        'temp_store': 'MEMORY',
+    }
+    
+    def __init__(self, db_path="data/wx_chat.db", pragmas=None):
+        """
+        :param db_path: 数据库文件路径
+        :param pragmas: 额外的PRAGMA设置，如 {'synchronous': 'FULL'}，值为None表示不设置该项
+        """
         # 确保data目录存在
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
         self.db_path = db_path
@@ -15,11 +108,59 @@ class DatabaseHandler:
         # 设置日志
         self.logger = logging.getLogger(__name__)
         
+        # 每个线程持有一个长连接
+        self.pragmas = dict(self.DEFAULT_PRAGMAS)
+        if pragmas:
+            self.pragmas.update(pragmas)
+        self._local = threading.local()
+        self._connections = []
+        self._conn_lock = threading.Lock()
+        
         self.init_db()
         
+    def get_connection(self):
+        """借出当前线程的长连接，首次调用时创建并应用PRAGMA"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+        
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        for name, value in self.pragmas.items():
+            if value is None:
+                continue
+            try:
+                conn.execute(f"PRAGMA {name} = {value}")
+            except sqlite3.Error as e:
+                self.logger.warning(f"设置PRAGMA失败: {name}={value}, {e}")
+        
+        self._local.conn = conn
+        with self._conn_lock:
+            self._connections.append(conn)
+        self.logger.debug(f"创建数据库连接: thread={threading.current_thread().name}")
+        return conn
+    
+    def release_connection(self, conn):
+        """归还连接：回滚未提交的事务，连接本身保持打开供后续复用"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error as e:
+            self.logger.warning(f"回滚未提交事务失败: {e}")
+    
+    def close(self):
+        """关闭所有线程的连接，程序退出前调用"""
+        with self._conn_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                self.logger.warning(f"关闭数据库连接失败: {e}")
+        self._local = threading.local()
+        
     def init_db(self):
         """初始化数据库"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         cursor = conn.cursor()
         
         try:
@@ -41,6 +182,7 @@ class DatabaseHandler:
                 content TEXT,
                 sender_name VARCHAR(64),
                 send_time TIMESTAMP,
+                send_ts INTEGER,  -- 毫秒时间戳，见 to_epoch_ms
                 FOREIGN KEY (chat_id) REFERENCES chats(chat_id)
             )
             ''')
@@ -51,12 +193,226 @@ class DatabaseHandler:
             ON messages(chat_id, sender_name, send_time, content)
             ''')
             
+            # 旧库迁移：补充send_ts列并回填
+            self._migrate_send_ts(cursor)
+            
+            # 时间范围过滤和排序使用的索引
+            cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_messages_chat_ts
+            ON messages(chat_id, send_ts)
+            ''')
+            cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_messages_ts
+            ON messages(send_ts)
+            ''')
+            
+            # 按小时汇总的统计表
+            self._init_rollups(cursor)
+            
+            # 修改和删除计数，分析结果缓存据此判断旧消息是否变化
+            self._init_change_counter(cursor)
+            
             conn.commit()
         except Exception as e:
             self.logger.error(f"初始化数据库失败: {e}")
         finally:
-            conn.close()
+            self.release_connection(conn)
+        
+    def _migrate_send_ts(self, cursor):
+        """为旧版messages表添加send_ts列，并从send_time文本一次性回填"""
+        cursor.execute("PRAGMA table_info(messages)")
+        columns = {row[1] for row in cursor.fetchall()}
+        if 'send_ts' not in columns:
+            cursor.execute("ALTER TABLE messages ADD COLUMN send_ts INTEGER")
+            self.logger.info("messages表已添加send_ts列")
+        
+        cursor.execute("SELECT rowid, send_time FROM messages WHERE send_ts IS NULL AND send_time IS NOT NULL")
+        updates = []
+        failed = 0
+        for rowid, send_time in cursor.fetchall():
+            send_ts = to_epoch_ms(send_time)
+            if send_ts is None:
+                failed += 1
+                continue
+            updates.append((send_ts, rowid))
         
+        if updates:
+            cursor.executemany("UPDATE messages SET send_ts = ? WHERE rowid = ?", updates)
+            self.logger.info(f"已回填 {len(updates)} 条消息的send_ts")
+        if failed:
+            self.logger.warning(f"{failed} 条消息的send_time无法解析，send_ts保持为空")
+        
+    def _init_rollups(self, cursor):
+        """创建message_rollup汇总表和维护触发器，新建时从现有消息生成
+        
+        汇总表按 (chat_id, 小时, 发送者, 消息类型) 记录消息数和内容长度，
+        消息的插入和删除由触发器同步，send_ts为空的消息不计入。
+        """
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'message_rollup'")
+        exists = cursor.fetchone() is not None
+        
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS message_rollup (
+            chat_id VARCHAR(32),
+            bucket_ts INTEGER,  -- 小时起点的send_ts
+            day TEXT,
+            hour INTEGER,
+            sender_name VARCHAR(64),
+            msg_type TINYINT,
+            msg_count INTEGER,
+            content_length INTEGER,
+            len_short INTEGER,
+            len_medium INTEGER,
+            len_long INTEGER,
+            len_xlong INTEGER,
+            PRIMARY KEY (chat_id, bucket_ts, sender_name, msg_type)
+        )
+        ''')
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_rollup_ts
+        ON message_rollup(bucket_ts)
+        ''')
+        
+        counters = _ROLLUP_COLUMNS[6:]
+        new_values = ', '.join(_rollup_exprs('new.'))
+        old_values = _rollup_exprs('old.')
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS message_rollup_insert
+        AFTER INSERT ON messages
+        WHEN new.send_ts IS NOT NULL
+        BEGIN
+            INSERT INTO message_rollup ({', '.join(_ROLLUP_COLUMNS)})
+            VALUES ({new_values})
+            ON CONFLICT (chat_id, bucket_ts, sender_name, msg_type) DO UPDATE SET
+            {', '.join(f"{c} = {c} + excluded.{c}" for c in counters)};
+        END
+        ''')
+        
+        # 主键列：chat_id, bucket_ts, sender_name, msg_type
+        old_key = ' AND '.join(f"{_ROLLUP_COLUMNS[i]} = {old_values[i]}" for i in (0, 1, 4, 5))
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS message_rollup_delete
+        AFTER DELETE ON messages
+        WHEN old.send_ts IS NOT NULL
+        BEGIN
+            UPDATE message_rollup SET
+            {', '.join(f"{c} = {c} - ({e})" for c, e in zip(counters, old_values[6:]))}
+            WHERE {old_key};
+            DELETE FROM message_rollup WHERE {old_key} AND msg_count <= 0;
+        END
+        ''')
+        
+        if not exists:
+            self._fill_rollups(cursor)
+    
+    def _init_change_counter(self, cursor):
+        """创建message_changes计数表和维护触发器
+        
+        messages的每次UPDATE和DELETE都使modified加一。新插入的消息总是得到比现有行更大的rowid
+        （删除最大rowid的行后才会复用，而删除已被计数），只看消息范围的最大rowid和条数无法发现
+        原地修改和删除后复用rowid的插入，需要结合这个计数判断。
+        """
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS message_changes (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            modified INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO message_changes (id, modified) VALUES (1, 0)")
+        for event in ('UPDATE', 'DELETE'):
+            cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS message_changes_{event.lower()}
+            AFTER {event} ON messages
+            BEGIN
+                UPDATE message_changes SET modified = modified + 1 WHERE id = 1;
+            END
+            ''')
+    
+    def _fill_rollups(self, cursor):
+        """从messages表整体生成汇总数据"""
+        exprs = _rollup_exprs()
+        cursor.execute(f'''
+        INSERT INTO message_rollup ({', '.join(_ROLLUP_COLUMNS)})
+        SELECT {', '.join(exprs[:6])}, {', '.join(f"SUM({e})" for e in exprs[6:])}
+        FROM messages
+        WHERE send_ts IS NOT NULL
+        GROUP BY 1, 2, 5, 6
+        ''')
+        self.logger.info(f"已生成消息汇总表: {cursor.rowcount} 行")
+    
+    def rebuild_rollups(self):
+        """清空并重新生成汇总表"""
+        conn = self.get_connection()
+        try:
+            with conn:
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM message_rollup")
+                self._fill_rollups(cursor)
+        finally:
+            self.release_connection(conn)
+    
+    def rollup_query(self, chat_id=None, start_ts=None, end_ts=None):
+        """构造与指定范围内消息等价的汇总行子查询
+        
+        完整的小时直接读message_rollup，范围首尾不足一小时的部分从messages表现算；
+        未指定时间范围时一并统计send_ts为空的消息（时间相关列为NULL）。
+        
+        Args:
+            chat_id: 聊天ID，为None时包含所有聊天
+            start_ts: 起始send_ts（含）
+            end_ts: 结束send_ts（含）
+            
+        Returns:
+            tuple: (子查询SQL, 参数列表)，子查询的列见 _ROLLUP_COLUMNS
+        """
+        exprs = _rollup_exprs()
+        raw_select = (
+            f"SELECT {', '.join(f'{e} AS {c}' for c, e in zip(_ROLLUP_COLUMNS[:6], exprs[:6]))}, "
+            f"{', '.join(f'SUM({e}) AS {c}' for c, e in zip(_ROLLUP_COLUMNS[6:], exprs[6:]))} "
+            f"FROM messages"
+        )
+        chat_filter = " AND chat_id = ?" if chat_id else ""
+        chat_params = [chat_id] if chat_id else []
+        
+        # 完整小时的范围 [lo, hi)
+        lo = None if start_ts is None else -(-start_ts // _BUCKET_MS) * _BUCKET_MS
+        hi = None if end_ts is None else (end_ts + 1) // _BUCKET_MS * _BUCKET_MS
+        
+        parts = []
+        params = []
+        
+        def add_raw(range_sql, range_params):
+            parts.append(f"{raw_select} WHERE {range_sql}{chat_filter} GROUP BY 1, 2, 5, 6")
+            params.extend(range_params + chat_params)
+        
+        if lo is not None and hi is not None and lo >= hi:
+            # 范围不足一个完整小时，全部现算
+            add_raw("send_ts >= ? AND send_ts <= ?", [start_ts, end_ts])
+        else:
+            conditions = []
+            if lo is not None:
+                conditions.append("bucket_ts >= ?")
+                params.append(lo)
+            if hi is not None:
+                conditions.append("bucket_ts < ?")
+                params.append(hi)
+            if chat_id:
+                conditions.append("chat_id = ?")
+                params.append(chat_id)
+            parts.append(
+                f"SELECT {', '.join(_ROLLUP_COLUMNS)} FROM message_rollup"
+                + (f" WHERE {' AND '.join(conditions)}" if conditions else "")
+            )
+            
+            if lo is not None and start_ts < lo:
+                add_raw("send_ts >= ? AND send_ts < ?", [start_ts, lo])
+            if hi is not None and end_ts >= hi:
+                add_raw("send_ts >= ? AND send_ts <= ?", [hi, end_ts])
+            if start_ts is None and end_ts is None:
+                add_raw("send_ts IS NULL", [])
+        
+        return " UNION ALL ".join(parts), params
+    
     def get_chat_id(self, chat_name, chat_type, user_input_name=None):
         """获取或创建chat_id
         :param chat_name: 自动获取的聊天名称
@@ -72,7 +428,7 @@ class DatabaseHandler:
         # 使用chat_name生成chat_id
         chat_id = hashlib.md5(f"{final_name}".encode()).hexdigest()
         
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         cursor = conn.cursor()
         
         try:
@@ -94,16 +450,20 @@ class DatabaseHandler:
                 self.logger.info(f"创建新会话: chat_id={chat_id}, name={final_name}")
                 return chat_id
         finally:
-            conn.close()
+            self.release_connection(conn)
+        
+    def _make_msg_id(self, chat_id, message):
+        """使用会话、发送者、时间和内容前缀生成消息ID"""
+        return hashlib.md5(
+            f"{chat_id}_{message['sender_name']}_{message['send_time']}_{message['content'][:100]}".encode()
+        ).hexdigest()
         
     def save_message(self, chat_id, message):
         """保存消息"""
         # 使用更多字段生成消息ID
-        msg_id = hashlib.md5(
-            f"{chat_id}_{message['sender_name']}_{message['send_time']}_{message['content'][:100]}".encode()
-        ).hexdigest()
+        msg_id = self._make_msg_id(chat_id, message)
         
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         cursor = conn.cursor()
         
         try:
@@ -127,15 +487,16 @@ class DatabaseHandler:
                 
             # 插入新消息
             cursor.execute('''
-            INSERT INTO messages (msg_id, chat_id, msg_type, content, sender_name, send_time)
-            VALUES (?, ?, ?, ?, ?, ?)
+            INSERT INTO messages (msg_id, chat_id, msg_type, content, sender_name, send_time, send_ts)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
             ''', (
                 msg_id,
                 chat_id,
                 message['msg_type'],
                 message['content'],
                 message['sender_name'],
-                message['send_time']
+                message['send_time'],
+                to_epoch_ms(message['send_time'])
             ))
             conn.commit()
             self.logger.debug(f"成功保存消息: {message['content'][:20]}...")
@@ -145,63 +506,141 @@ class DatabaseHandler:
         except Exception as e:
             self.logger.error(f"保存消息失败: {e}")
         finally:
-            conn.close()
+            self.release_connection(conn)
+        
+    def save_messages(self, chat_id, messages):
+        """批量保存消息，整批在一个事务内提交
+        
+        依赖主键和idx_message_unique去重，已存在的消息由INSERT OR IGNORE跳过。
+        
+        Args:
+            chat_id: 聊天ID
+            messages: 消息字典的可迭代对象，字段同save_message
+            
+        Returns:
+            tuple: (新增条数, 跳过条数)
+            
+        Raises:
+            Exception: 写入失败时整批回滚并继续抛出，由调用方决定重试
+        """
+        rows = [(
+            self._make_msg_id(chat_id, message),
+            chat_id,
+            message['msg_type'],
+            message['content'],
+            message['sender_name'],
+            message['send_time'],
+            to_epoch_ms(message['send_time'])
+        ) for message in messages]
+        
+        if not rows:
+            return 0, 0
+        
+        conn = self.get_connection()
+        
+        try:
+            with conn:
+                # rowcount只统计语句本身插入的行，不含触发器维护汇总表产生的改动
+                cursor = conn.executemany('''
+                INSERT OR IGNORE INTO messages (msg_id, chat_id, msg_type, content, sender_name, send_time, send_ts)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+            inserted = cursor.rowcount
+            skipped = len(rows) - inserted
+            self.logger.debug(f"批量保存消息: 新增 {inserted} 条, 跳过 {skipped} 条")
+            return inserted, skipped
+            
+        except Exception as e:
+            self.logger.error(f"批量保存消息失败: {e}")
+            raise
+        finally:
+            self.release_connection(conn)
         
     def get_last_message_time(self, chat_id):
         """获取最后一条消息的时间"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         cursor = conn.cursor()
         
         try:
             cursor.execute('''
-            SELECT send_time FROM messages 
-            WHERE chat_id = ? 
-            ORDER BY send_time DESC 
-            LIMIT 1
+            SELECT MAX(send_ts) FROM messages 
+            WHERE chat_id = ?
             ''', (chat_id,))
             
             result = cursor.fetchone()
-            if result:
-                return datetime.strptime(result[0], '%Y-%m-%d %H:%M:%S.%f')
-            return None
+            return from_epoch_ms(result[0]) if result else None
         finally:
-            conn.close()
+            self.release_connection(conn)
+        
+    def count_stored_messages(self, chat_id, messages):
+        """统计一组解析出的消息中已经入库的条数，按与save_messages相同的msg_id判断"""
+        msg_ids = list({self._make_msg_id(chat_id, message) for message in messages})
+        if not msg_ids:
+            return 0
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            placeholders = ','.join('?' * len(msg_ids))
+            cursor.execute(
+                f"SELECT COUNT(*) FROM messages WHERE msg_id IN ({placeholders})",
+                msg_ids
+            )
+            return cursor.fetchone()[0]
+        finally:
+            self.release_connection(conn)
+        
+    def count_messages_since(self, chat_id, since):
+        """统计某个时间之后的消息数，用于估计聊天的消息频率"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+            SELECT COUNT(*) FROM messages
+            WHERE chat_id = ? AND send_ts >= ?
+            ''', (chat_id, to_epoch_ms(since)))
+            return cursor.fetchone()[0]
+        finally:
+            self.release_connection(conn)
         
     def get_all_chats(self):
         """获取所有聊天对象"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         cursor = conn.cursor()
         
         try:
             cursor.execute('''
                 SELECT c.chat_id, c.chat_type, c.chat_name,
                        COUNT(m.msg_id) as msg_count,
-                       MAX(m.send_time) as last_active
+                       MAX(m.send_ts) as last_ts
                 FROM chats c
                 LEFT JOIN messages m ON c.chat_id = m.chat_id
                 GROUP BY c.chat_id
-                ORDER BY last_active DESC
+                ORDER BY last_ts DESC
             ''')
             
             chats = []
             for row in cursor.fetchall():
+                last_active = from_epoch_ms(row[4])
                 chats.append({
                     'chat_id': row[0],
                     'chat_type': row[1],
                     'chat_name': row[2],
                     'msg_count': row[3],
-                    'last_active': row[4]
+                    'last_active': last_active.strftime('%Y-%m-%d %H:%M:%S') if last_active else None
                 })
             return chats
         except Exception as e:
             self.logger.error(f"获取聊天列表失败: {str(e)}")
             return []
         finally:
-            conn.close()
+            self.release_connection(conn)
         
     def get_chat_by_name(self, chat_name):
         """根据chat_name查询会话，支持模糊匹配"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         cursor = conn.cursor()
         
         try:
@@ -218,7 +657,7 @@ class DatabaseHandler:
                 } for row in results]
             return []
         finally:
-            conn.close()
+            self.release_connection(conn)
             
     def create_chat(self, chat_name, chat_type=1):
         """创建新的会话记录"""
@@ -228,7 +667,7 @@ class DatabaseHandler:
         # 使用chat_name生成chat_id
         chat_id = hashlib.md5(f"{chat_name}".encode()).hexdigest()
         
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         cursor = conn.cursor()
         
         try:
@@ -250,7 +689,7 @@ class DatabaseHandler:
             self.logger.info(f"创建新会话: chat_id={chat_id}, name={chat_name}")
             return chat_id, chat_name
         finally:
-            conn.close()
+            self.release_connection(conn)
             
     def update_chat_name(self, chat_id, new_name):
         """更新会话名称，处理名称冲突"""
@@ -266,7 +705,7 @@ class DatabaseHandler:
                 counter += 1
             self.logger.info(f"处理名称冲突: {base_name} -> {new_name}")
         
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         cursor = conn.cursor()
         
         try:
@@ -278,34 +717,27 @@ class DatabaseHandler:
             self.logger.info(f"更新会话名称: chat_id={chat_id}, new_name={new_name}")
             return new_name
         finally:
-            conn.close()
+            self.release_connection(conn)
             
     def get_chat_messages(self, chat_id):
         """获取指定聊天的所有消息"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         cursor = conn.cursor()
         
         try:
             cursor.execute('''
-                SELECT msg_id, chat_id, sender_name, send_time, content, msg_type
+                SELECT msg_id, chat_id, sender_name, send_ts, content, msg_type
                 FROM messages
                 WHERE chat_id = ?
-                ORDER BY send_time DESC
+                ORDER BY send_ts DESC
             ''', (chat_id,))
             
             messages = []
             for row in cursor.fetchall():
-                # 处理时间格式
-                try:
-                    # 先尝试带微秒的格式
-                    send_time = datetime.strptime(row[3], '%Y-%m-%d %H:%M:%S.%f')
-                except ValueError:
-                    try:
-                        # 再尝试不带微秒的格式
-                        send_time = datetime.strptime(row[3], '%Y-%m-%d %H:%M:%S')
-                    except ValueError as e:
-                        self.logger.error(f"无法解析时间格式: {row[3]}, {str(e)}")
-                        continue
+                send_time = from_epoch_ms(row[3])
+                if send_time is None:
+                    self.logger.error(f"消息缺少send_ts: {row[0]}")
+                    continue
                 
                 messages.append({
                     'msg_id': row[0],
@@ -320,11 +752,11 @@ class DatabaseHandler:
             self.logger.error(f"获取聊天消息失败: {str(e)}")
             return []
         finally:
-            conn.close()
+            self.release_connection(conn)
             
     def get_chat_by_id(self, chat_id):
         """根据ID获取聊天对象信息"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         cursor = conn.cursor()
         
         try:
@@ -347,7 +779,7 @@ class DatabaseHandler:
             self.logger.error(f"获取聊天对象信息失败: {str(e)}")
             raise
         finally:
-            conn.close()
+            self.release_connection(conn)
             
     def add_message(self, chat_id, msg_type, content, sender_name, send_time):
         """添加新消息"""
@@ -357,21 +789,22 @@ class DatabaseHandler:
         # 生成唯一的msg_id
         msg_id = hashlib.md5(f"{chat_id}_{sender_name}_{send_time}_{content[:50]}".encode()).hexdigest()
         
-        conn = sqlite3.connect(self.db_path)
+        conn = self.get_connection()
         cursor = conn.cursor()
         
         try:
             # 插入新消息
             cursor.execute('''
-            INSERT INTO messages (msg_id, chat_id, msg_type, content, sender_name, send_time)
-            VALUES (?, ?, ?, ?, ?, ?)
+            INSERT INTO messages (msg_id, chat_id, msg_type, content, sender_name, send_time, send_ts)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
             ''', (
                 msg_id,
                 chat_id,
                 msg_type,
                 content,
                 sender_name,
-                send_time
+                send_time,
+                to_epoch_ms(send_time)
             ))
             conn.commit()
             self.logger.debug(f"成功保存消息: {content[:20]}...")
@@ -380,11 +813,17 @@ class DatabaseHandler:
             self.logger.error(f"保存消息失败: {e}")
             return False, str(e)
         finally:
-            conn.close()
+            self.release_connection(conn)
             
-    def export_chat(self, chat_id, output_path=None, start_date=None, end_date=None):
-        """导出聊天记录"""
-        conn = sqlite3.connect(self.db_path)
+    def export_chat(self, chat_id, output_path=None, start_date=None, end_date=None,
+                    compression=None, progress_callback=None, chunk_size=5000):
+        """导出聊天记录为CSV，按批次流式写出
+        
+        Args:
+            compression: None / 'gzip' / 'zstd'，output_path未指定时自动添加后缀
+            progress_callback: 进度回调 callback(已导出条数, None)
+        """
+        conn = self.get_connection()
         cursor = conn.cursor()
         
         try:
@@ -393,69 +832,59 @@ class DatabaseHandler:
             query_params = [chat_id]
             
             if start_date:
-                query_conditions.append("send_time >= ?")
-                query_params.append(start_date)
+                query_conditions.append("send_ts >= ?")
+                query_params.append(to_epoch_ms(start_date))
             if end_date:
-                query_conditions.append("send_time <= ?")
-                query_params.append(end_date)
+                query_conditions.append("send_ts <= ?")
+                query_params.append(to_epoch_ms(end_date))
             
             # 构建查询语句
             query = f"""
-                SELECT sender_name, send_time, content, msg_type, file_id
+                SELECT sender_name, send_ts, content, msg_type
                 FROM messages 
                 WHERE {' AND '.join(query_conditions)}
-                ORDER BY send_time ASC
+                ORDER BY send_ts ASC
             """
             
             cursor.execute(query, query_params)
-            messages = cursor.fetchall()
             
-            if not messages:
-                return False, "未找到聊天记录"
+            exporter = StreamingExporter(
+                chunk_size=chunk_size,
+                compression=compression,
+                progress_callback=progress_callback
+            )
             
             # 如果未指定输出路径，生成默认路径
             if not output_path:
                 timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                output_path = f"chat_export_{timestamp}.csv"
+                output_path = exporter.build_path('.', f"chat_export_{timestamp}")
             
-            # 确保输出目录存在
-            os.makedirs(os.path.dirname(output_path) if os.path.dirname(output_path) else '.', exist_ok=True)
+            def format_row(row):
+                # 统一时间格式为 YYYY-MM-DD HH:MM:SS
+                sender_name, send_ts, content, msg_type = row
+                send_time = from_epoch_ms(send_ts)
+                formatted_time = send_time.strftime('%Y-%m-%d %H:%M:%S') if send_time else ''
+                return (sender_name, formatted_time, content, msg_type)
+            
+            count = exporter.export(
+                cursor,
+                ['sender_name', 'send_time', 'content', 'msg_type'],
+                output_path,
+                headers=['发送者', '发送时间', '内容', '消息类型'],
+                transform=format_row
+            )
+            
+            if not count:
+                os.remove(output_path)
+                return False, "未找到聊天记录"
             
-            # 写入CSV文件
-            with open(output_path, 'w', encoding='utf-8-sig', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(['发送者', '发送时间', '内容', '消息类型', '文件ID'])
-                
-                for msg in messages:
-                    sender_name, send_time, content, msg_type, file_id = msg
-                    
-                    # 统一时间格式为 YYYY-MM-DD HH:MM:SS
-                    try:
-                        if isinstance(send_time, str):
-                            dt = datetime.strptime(send_time, '%Y-%m-%d %H:%M:%S.%f')
-                        else:
-                            dt = send_time
-                        formatted_time = dt.strftime('%Y-%m-%d %H:%M:%S')
-                    except Exception as e:
-                        self.logger.error(f"时间格式转换失败: {send_time}, 错误: {e}")
-                        formatted_time = send_time  # 保持原始格式
-                    
-                    writer.writerow([
-                        sender_name,
-                        formatted_time,
-                        content,
-                        msg_type,
-                        file_id or ''
-                    ])
-                    
-            self.logger.info(f"导出完成: {output_path}")
             return True, output_path
             
         except Exception as e:
             self.logger.error(f"导出失败: {e}")
             return False, str(e)
         finally:
-            conn.close()
+            self.release_connection(conn)
             
     def get_message_count(self, chat_id=None):
         """获取消息数量
@@ -467,7 +896,7 @@ class DatabaseHandler:
             int: 消息数量
         """
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self.get_connection()
             cursor = conn.cursor()
             
             if chat_id:
@@ -479,7 +908,7 @@ class DatabaseHandler:
                 cursor.execute("SELECT COUNT(*) FROM messages")
                 
             count = cursor.fetchone()[0]
-            conn.close()
+            self.release_connection(conn)
             return count
             
         except Exception as e:
@@ -2,12 +2,9 @@ import os
 import re
 import logging
 from pathlib import Path
-import sqlite3
-import jieba
 from collections import defaultdict
+from src.token_store import TokenStore
 from datetime import datetime
-import matplotlib.pyplot as plt
-from wordcloud import WordCloud
 
 class DictManager:
     def __init__(self, dict_path="data/custom_dict.txt", backup_dir="data/dict_backups"):
@@ -15,6 +12,11 @@ class DictManager:
         self.backup_dir = backup_dir
         self.logger = logging.getLogger(__name__)
         
+        # 词典的内存索引，文件修改时间或大小变化后按需重新加载
+        self._lines = []      # 文件行：('entry', 词语) 或 ('raw', 注释/空行原文)
+        self._entries = {}    # 词语 -> [词语, 词频, 词性(可选)]
+        self._stamp = None
+        
         # 确保目录存在
         os.makedirs(os.path.dirname(dict_path), exist_ok=True)
         os.makedirs(backup_dir, exist_ok=True)
@@ -77,20 +79,73 @@ class DictManager:
         except Exception as e:
             return False, f"验证词典时出错: {e}"
     
+    def _file_stamp(self):
+        """词典文件的修改时间和大小"""
+        try:
+            stat = os.stat(self.dict_path)
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+    
+    def _ensure_loaded(self):
+        """文件自上次加载后有变化时重新建立内存索引"""
+        stamp = self._file_stamp()
+        if stamp == self._stamp:
+            return
+        
+        lines = []
+        entries = {}
+        if stamp is not None:
+            with open(self.dict_path, 'r', encoding='utf-8') as f:
+                for raw in f:
+                    raw = raw.rstrip('\n')
+                    line = raw.strip()
+                    if line and not line.startswith('#'):
+                        parts = line.split()
+                        if parts[0] in entries:  # 重复词条只保留第一条
+                            continue
+                        entries[parts[0]] = parts
+                        lines.append(('entry', parts[0]))
+                    else:
+                        lines.append(('raw', raw))
+        
+        self._lines = lines
+        self._entries = entries
+        self._stamp = stamp
+    
+    def _flush(self):
+        """把内存中的词典写入临时文件后原子替换原文件"""
+        content = []
+        for kind, value in self._lines:
+            if kind == 'raw':
+                content.append(value)
+            elif value in self._entries:
+                content.append(' '.join(self._entries[value]))
+        
+        tmp_path = f"{self.dict_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(content) + '\n')
+        os.replace(tmp_path, self.dict_path)
+        
+        # 丢弃已删除词条留下的行标记
+        self._lines = [(kind, value) for kind, value in self._lines
+                       if kind == 'raw' or value in self._entries]
+        self._stamp = self._file_stamp()
+    
+    def _make_entry(self, word, freq, pos=None):
+        """构建词条"""
+        return [word, str(freq), pos] if pos else [word, str(freq)]
+    
     def add_word(self, word, freq=500, pos=None):
         """添加新词到词典"""
         try:
             if self.has_word(word):
                 return False, "词语已存在"
                 
-            # 构建词条
-            entry = f"{word} {freq}"
-            if pos:
-                entry += f" {pos}"
-                
             # 添加到词典
-            with open(self.dict_path, 'a', encoding='utf-8') as f:
-                f.write(f"\n{entry}")
+            self._entries[word] = self._make_entry(word, freq, pos)
+            self._lines.append(('entry', word))
+            self._flush()
                 
             return True, "添加成功"
             
@@ -98,38 +153,65 @@ class DictManager:
             self.logger.error(f"添加词语失败: {e}")
             return False, f"添加失败: {e}"
     
+    def add_words(self, entries):
+        """批量添加新词，只读写一次词典文件
+        
+        Args:
+            entries: [(词语, 词频, 词性), ...]，词性可省略
+            
+        Returns:
+            int: 实际新增的词条数
+        """
+        try:
+            self._ensure_loaded()
+            added = 0
+            for entry in entries:
+                word, freq = entry[0], entry[1]
+                pos = entry[2] if len(entry) > 2 else None
+                if word in self._entries:
+                    continue
+                self._entries[word] = self._make_entry(word, freq, pos)
+                self._lines.append(('entry', word))
+                added += 1
+            
+            if added:
+                self._flush()
+            return added
+            
+        except Exception as e:
+            self.logger.error(f"批量添加词语失败: {e}")
+            return 0
+    
     def remove_word(self, word):
         """删除词条"""
         try:
-            with open(self.dict_path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-                
-            with open(self.dict_path, 'w', encoding='utf-8') as f:
-                removed = False
-                for line in lines:
-                    if line.strip() and not line.startswith('#'):
-                        if line.split()[0] != word:
-                            f.write(line)
-                        else:
-                            removed = True
-                    else:
-                        f.write(line)
-                        
+            removed = self.remove_words([word]) > 0
             return removed, "删除成功" if removed else "词条不存在"
             
         except Exception as e:
             return False, f"删除词条失败: {e}"
     
+    def remove_words(self, words):
+        """批量删除词条，只写一次词典文件
+        
+        Returns:
+            int: 实际删除的词条数
+        """
+        self._ensure_loaded()
+        removed = 0
+        for word in set(words):
+            if self._entries.pop(word, None) is not None:
+                removed += 1
+        
+        if removed:
+            self._flush()
+        return removed
+    
     def list_words(self):
         """列出所有词条"""
         try:
-            words = []
-            with open(self.dict_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if line and not line.startswith('#'):
-                        words.append(line.split())
-            return words
+            self._ensure_loaded()
+            return [list(parts) for parts in self._entries.values()]
         except Exception as e:
             self.logger.error(f"列出词条失败: {e}")
             return [] 
@@ -179,25 +261,26 @@ class DictManager:
         except Exception as e:
             return False, f"恢复失败: {e}"
     
-    def calculate_word_frequencies(self, db_handler, min_freq=100, max_freq=1000):
+    def calculate_word_frequencies(self, db_handler, min_freq=100, max_freq=1000, segmenter=None):
         """从聊天记录计算词频
         
         Args:
             db_handler: DatabaseHandler实例
             min_freq: 最小词频
             max_freq: 最大词频
+            segmenter: 可选的ParallelSegmenter，用于多进程分词
         """
         try:
             # 获取所有消息内容
-            conn = sqlite3.connect(db_handler.db_path)
+            conn = db_handler.get_connection()
             cursor = conn.cursor()
-            cursor.execute("SELECT content FROM messages WHERE content IS NOT NULL")
+            cursor.execute("SELECT msg_id, content FROM messages WHERE content IS NOT NULL")
             contents = cursor.fetchall()
             
-            # 分词统计
+            # 分词统计，复用按词典版本缓存的分词结果
+            token_store = TokenStore(db_handler, dict_path=self.dict_path, segmenter=segmenter)
             word_freq = defaultdict(int)
-            for content, in contents:
-                words = jieba.cut(content)
+            for words in token_store.iter_tokens(contents):
                 for word in words:
                     if len(word) > 1:  # 忽略单字
                         word_freq[word] += 1
@@ -216,37 +299,20 @@ class DictManager:
             self.logger.error(f"计算词频失败: {e}")
             return {}
         finally:
-            conn.close()
+            db_handler.release_connection(conn)
     
-    def update_frequencies(self, db_handler):
+    def update_frequencies(self, db_handler, segmenter=None):
         """更新词典中的词频"""
         try:
-            # 获取当前词典内容
-            current_words = self.list_words()
-            current_dict = {word[0]: (word[1], word[2] if len(word) > 2 else None) 
-                          for word in current_words}
-            
             # 计算新词频
-            new_frequencies = self.calculate_word_frequencies(db_handler)
+            new_frequencies = self.calculate_word_frequencies(db_handler, segmenter=segmenter)
             
-            # 更新词典文件
-            with open(self.dict_path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-            
-            with open(self.dict_path, 'w', encoding='utf-8') as f:
-                for line in lines:
-                    if line.strip() and not line.startswith('#'):
-                        word = line.split()[0]
-                        if word in new_frequencies:
-                            pos = current_dict.get(word, (None, None))[1]
-                            new_line = f"{word} {new_frequencies[word]}"
-                            if pos:
-                                new_line += f" {pos}"
-                            f.write(new_line + '\n')
-                        else:
-                            f.write(line)
-                    else:
-                        f.write(line)
+            # 更新词典中已有词条的词频，保留词性
+            self._ensure_loaded()
+            for word, parts in self._entries.items():
+                if word in new_frequencies:
+                    parts[1] = str(new_frequencies[word])
+            self._flush()
             
             return True, "词频更新成功"
         except Exception as e:
@@ -264,16 +330,11 @@ class DictManager:
                 return False, "要合并的词典文件不存在"
             
             # 读取当前词典
-            current_dict = {}
-            with open(self.dict_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if line and not line.startswith('#'):
-                        parts = line.split()
-                        word = parts[0]
-                        freq = int(parts[1])
-                        pos = parts[2] if len(parts) > 2 else None
-                        current_dict[word] = (freq, pos)
+            self._ensure_loaded()
+            current_dict = {
+                word: (int(parts[1]), parts[2] if len(parts) > 2 else None)
+                for word, parts in self._entries.items()
+            }
             
             # 读取要合并的词典
             other_dict = {}
@@ -310,20 +371,18 @@ class DictManager:
             # 备份当前词典
             self.backup_dict()
             
-            # 写入合并后的词典
-            with open(self.dict_path, 'w', encoding='utf-8') as f:
-                f.write("# 自定义词典格式说明：\n")
-                f.write("# 每行一个词条，格式为：词语 词频 词性(可选)\n")
-                f.write("# 示例：\n")
-                
-                # 按词频降序排序
-                sorted_words = sorted(merged_dict.items(), key=lambda x: x[1][0], reverse=True)
-                
-                for word, (freq, pos) in sorted_words:
-                    line = f"{word} {freq}"
-                    if pos:
-                        line += f" {pos}"
-                    f.write(line + '\n')
+            # 写入合并后的词典，按词频降序排序
+            sorted_words = sorted(merged_dict.items(), key=lambda x: x[1][0], reverse=True)
+            self._lines = [
+                ('raw', "# 自定义词典格式说明："),
+                ('raw', "# 每行一个词条，格式为：词语 词频 词性(可选)"),
+                ('raw', "# 示例："),
+            ] + [('entry', word) for word, _ in sorted_words]
+            self._entries = {
+                word: self._make_entry(word, freq, pos)
+                for word, (freq, pos) in sorted_words
+            }
+            self._flush()
             
             return True, f"成功合并词典，共 {len(merged_dict)} 个词条"
             
@@ -332,6 +391,8 @@ class DictManager:
     
     def visualize_dict(self, output_dir="analysis_results"):
         """可视化词典数据"""
+        import matplotlib.pyplot as plt
+        from wordcloud import WordCloud
         try:
             os.makedirs(output_dir, exist_ok=True)
             
@@ -391,36 +452,9 @@ class DictManager:
     def has_word(self, word):
         """检查词典中是否存在指定词语"""
         try:
-            with open(self.dict_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if line and not line.startswith('#'):
-                        parts = line.split()
-                        if parts[0] == word:
-                            return True
-            return False
+            self._ensure_loaded()
+            return word in self._entries
             
         except Exception as e:
             self.logger.error(f"检查词语是否存在失败: {e}")
             return False
-            
-    def add_word(self, word, freq=500, pos=None):
-        """添加新词到词典"""
-        try:
-            if self.has_word(word):
-                return False, "词语已存在"
-                
-            # 构建词条
-            entry = f"{word} {freq}"
-            if pos:
-                entry += f" {pos}"
-                
-            # 添加到词典
-            with open(self.dict_path, 'a', encoding='utf-8') as f:
-                f.write(f"\n{entry}")
-                
-            return True, "添加成功"
-            
-        except Exception as e:
-            self.logger.error(f"添加词语失败: {e}")
-            return False, f"添加失败: {e}" 
\ No newline at end of file
@@ -0,0 +1,125 @@
+import io
+import os
+import csv
+import gzip
+import json
+import logging
+
+# 压缩方式对应的文件后缀
+_COMPRESSION_SUFFIX = {
+    None: '',
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+# 导出格式对应的文件后缀
+_FORMAT_SUFFIX = {
+    'csv': '.csv',
+    'json': '.json',
+    'ndjson': '.ndjson',
+}
+
+class StreamingExporter:
+    """流式导出器
+
+    按固定批次从游标读取数据并逐行写出，内存占用与结果集大小无关。
+    支持的格式：
+    - csv: 带BOM的UTF-8，方便Excel直接打开
+    - json: 对象数组，与原先 DataFrame.to_json(orient='records') 的结构一致
+    - ndjson: 每行一个JSON对象
+    """
+
+    def __init__(self, chunk_size=5000, compression=None, progress_callback=None):
+        """
+        :param chunk_size: 每次从游标读取的行数
+        :param compression: None / 'gzip' / 'zstd'
+        :param progress_callback: 进度回调 callback(已写出行数, 总行数或None)
+        """
+        if compression not in _COMPRESSION_SUFFIX:
+            raise ValueError(f"不支持的压缩方式: {compression}")
+        self.chunk_size = chunk_size
+        self.compression = compression
+        self.progress_callback = progress_callback
+        self.logger = logging.getLogger(__name__)
+
+    def build_path(self, directory, filename, format='csv'):
+        """根据格式和压缩方式生成完整的导出文件路径"""
+        if format not in _FORMAT_SUFFIX:
+            raise ValueError(f"不支持的导出格式: {format}")
+        return os.path.join(directory, filename + _FORMAT_SUFFIX[format] + _COMPRESSION_SUFFIX[self.compression])
+
+    def _open(self, output_path, encoding):
+        """按压缩方式打开文本输出流"""
+        if self.compression == 'gzip':
+            return gzip.open(output_path, 'wt', encoding=encoding, newline='')
+        if self.compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError:
+                raise ValueError("zstd压缩需要安装zstandard: pip install zstandard")
+            raw = open(output_path, 'wb')
+            stream = zstandard.ZstdCompressor().stream_writer(raw, closefd=True)
+            return io.TextIOWrapper(stream, encoding=encoding, newline='')
+        return open(output_path, 'w', encoding=encoding, newline='')
+
+    def _iter_chunks(self, cursor):
+        """从游标按批次读取"""
+        while True:
+            rows = cursor.fetchmany(self.chunk_size)
+            if not rows:
+                break
+            yield rows
+
+    def export(self, cursor, columns, output_path, format='csv', headers=None, transform=None, total=None):
+        """把游标中的数据流式写入文件
+
+        Args:
+            cursor: 已执行查询的游标
+            columns: 各列的字段名，用作JSON的键
+            output_path: 输出文件路径
+            format: 'csv' / 'json' / 'ndjson'
+            headers: CSV表头，默认与columns相同
+            transform: 可选的行转换函数，接收一行返回新的一行
+            total: 总行数，仅用于进度回调
+
+        Returns:
+            int: 写出的行数
+        """
+        if format not in _FORMAT_SUFFIX:
+            raise ValueError(f"不支持的导出格式: {format}")
+
+        directory = os.path.dirname(output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        written = 0
+        encoding = 'utf-8-sig' if format == 'csv' else 'utf-8'
+        with self._open(output_path, encoding) as f:
+            if format == 'csv':
+                writer = csv.writer(f)
+                writer.writerow(headers or columns)
+            elif format == 'json':
+                f.write('[')
+
+            for rows in self._iter_chunks(cursor):
+                if transform:
+                    rows = [transform(row) for row in rows]
+
+                if format == 'csv':
+                    writer.writerows(rows)
+                else:
+                    lines = [json.dumps(dict(zip(columns, row)), ensure_ascii=False) for row in rows]
+                    if format == 'json':
+                        f.write((',\n' if written else '\n') + ',\n'.join(lines))
+                    else:
+                        f.write('\n'.join(lines) + '\n')
+
+                written += len(rows)
+                if self.progress_callback:
+                    self.progress_callback(written, total)
+
+            if format == 'json':
+                f.write('\n]' if written else ']')
+
+        self.logger.info(f"导出完成: {output_path}, 共 {written} 行")
+        return written
@@ -0,0 +1,214 @@
+import os
+import re
+import shutil
+import logging
+import threading
+import subprocess
+from xml.sax.saxutils import escape
+
+logger = logging.getLogger(__name__)
+
+# PATH中找不到dot时尝试的常见安装路径
+_COMMON_PATHS = [
+    r'C:\Program Files\Graphviz\bin',
+    r'C:\Program Files (x86)\Graphviz\bin',
+    r'C:\Graphviz\bin',
+]
+
+_probe_lock = threading.Lock()
+_probe_result = None
+
+def probe_graphviz():
+    """探测Graphviz的dot命令，每个进程只探测一次
+
+    Returns:
+        dict: {'dot': dot可执行文件路径或None, 'formats': 支持的输出格式集合}
+    """
+    global _probe_result
+    with _probe_lock:
+        if _probe_result is not None:
+            return _probe_result
+
+        dot = shutil.which('dot')
+        if dot is None:
+            for path in _COMMON_PATHS:
+                candidate = os.path.join(path, 'dot.exe')
+                if os.path.exists(candidate):
+                    dot = candidate
+                    break
+
+        formats = set()
+        if dot:
+            try:
+                # 指定不存在的格式时dot会在错误信息中列出所有支持的格式
+                result = subprocess.run([dot, '-T?'], capture_output=True, text=True, timeout=10)
+                match = re.search(r'Use one of:(.*)', result.stderr, re.S)
+                if match:
+                    formats = {fmt.split(':')[0] for fmt in match.group(1).split()}
+            except (OSError, subprocess.SubprocessError) as e:
+                logger.warning(f"Graphviz探测失败: {e}")
+                dot = None
+
+        if dot:
+            logger.info(f"找到Graphviz: {dot}, 支持 {len(formats)} 种输出格式")
+        else:
+            logger.info("未找到Graphviz，思维导图将输出为SVG和DOT文本")
+        _probe_result = {'dot': dot, 'formats': formats}
+        return _probe_result
+
+def _quote(value):
+    """DOT中的字符串字面量"""
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+
+def _format_attrs(attrs):
+    return ', '.join(f'{key}={_quote(value)}' for key, value in attrs.items())
+
+class MindMapGraph:
+    """思维导图的有向图
+
+    接口与 graphviz.Digraph 常用部分一致（attr/node/edge/source/render）。
+    有Graphviz时直接调用探测到的dot命令渲染；否则在进程内按层级布局输出SVG，并保存DOT源文件。
+    """
+
+    def __init__(self, comment=None):
+        self.comment = comment
+        self.graph_attrs = {}
+        self.node_attrs = {}
+        self.edge_attrs = {}
+        self.nodes = {}   # name -> (label, attrs)，保持添加顺序
+        self.edges = []
+
+    def attr(self, kind=None, **attrs):
+        """设置图属性，kind为'node'或'edge'时设置默认节点或边属性"""
+        target = {'node': self.node_attrs, 'edge': self.edge_attrs}.get(kind, self.graph_attrs)
+        target.update(attrs)
+
+    def node(self, name, label=None, **attrs):
+        self.nodes[name] = (label if label is not None else name, attrs)
+
+    def edge(self, tail, head, **attrs):
+        self.edges.append((tail, head, attrs))
+
+    @property
+    def source(self):
+        """DOT源文本"""
+        lines = []
+        if self.comment:
+            lines.append(f'// {self.comment}')
+        lines.append('digraph {')
+        for key, value in self.graph_attrs.items():
+            lines.append(f'\t{key}={_quote(value)}')
+        if self.node_attrs:
+            lines.append(f'\tnode [{_format_attrs(self.node_attrs)}]')
+        if self.edge_attrs:
+            lines.append(f'\tedge [{_format_attrs(self.edge_attrs)}]')
+        for name, (label, attrs) in self.nodes.items():
+            lines.append(f'\t{_quote(name)} [{_format_attrs(dict(label=label, **attrs))}]')
+        for tail, head, attrs in self.edges:
+            suffix = f' [{_format_attrs(attrs)}]' if attrs else ''
+            lines.append(f'\t{_quote(tail)} -> {_quote(head)}{suffix}')
+        lines.append('}')
+        return '\n'.join(lines) + '\n'
+
+    def _levels(self):
+        """从入度为0的节点开始按层分组"""
+        children = {name: [] for name in self.nodes}
+        indegree = {name: 0 for name in self.nodes}
+        for tail, head, _ in self.edges:
+            if tail in children and head in indegree:
+                children[tail].append(head)
+                indegree[head] += 1
+
+        depth = {}
+        queue = [name for name in self.nodes if indegree[name] == 0]
+        for name in queue:
+            depth[name] = 0
+        while queue:
+            name = queue.pop(0)
+            for child in children[name]:
+                if child not in depth:
+                    depth[child] = depth[name] + 1
+                    queue.append(child)
+        for name in self.nodes:  # 环上的节点放在最后一层
+            depth.setdefault(name, max(depth.values(), default=-1) + 1)
+
+        levels = {}
+        for name in self.nodes:
+            levels.setdefault(depth[name], []).append(name)
+        return [levels[d] for d in sorted(levels)]
+
+    def to_svg(self, node_width=180, node_height=36, h_gap=20, v_gap=60, font_size=12):
+        """在进程内按层级从上到下布局，生成SVG"""
+        levels = self._levels()
+        width = max((len(level) for level in levels), default=1) * (node_width + h_gap) + h_gap
+        height = len(levels) * (node_height + v_gap) + v_gap
+
+        positions = {}
+        for row, level in enumerate(levels):
+            offset = (width - len(level) * (node_width + h_gap) + h_gap) / 2
+            for col, name in enumerate(level):
+                x = offset + col * (node_width + h_gap)
+                y = v_gap / 2 + row * (node_height + v_gap)
+                positions[name] = (x, y)
+
+        font = self.node_attrs.get('fontname', 'SimHei')
+        parts = [
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:.0f}" height="{height:.0f}" '
+            f'font-family="{escape(font)}" font-size="{font_size}">'
+        ]
+        for tail, head, _ in self.edges:
+            if tail in positions and head in positions:
+                x1, y1 = positions[tail]
+                x2, y2 = positions[head]
+                parts.append(
+                    f'<line x1="{x1 + node_width / 2:.0f}" y1="{y1 + node_height:.0f}" '
+                    f'x2="{x2 + node_width / 2:.0f}" y2="{y2:.0f}" stroke="#666"/>'
+                )
+        for name, (label, attrs) in self.nodes.items():
+            x, y = positions[name]
+            fill = attrs.get('fillcolor', self.node_attrs.get('fillcolor', '#ffffff'))
+            parts.append(
+                f'<rect x="{x:.0f}" y="{y:.0f}" width="{node_width}" height="{node_height}" '
+                f'rx="6" fill="{escape(fill)}" stroke="#999"/>'
+            )
+            parts.append(
+                f'<text x="{x + node_width / 2:.0f}" y="{y + node_height / 2:.0f}" '
+                f'text-anchor="middle" dominant-baseline="middle">{escape(str(label))}</text>'
+            )
+        parts.append('</svg>')
+        return '\n'.join(parts) + '\n'
+
+    def render(self, output_path, format='png'):
+        """渲染到文件
+
+        Args:
+            output_path: 不含后缀的输出路径
+            format: Graphviz输出格式
+
+        Returns:
+            str: 生成的文件路径；没有Graphviz或不支持该格式时为进程内生成的SVG
+        """
+        directory = os.path.dirname(output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        probe = probe_graphviz()
+        if probe['dot'] and (not probe['formats'] or format in probe['formats']):
+            target = f"{output_path}.{format}"
+            try:
+                subprocess.run(
+                    [probe['dot'], f'-T{format}', '-o', target],
+                    input=self.source.encode('utf-8'),
+                    capture_output=True,
+                    check=True
+                )
+                return target
+            except (OSError, subprocess.CalledProcessError) as e:
+                logger.warning(f"Graphviz渲染失败，改为输出SVG: {e}")
+
+        with open(f"{output_path}.dot", 'w', encoding='utf-8') as f:
+            f.write(self.source)
+        target = f"{output_path}.svg"
+        with open(target, 'w', encoding='utf-8') as f:
+            f.write(self.to_svg())
+        return target
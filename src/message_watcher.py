@@ -0,0 +1,171 @@
+import time
+import logging
+import threading
+
+try:
+    import uiautomation as auto
+except ImportError:  # 非Windows环境没有UI Automation事件，只能轮询
+    auto = None
+
+# IUIAutomation::AddStructureChangedEventHandler 的范围：列表自身及其直接子项
+_TREE_SCOPE_ELEMENT_AND_CHILDREN = 0x1 | 0x2
+
+class MessageWatcher:
+    """事件驱动的消息采集
+
+    订阅"消息"列表的 UI Automation StructureChanged 事件（新增、删除、批量刷新子项），
+    事件处理只负责唤醒等待中的采集线程，由采集线程调用 get_messages 增量解析。
+    订阅失败（非Windows、comtypes接口不可用）时退化为自适应轮询：
+    有新消息时按最短间隔扫描，连续没有新消息时间隔按指数退避增长到上限。
+    有事件订阅时轮询仍以较长的间隔兜底，防止漏掉事件。
+    等待使用 threading.Event，空闲时不占用CPU。
+    """
+
+    def __init__(self, monitor, min_interval=0.05, max_interval=2.0,
+                 event_max_interval=10.0, settle=0.02):
+        """
+        :param monitor: WeChatMonitor实例
+        :param min_interval: 最短扫描间隔（秒）
+        :param max_interval: 没有事件订阅时退避的间隔上限（秒）
+        :param event_max_interval: 有事件订阅时兜底轮询的间隔上限（秒）
+        :param settle: 收到事件后等待同一批事件到齐的时间（秒），一次扫描处理一批新消息
+        """
+        self.monitor = monitor
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.event_max_interval = event_max_interval
+        self.settle = settle
+        self.logger = logging.getLogger(__name__)
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._event_at = None   # 最早一个未处理事件的时间
+        self._stats = {
+            'events': 0,          # 收到的结构变化事件数
+            'scans': 0,           # 扫描次数
+            'event_scans': 0,     # 由事件触发的扫描次数
+            'delivered': 0,       # 交付的新消息数
+            'latency_ms': 0.0,    # 最近一次从事件到交付完成的耗时
+            'subscribed': False,  # 当前是否订阅了事件
+        }
+
+    def notify(self):
+        """唤醒采集线程立即扫描，事件处理函数和回放时调用"""
+        if self._event_at is None:
+            self._event_at = time.perf_counter()
+        self._stats['events'] += 1
+        self._wake.set()
+
+    def stop(self):
+        """停止正在进行的 run"""
+        self._stop.set()
+        self._wake.set()
+
+    def _subscribe(self, message_list):
+        """订阅消息列表的结构变化事件
+
+        Returns:
+            tuple: 用于取消订阅的 (IUIAutomation, 元素, 处理对象)，不可用时为None
+        """
+        if auto is None:
+            return None
+        try:
+            import comtypes
+            client = auto._AutomationClient.instance()
+            interface = client.UIAutomationCore.IUIAutomationStructureChangedEventHandler
+            watcher = self
+
+            class StructureChangedHandler(comtypes.COMObject):
+                _com_interfaces_ = [interface]
+
+                def IUIAutomationStructureChangedEventHandler_HandleStructureChangedEvent(self, sender, changeType, runtimeId):
+                    # 在UI Automation的事件线程中调用，不能在这里访问控件
+                    watcher.notify()
+
+            handler = StructureChangedHandler()
+            element = message_list.Element
+            client.IUIAutomation.AddStructureChangedEventHandler(
+                element, _TREE_SCOPE_ELEMENT_AND_CHILDREN, None, handler
+            )
+            self.logger.info("已订阅消息列表的结构变化事件")
+            return client.IUIAutomation, element, handler
+        except Exception as e:
+            self.logger.warning(f"订阅消息列表事件失败，改为自适应轮询: {e}")
+            return None
+
+    def _unsubscribe(self, subscription):
+        if not subscription:
+            return
+        automation, element, handler = subscription
+        try:
+            automation.RemoveStructureChangedEventHandler(element, handler)
+        except Exception as e:
+            self.logger.debug(f"取消事件订阅失败: {e}")
+
+    def run(self, sink, last_time=None, duration=None):
+        """持续采集新消息，直到调用 stop() 或超过 duration
+
+        按下 Ctrl+C 时先取消事件订阅，再继续抛出 KeyboardInterrupt。
+
+        Args:
+            sink: 每条新消息解析出来后立即调用 sink(message)；交付到队列时传入 queue.put
+            last_time: 只交付晚于该时间的消息
+            duration: 最长采集时间（秒），None表示一直采集
+
+        Returns:
+            datetime: 最后一条有效消息的时间，可作为下一次 run 的 last_time
+        """
+        if not self.monitor.wx_window:
+            self.logger.warning("未找到微信窗口")
+            return last_time
+
+        self._stop.clear()
+        subscription = None
+        message_list = self.monitor.wx_window.ListControl(Name="消息")
+        if message_list.Exists(maxSearchSeconds=2):
+            subscription = self._subscribe(message_list)
+        self._stats['subscribed'] = subscription is not None
+        ceiling = self.event_max_interval if subscription else self.max_interval
+
+        deadline = time.monotonic() + duration if duration is not None else None
+        interval = self.min_interval
+        try:
+            while not self._stop.is_set():
+                timeout = interval
+                if deadline is not None:
+                    timeout = min(timeout, deadline - time.monotonic())
+                    if timeout <= 0:
+                        break
+                triggered = self._wake.wait(timeout)
+                if self._stop.is_set():
+                    break
+                if triggered:
+                    # 新消息通常伴随多个子项事件，稍等片刻合并为一次扫描
+                    time.sleep(self.settle)
+                    self._wake.clear()
+                    self._stats['event_scans'] += 1
+                event_at, self._event_at = self._event_at, None
+
+                messages = self.monitor.get_messages(last_time, sink=sink)
+                self._stats['scans'] += 1
+                if messages:
+                    valid_messages = [
+                        msg for msg in messages
+                        if msg['sender_name'] and msg['sender_name'].strip()
+                    ]
+                    if valid_messages:
+                        last_time = valid_messages[-1]['send_time']
+                    self._stats['delivered'] += len(messages)
+                    if event_at is not None:
+                        self._stats['latency_ms'] = (time.perf_counter() - event_at) * 1000
+                    interval = self.min_interval
+                else:
+                    interval = min(interval * 2, ceiling)
+        finally:
+            self._unsubscribe(subscription)
+            self._stats['subscribed'] = False
+        return last_time
+
+    def get_metrics(self):
+        """获取采集统计"""
+        return dict(self._stats)
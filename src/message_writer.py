@@ -0,0 +1,183 @@
+import queue
+import threading
+import time
+import logging
+
+class MessageWriter:
+    """后台写入线程：采集端把解析好的消息放入有界队列，写入线程按批次落库"""
+
+    _STOP = object()  # 停止信号
+
+    def __init__(self, db, max_queue_size=10000, batch_size=200, flush_interval=1.0,
+                 max_retries=3, retry_interval=0.5):
+        """
+        :param db: DatabaseHandler实例
+        :param max_queue_size: 队列容量，队列满时put会阻塞（背压）
+        :param batch_size: 攒够多少条写一次
+        :param flush_interval: 最长等待多少秒写一次
+        :param max_retries: 写入失败后的重试次数，仍失败的消息计入failed
+        :param retry_interval: 第一次重试前等待的秒数，之后每次加倍
+        """
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_interval = retry_interval
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.logger = logging.getLogger(__name__)
+
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'enqueued': 0,         # 入队消息数
+            'inserted': 0,         # 实际新增消息数
+            'skipped': 0,          # 重复跳过的消息数
+            'failed': 0,           # 重试后仍未写入的消息数
+            'retries': 0,          # 写入失败后的重试次数
+            'batches': 0,          # 已写入批次数
+            'blocked_puts': 0,     # 因队列满而阻塞的put次数
+            'blocked_seconds': 0.0,  # put累计阻塞时长
+            'max_depth': 0,        # 队列最大深度
+        }
+
+    def start(self):
+        """启动写入线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="MessageWriter", daemon=True)
+        self._thread.start()
+        self.logger.info("消息写入线程已启动")
+
+    def put(self, chat_id, message, timeout=None):
+        """提交一条消息，队列满时阻塞直到有空位或超时
+
+        Returns:
+            bool: 是否成功入队
+        """
+        item = (chat_id, message)
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            started = time.monotonic()
+            try:
+                self.queue.put(item, timeout=timeout)
+            except queue.Full:
+                self.logger.warning("写入队列已满，消息入队超时")
+                return False
+            finally:
+                with self._stats_lock:
+                    self._stats['blocked_puts'] += 1
+                    self._stats['blocked_seconds'] += time.monotonic() - started
+
+        with self._stats_lock:
+            self._stats['enqueued'] += 1
+            self._stats['max_depth'] = max(self._stats['max_depth'], self.queue.qsize())
+        return True
+
+    def put_many(self, chat_id, messages, timeout=None):
+        """批量提交消息，返回成功入队的条数"""
+        return sum(1 for message in messages if self.put(chat_id, message, timeout))
+
+    def flush(self):
+        """阻塞直到队列中已提交的消息全部处理完
+
+        Returns:
+            int: 等待期间重试后仍写入失败的消息数，0表示全部写入
+        """
+        with self._stats_lock:
+            failed = self._stats['failed']
+        self.queue.join()
+        with self._stats_lock:
+            return self._stats['failed'] - failed
+
+    def stop(self, timeout=None):
+        """写完队列中剩余的消息后停止写入线程"""
+        if not self._thread:
+            return
+        self.queue.put(self._STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            self.logger.warning(f"写入线程未能在超时内退出，剩余 {self.queue.qsize()} 条")
+        else:
+            self.logger.info(f"消息写入线程已停止: {self.get_metrics()}")
+        self._thread = None
+
+    def get_metrics(self):
+        """获取队列深度和写入统计"""
+        with self._stats_lock:
+            metrics = dict(self._stats)
+        metrics['queue_depth'] = self.queue.qsize()
+        metrics['queue_capacity'] = self.queue.maxsize
+        return metrics
+
+    def _run(self):
+        """写入线程主循环：按数量或时间攒批"""
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    self.queue.task_done()
+                    stopping = True
+                    # 停止前把已入队的消息一并写完
+                    while True:
+                        try:
+                            item = self.queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        batch.append(item)
+                    break
+                batch.append(item)
+
+            if batch:
+                self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        """按聊天分组写入一个批次"""
+        try:
+            grouped = {}
+            for chat_id, message in batch:
+                grouped.setdefault(chat_id, []).append(message)
+
+            for chat_id, messages in grouped.items():
+                self._write_group(chat_id, messages)
+
+            with self._stats_lock:
+                self._stats['batches'] += 1
+            self.logger.debug(f"写入批次完成: {len(batch)} 条, 剩余队列 {self.queue.qsize()} 条")
+
+        finally:
+            for _ in batch:
+                self.queue.task_done()
+
+    def _write_group(self, chat_id, messages):
+        """写入同一聊天的消息，失败时整组已回滚，按退避间隔重试"""
+        delay = self.retry_interval
+        for attempt in range(self.max_retries + 1):
+            try:
+                inserted, skipped = self.db.save_messages(chat_id, messages)
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    self.logger.error(f"写入 {len(messages)} 条消息失败，已重试 {self.max_retries} 次: {e}")
+                    with self._stats_lock:
+                        self._stats['failed'] += len(messages)
+                    return
+                self.logger.warning(f"写入 {len(messages)} 条消息失败，{delay:.1f}s 后重试: {e}")
+                with self._stats_lock:
+                    self._stats['retries'] += 1
+                time.sleep(delay)
+                delay *= 2
+                continue
+
+            with self._stats_lock:
+                self._stats['inserted'] += inserted
+                self._stats['skipped'] += skipped
+            return
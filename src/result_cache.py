@@ -0,0 +1,173 @@
+import logging
+import threading
+from collections import OrderedDict
+
+class ResultCache:
+    """分析结果缓存
+
+    缓存键为 (方法名, chat_id, 时间范围, 词典版本, 附加参数)，每条结果同时记录计算时
+    对应消息范围的水位线 (最大rowid, 消息数, 最大send_ts, 修改计数)。
+    修改计数来自 message_changes 表，任何消息的修改或删除都会使其变化。
+    - 水位线不变：直接返回缓存结果
+    - 只有追加的新消息：可合并的聚合结果只对新增部分计算后合并
+    - 其他变化（删除、修改、词典变化）：重新计算
+    """
+
+    def __init__(self, db, version_func=None, max_entries=64):
+        """
+        :param db: DatabaseHandler实例
+        :param version_func: 返回当前自定义词典版本的函数
+        :param max_entries: 最多缓存的结果数，超出后淘汰最久未使用的
+        """
+        self.db = db
+        self.version_func = version_func
+        self.max_entries = max_entries
+        self.logger = logging.getLogger(__name__)
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'merges': 0, 'misses': 0}
+
+    def _range_sql(self, chat_id, start_ts, end_ts):
+        """消息范围的查询条件"""
+        conditions = []
+        params = []
+        if chat_id:
+            conditions.append("chat_id = ?")
+            params.append(chat_id)
+        if start_ts is not None:
+            conditions.append("send_ts >= ?")
+            params.append(start_ts)
+        if end_ts is not None:
+            conditions.append("send_ts <= ?")
+            params.append(end_ts)
+        return (" AND ".join(conditions) or "1 = 1"), params
+
+    def watermark(self, chat_id=None, start_ts=None, end_ts=None):
+        """获取消息范围的水位线 (最大rowid, 消息数, 最大send_ts, 修改计数)"""
+        where, params = self._range_sql(chat_id, start_ts, end_ts)
+        conn = self.db.get_connection()
+        try:
+            row = conn.execute(f"""
+            SELECT COALESCE(MAX(rowid), 0), COUNT(*), MAX(send_ts),
+                (SELECT modified FROM message_changes WHERE id = 1)
+            FROM messages
+            WHERE {where}
+            """, params).fetchone()
+            return tuple(row)
+        finally:
+            self.db.release_connection(conn)
+
+    def _appended_only(self, old, new, chat_id, start_ts, end_ts):
+        """判断从old到new之间范围内的变化是否只有追加的新消息"""
+        if new[3] != old[3] or new[1] < old[1] or new[0] < old[0]:
+            return False
+        where, params = self._range_sql(chat_id, start_ts, end_ts)
+        conn = self.db.get_connection()
+        try:
+            appended = conn.execute(f"""
+            SELECT COUNT(*) FROM messages
+            WHERE rowid > ? AND rowid <= ? AND {where}
+            """, [old[0], new[0]] + params).fetchone()[0]
+        finally:
+            self.db.release_connection(conn)
+        # 修改计数不变说明没有修改和删除，新增行数还应正好等于消息数的增量
+        return appended == new[1] - old[1]
+
+    def _key(self, method, chat_id, start_ts, end_ts, extra):
+        version = self.version_func() if self.version_func else None
+        return (method, chat_id, start_ts, end_ts, version, extra)
+
+    def _store(self, key, mark, result):
+        with self._lock:
+            self._entries[key] = (mark, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get(self, method, compute, chat_id=None, start_ts=None, end_ts=None, extra=None, validate=None):
+        """水位线不变时返回缓存结果，否则调用compute()重新计算
+
+        Args:
+            method: 方法名
+            compute: 无参数的计算函数
+            chat_id, start_ts, end_ts: 结果依赖的消息范围
+            extra: 其他影响结果的参数（需可哈希），如输出目录
+            validate: 可选的校验函数，接收缓存结果，返回False时视为失效（如输出文件已被删除）
+        """
+        mark = self.watermark(chat_id, start_ts, end_ts)
+        key = self._key(method, chat_id, start_ts, end_ts, extra)
+        entry = self._lookup(key)
+        if entry is not None and entry[0] == mark and (validate is None or validate(entry[1])):
+            self._count('hits')
+            self.logger.info(f"命中分析结果缓存: {method}")
+            return entry[1]
+
+        self._count('misses')
+        result = compute()
+        # 计算过程中可能更新了词典（如思维导图的新词发现），按计算后的版本保存
+        self._store(self._key(method, chat_id, start_ts, end_ts, extra), mark, result)
+        return result
+
+    def aggregate(self, method, compute, merge, chat_id=None, start_ts=None, end_ts=None, extra=None):
+        """可合并的聚合结果，只有追加的新消息时增量计算
+
+        Args:
+            method: 方法名
+            compute: compute(after_rowid, until_rowid)，只计算rowid在
+                (after_rowid, until_rowid] 内的消息，after_rowid为None时从头计算
+            merge: merge(旧结果, 增量结果)，返回合并后的结果
+            chat_id, start_ts, end_ts, extra: 同 get
+
+        Returns:
+            tuple: (结果, 是否与上次结果相同)
+        """
+        mark = self.watermark(chat_id, start_ts, end_ts)
+        key = self._key(method, chat_id, start_ts, end_ts, extra)
+        entry = self._lookup(key)
+
+        if entry is not None:
+            old_mark, old_result = entry
+            if old_mark == mark:
+                self._count('hits')
+                self.logger.info(f"命中分析结果缓存: {method}")
+                return old_result, True
+            if self._appended_only(old_mark, mark, chat_id, start_ts, end_ts):
+                self._count('merges')
+                self.logger.info(f"增量更新分析结果: {method}, 新增 {mark[1] - old_mark[1]} 条消息")
+                # 只计算到当前水位线，计算期间再追加的消息留给下次增量
+                result = merge(old_result, compute(old_mark[0], mark[0]))
+                self._store(key, mark, result)
+                return result, False
+
+        self._count('misses')
+        result = compute(None, mark[0])
+        self._store(key, mark, result)
+        return result, False
+
+    def invalidate(self, method=None):
+        """清除缓存，method为None时清除全部"""
+        with self._lock:
+            if method is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k[0] == method]:
+                    del self._entries[key]
+
+    def get_metrics(self):
+        """获取缓存命中统计"""
+        with self._lock:
+            metrics = dict(self._stats)
+            metrics['entries'] = len(self._entries)
+        return metrics
@@ -0,0 +1,216 @@
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from src.backfill import Backfill
+
+class ChatScheduler:
+    """无人值守的多聊天轮转采集
+
+    每次选择"消息频率 × 距上次访问的时间"最大的聊天，频率高的群被更频繁地访问；
+    距上次访问超过 max_staleness 的聊天优先，保证低频聊天也不会被饿死。
+    切换聊天（打开聊天窗口）的耗时按实测值平滑估计，每次访问至少停留
+    switch_ratio 倍的切换耗时，使切换开销不超过总时间的 1/(switch_ratio+1)；
+    选中的仍是当前聊天时不切换，直接继续采集。
+    """
+
+    def __init__(self, monitor, db, writer, chat_names, min_dwell=5.0, max_dwell=60.0,
+                 switch_ratio=4.0, max_staleness=300.0, rate_window=3600, rate_floor=0.1,
+                 smoothing=0.3):
+        """
+        :param monitor: WeChatMonitor实例
+        :param db: DatabaseHandler实例
+        :param writer: 已启动的MessageWriter
+        :param chat_names: 要轮转采集的聊天名称
+        :param min_dwell: 每次访问的最短停留时间（秒）
+        :param max_dwell: 每次访问的最长停留时间（秒）
+        :param switch_ratio: 停留时间至少为切换耗时的倍数
+        :param max_staleness: 聊天两次访问之间的最长间隔（秒），超过后优先访问
+        :param rate_window: 启动时用最近多少秒的已存消息估计消息频率
+        :param rate_floor: 消息频率的下限（条/分钟），没有消息的聊天也按该频率参与排序
+        :param smoothing: 每次访问后更新消息频率的平滑系数
+        """
+        self.monitor = monitor
+        self.db = db
+        self.writer = writer
+        self.min_dwell = min_dwell
+        self.max_dwell = max_dwell
+        self.switch_ratio = switch_ratio
+        self.max_staleness = max_staleness
+        self.rate_window = rate_window
+        self.rate_floor = rate_floor
+        self.smoothing = smoothing
+        self.logger = logging.getLogger(__name__)
+
+        self.switch_cost = None  # 打开聊天窗口的平滑耗时（秒）
+        self.switches = 0
+        self._current = None
+        self._stop = threading.Event()
+        self.backfill = Backfill(monitor, db)
+        self.chats = [self._load_chat(name) for name in chat_names]
+
+    def _load_chat(self, chat_name):
+        """读取聊天的已存进度，用最近一段时间的消息数估计初始频率"""
+        chat_id, chat_name = self.db.create_chat(chat_name)
+        since = datetime.now() - timedelta(seconds=self.rate_window)
+        recent = self.db.count_messages_since(chat_id, since)
+        return {
+            'chat_name': chat_name,
+            'chat_id': chat_id,
+            'chat_type': 1,
+            'last_time': self.db.get_last_message_time(chat_id),
+            'rate': recent * 60.0 / self.rate_window,  # 条/分钟
+            'visits': 0,
+            'messages': 0,
+            'failures': 0,
+            'backfilled': 0,     # 最近一次切换时补采到的新消息数
+            'last_visit': None,  # 上次访问结束的时间（time.monotonic）
+            'last_gap': 0.0,     # 最近一次访问前距上次访问的间隔（秒）
+            'max_gap': 0.0,
+        }
+
+    def _staleness(self, chat, now):
+        if chat['last_visit'] is None:
+            return float('inf')
+        return now - chat['last_visit']
+
+    def _pick(self, now):
+        """选择下一个要访问的聊天"""
+        # 从未访问或超过最长间隔的聊天优先，按等待时间排序
+        overdue = [chat for chat in self.chats if self._staleness(chat, now) >= self.max_staleness]
+        if overdue:
+            return max(overdue, key=lambda chat: self._staleness(chat, now))
+        return max(
+            self.chats,
+            key=lambda chat: max(chat['rate'], self.rate_floor) * self._staleness(chat, now)
+        )
+
+    def _dwell(self):
+        """本次访问的停留时间"""
+        cost = self.switch_cost or 0.0
+        return min(max(cost * self.switch_ratio, self.min_dwell), self.max_dwell)
+
+    def _switch(self, chat):
+        """打开聊天窗口并记录切换耗时"""
+        started = time.monotonic()
+        ok = self.monitor.open_chat_by_name(chat['chat_name'])
+        elapsed = time.monotonic() - started
+        if self.switch_cost is None:
+            self.switch_cost = elapsed
+        else:
+            self.switch_cost += self.smoothing * (elapsed - self.switch_cost)
+        if not ok:
+            self._current = None  # 打开失败后窗口停在哪个聊天不确定
+            return False
+
+        self.switches += 1
+        self._current = chat
+        # 与交互采集一致，按窗口标题确定chat_id
+        title = self.monitor.get_chat_title()
+        chat['chat_id'] = self.db.get_chat_id(title or chat['chat_name'], chat['chat_type'], chat['chat_name'])
+
+        # 离开期间的消息可能超过一屏，向上翻页补采到已入库的记录为止；先写完队列，以便按库中进度判断衔接
+        failed = self.writer.flush()
+        if failed:
+            self.logger.warning(f"{failed} 条消息写入失败，补采只能按库中已有的记录衔接")
+        newest = self.backfill.run(chat['chat_id'], self.writer)
+        chat['backfilled'] = self.backfill.last_stats.get('new', 0)
+        if newest and (not chat['last_time'] or newest > chat['last_time']):
+            chat['last_time'] = newest
+        return True
+
+    def _visit(self, chat, now):
+        """在当前聊天停留一段时间采集新消息，结束后更新频率和间隔统计"""
+        chat_id = chat['chat_id']
+        received = [0]
+
+        def enqueue(msg):
+            if msg['sender_name'] and msg['sender_name'].strip():
+                self.writer.put(chat_id, msg)
+                received[0] += 1
+
+        gap = self._staleness(chat, now)
+        received[0], chat['backfilled'] = chat['backfilled'], 0
+        chat['last_time'] = self.monitor.watch_messages(enqueue, chat['last_time'], duration=self._dwell())
+        finished = time.monotonic()
+
+        # 本次采集到的消息覆盖了上次访问结束至今的时间段；首次访问补采的是停机期间的积压，不计入频率
+        if chat['last_visit'] is not None:
+            chat['last_gap'] = gap
+            chat['max_gap'] = max(chat['max_gap'], gap)
+            sample = received[0] * 60.0 / max(finished - chat['last_visit'], 1e-6)
+            chat['rate'] += self.smoothing * (sample - chat['rate'])
+        chat['visits'] += 1
+        chat['messages'] += received[0]
+        chat['last_visit'] = finished
+        if received[0]:
+            self.logger.info(f"{chat['chat_name']}: 采集到 {received[0]} 条新消息")
+
+    def run(self, duration=None, metrics_interval=60):
+        """轮转采集，直到调用 stop() 或超过 duration
+
+        Args:
+            duration: 最长采集时间（秒），None表示一直采集
+            metrics_interval: 每隔多少秒输出一次各聊天的延迟统计，None表示不输出
+        """
+        self._stop.clear()
+        deadline = time.monotonic() + duration if duration is not None else None
+        next_report = time.monotonic() + metrics_interval if metrics_interval else None
+
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                break
+            if next_report is not None and now >= next_report:
+                self.log_metrics()
+                next_report = now + metrics_interval
+
+            chat = self._pick(now)
+            if chat is not self._current and not self._switch(chat):
+                chat['failures'] += 1
+                # 打开失败的聊天推迟到下一轮，避免反复重试拖住其他聊天
+                chat['last_visit'] = time.monotonic()
+                self.logger.warning(f"无法打开聊天: {chat['chat_name']}")
+                continue
+            self._visit(chat, now)
+
+    def stop(self):
+        """停止轮转，当前访问会立即结束"""
+        self._stop.set()
+        self.monitor.watcher.stop()
+
+    def get_metrics(self):
+        """各聊天的采集延迟统计
+
+        Returns:
+            list: 每个聊天一项，rate为平滑后的消息频率（条/分钟），staleness为距上次访问的秒数，
+                  last_gap/max_gap为访问间隔（新消息最长要等这么久才被采集）
+        """
+        now = time.monotonic()
+        metrics = []
+        for chat in self.chats:
+            staleness = 0.0 if chat is self._current else self._staleness(chat, now)
+            metrics.append({
+                'chat_name': chat['chat_name'],
+                'rate': chat['rate'],
+                'visits': chat['visits'],
+                'messages': chat['messages'],
+                'failures': chat['failures'],
+                'staleness': staleness if staleness != float('inf') else None,
+                'last_gap': chat['last_gap'],
+                'max_gap': chat['max_gap'],
+                'last_time': chat['last_time'],
+            })
+        return metrics
+
+    def log_metrics(self):
+        """输出各聊天的延迟统计"""
+        cost = f"{self.switch_cost:.1f}s" if self.switch_cost is not None else "未知"
+        self.logger.info(f"轮转采集: 已切换 {self.switches} 次, 平均切换耗时 {cost}")
+        for item in self.get_metrics():
+            staleness = f"{item['staleness']:.0f}s" if item['staleness'] is not None else "未访问"
+            self.logger.info(
+                f"  {item['chat_name']}: {item['rate']:.2f} 条/分钟, 访问 {item['visits']} 次, "
+                f"采集 {item['messages']} 条, 距上次访问 {staleness}, "
+                f"最大间隔 {item['max_gap']:.0f}s, 最新消息 {item['last_time']}"
+            )
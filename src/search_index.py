@@ -0,0 +1,150 @@
+import re
+import logging
+
+# 分词后的内容用空格连接写入FTS5，unicode61分词器按空格切分即可得到jieba的词
+_CJK_GAP = re.compile(r'(?<=[\u4e00-\u9fa5【】…]) +(?=[\u4e00-\u9fa5【】…])')
+_WORD_CHAR = re.compile(r'\w')
+
+class SearchIndex:
+    """消息全文索引
+
+    messages_fts 的 rowid 与 messages.rowid 一一对应：
+    - tokens: jieba精确模式分词结果，用于匹配和摘要高亮
+    - extra_tokens: 搜索引擎模式切出的额外子词，提高长词的召回率
+    新消息在搜索前增量补齐索引，删除消息由触发器同步。
+    分词使用与TokenStore相同的按词典版本构建的分词器，messages_fts_meta 记录索引对应的词典版本，
+    词典变化后同步时整体重建。
+    """
+
+    def __init__(self, db, token_store):
+        """
+        :param db: DatabaseHandler实例
+        :param token_store: TokenStore实例，提供词典版本和对应的分词器
+        """
+        self.db = db
+        self.token_store = token_store
+        self.logger = logging.getLogger(__name__)
+        self.init_index()
+
+    def init_index(self):
+        """创建FTS5虚拟表、版本记录表和删除同步触发器"""
+        conn = self.db.get_connection()
+        try:
+            conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                tokens,
+                extra_tokens,
+                tokenize = 'unicode61'
+            )
+            ''')
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS messages_fts_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+            ''')
+            conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS messages_fts_delete
+            AFTER DELETE ON messages
+            BEGIN
+                DELETE FROM messages_fts WHERE rowid = old.rowid;
+            END
+            ''')
+            conn.commit()
+        except Exception as e:
+            self.logger.error(f"初始化全文索引失败: {e}")
+        finally:
+            self.db.release_connection(conn)
+
+    def _segment(self, tokenizer, text):
+        """分词，返回 (精确模式文本, 额外子词文本)"""
+        if not text:
+            return '', ''
+        words = [w for w in tokenizer.cut(text) if w.strip()]
+        word_set = set(words)
+        extra = [w for w in tokenizer.cut_for_search(text) if w.strip() and w not in word_set]
+        return ' '.join(words), ' '.join(extra)
+
+    def indexed_version(self):
+        """当前索引内容对应的词典版本，从未记录时为None"""
+        conn = self.db.get_connection()
+        try:
+            row = conn.execute(
+                "SELECT value FROM messages_fts_meta WHERE key = 'dict_version'"
+            ).fetchone()
+            return row[0] if row else None
+        finally:
+            self.db.release_connection(conn)
+
+    def sync(self, batch_size=2000):
+        """把尚未索引的消息补充到全文索引中，词典版本与索引不一致时重建
+
+        Returns:
+            int: 本次新增索引的消息数
+        """
+        if self.indexed_version() != self.token_store.dict_version():
+            self.logger.info("自定义词典已变化，重建全文索引")
+            return self.rebuild()
+
+        tokenizer = self.token_store.tokenizer()
+        conn = self.db.get_connection()
+        indexed = 0
+        try:
+            last_rowid = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM messages_fts").fetchone()[0]
+            while True:
+                rows = conn.execute('''
+                SELECT rowid, content FROM messages
+                WHERE rowid > ?
+                ORDER BY rowid
+                LIMIT ?
+                ''', (last_rowid, batch_size)).fetchall()
+                if not rows:
+                    break
+
+                entries = [(rowid, *self._segment(tokenizer, content)) for rowid, content in rows]
+                with conn:
+                    conn.executemany(
+                        "INSERT INTO messages_fts (rowid, tokens, extra_tokens) VALUES (?, ?, ?)",
+                        entries
+                    )
+                indexed += len(entries)
+                last_rowid = rows[-1][0]
+
+            if indexed:
+                self.logger.info(f"全文索引新增 {indexed} 条消息")
+            return indexed
+
+        except Exception as e:
+            self.logger.error(f"同步全文索引失败: {e}")
+            return indexed
+        finally:
+            self.db.release_connection(conn)
+
+    def rebuild(self):
+        """清空并按当前词典重建全文索引，sync 发现词典变化时自动调用"""
+        version = self.token_store.dict_version()
+        conn = self.db.get_connection()
+        try:
+            with conn:
+                conn.execute("DELETE FROM messages_fts")
+                conn.execute(
+                    "INSERT OR REPLACE INTO messages_fts_meta (key, value) VALUES ('dict_version', ?)",
+                    (version,)
+                )
+        finally:
+            self.db.release_connection(conn)
+        return self.sync()
+
+    def build_match_query(self, keyword):
+        """把搜索词分词后拼成FTS5查询，各词之间为AND关系"""
+        terms = []
+        for word in self.token_store.tokenizer().cut(keyword or ''):
+            word = word.strip()
+            if word and _WORD_CHAR.search(word) and word not in terms:
+                terms.append(word)
+        return ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+
+    @staticmethod
+    def clean_snippet(snippet):
+        """去掉分词时在中文之间插入的空格"""
+        return _CJK_GAP.sub('', snippet or '')
@@ -0,0 +1,234 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import jieba
+
+logger = logging.getLogger(__name__)
+
+class DictTokenizer:
+    """按某一版本的自定义词典构建的独立jieba分词器
+
+    全局分词器的 load_userdict 只会增加词，从词典中删除的词仍然有效；
+    每个词典版本新建一个分词器，分词结果只由构建时的词典文件决定。
+    """
+
+    def __init__(self, dict_path=None):
+        """
+        :param dict_path: 自定义词典路径，不存在时只使用jieba自带词典
+        """
+        self.tokenizer = jieba.Tokenizer()
+        self.tokenizer.initialize()
+        if dict_path and os.path.exists(dict_path):
+            try:
+                self.tokenizer.load_userdict(dict_path)
+            except Exception as e:
+                logger.warning(f"加载自定义词典失败: {e}")
+        self._pos_tokenizer = None
+
+    def cut(self, text):
+        return self.tokenizer.cut(text)
+
+    def cut_for_search(self, text):
+        return self.tokenizer.cut_for_search(text)
+
+    def pos_cut(self, text):
+        """词性标注，词性分词器在第一次使用时创建"""
+        if self._pos_tokenizer is None:
+            from jieba import posseg  # 导入时加载HMM概率表，只在需要词性时导入
+            self._pos_tokenizer = posseg.POSTokenizer(self.tokenizer)
+        return self._pos_tokenizer.cut(text)
+
+def dict_stamp(dict_path):
+    """词典文件的修改时间和大小，文件不存在时为None"""
+    try:
+        stat = os.stat(dict_path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+_tokenizer_lock = threading.Lock()
+_tokenizers = {}  # 词典路径 -> (文件状态, DictTokenizer)，只保留每个词典的当前版本
+
+def get_tokenizer(dict_path):
+    """当前词典文件对应的分词器，文件变化后重新构建，同一版本在进程内共用"""
+    with _tokenizer_lock:
+        stamp = dict_stamp(dict_path)
+        entry = _tokenizers.get(dict_path)
+        if entry is None or entry[0] != stamp:
+            entry = (stamp, DictTokenizer(dict_path))
+            _tokenizers[dict_path] = entry
+            logger.info(f"已按当前自定义词典构建分词器: {dict_path}")
+        return entry[1]
+
+_worker_tokenizer = None  # 工作进程的分词器，由 _init_worker 创建
+
+def _init_worker(dict_path):
+    """工作进程启动时按当前词典构建一次分词器"""
+    global _worker_tokenizer
+    jieba.setLogLevel(logging.WARNING)
+    _worker_tokenizer = DictTokenizer(dict_path)
+
+def segment_texts(texts, with_pos, tokenizer=None):
+    """对一批文本分词，返回与输入顺序一致的结果
+
+    Args:
+        texts: 文本列表
+        with_pos: 是否返回词性
+        tokenizer: DictTokenizer，在工作进程中省略时使用进程启动时构建的分词器
+    """
+    tokenizer = tokenizer or _worker_tokenizer
+    if with_pos:
+        return [
+            [(pair.word, pair.flag) for pair in tokenizer.pos_cut(text) if pair.word.strip()]
+            for text in texts
+        ]
+    return [[w for w in tokenizer.cut(text) if w.strip()] for text in texts]
+
+class ParallelSegmenter:
+    """多进程分词服务
+
+    把文本按chunk_size切块分发到进程池，结果按输入顺序以生成器形式返回。
+    同时在途的块数有上限，调用方边消费边提交，不需要把整个语料放进内存。
+    文本量不足一个块时直接在当前进程分词，避免进程池的启动开销。
+    """
+
+    def __init__(self, dict_path="data/custom_dict.txt", workers=None, chunk_size=500, max_pending=None):
+        """
+        :param dict_path: 自定义词典路径，每个工作进程启动时按它构建一次分词器
+        :param workers: 工作进程数，默认为CPU核数
+        :param chunk_size: 每个任务包含的文本条数
+        :param max_pending: 最多同时在途的任务数，默认为进程数的2倍
+        """
+        self.dict_path = dict_path
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.max_pending = max_pending or self.workers * 2
+        self.logger = logging.getLogger(__name__)
+
+        self._executor = None
+        self._executor_version = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'messages': 0,   # 已分词文本数
+            'chunks': 0,     # 已完成任务块数
+            'seconds': 0.0,  # 累计分词耗时
+        }
+
+    def _get_executor(self):
+        """按需创建进程池，词典变化后重建"""
+        with self._lock:
+            stamp = dict_stamp(self.dict_path)
+            if self._executor is not None and self._executor_version != stamp:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    initializer=_init_worker,
+                    initargs=(self.dict_path,)
+                )
+                self._executor_version = stamp
+                self.logger.info(f"分词进程池已启动: {self.workers} 个进程")
+            return self._executor
+
+    def _segment_local(self, texts, with_pos):
+        """在当前进程分词"""
+        return segment_texts(texts, with_pos, get_tokenizer(self.dict_path))
+
+    def _chunks(self, texts):
+        """把文本流切成块"""
+        chunk = []
+        for text in texts:
+            chunk.append(text)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def segment(self, texts, with_pos=False):
+        """按输入顺序逐条返回分词结果
+
+        Args:
+            texts: 文本的可迭代对象
+            with_pos: 为True时返回 [(词, 词性), ...]，否则返回 [词, ...]
+
+        Yields:
+            list: 每条文本的分词结果
+        """
+        started = time.monotonic()
+        count = 0
+        chunks = self._chunks(texts)
+        first = next(chunks, None)
+        if first is None:
+            return
+
+        try:
+            second = next(chunks, None)
+            if second is None:
+                # 只有一个块，直接在当前进程处理
+                for tokens in self._segment_local(first, with_pos):
+                    count += 1
+                    yield tokens
+                return
+
+            executor = self._get_executor()
+            pending = deque()
+            for chunk in (first, second):
+                pending.append(executor.submit(segment_texts, chunk, with_pos))
+
+            while pending:
+                # 保持在途任务数，按提交顺序取结果
+                while len(pending) < self.max_pending:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    pending.append(executor.submit(segment_texts, chunk, with_pos))
+
+                results = pending.popleft().result()
+                with self._stats_lock:
+                    self._stats['chunks'] += 1
+                for tokens in results:
+                    count += 1
+                    yield tokens
+        finally:
+            with self._stats_lock:
+                self._stats['messages'] += count
+                self._stats['seconds'] += time.monotonic() - started
+            if count:
+                elapsed = time.monotonic() - started
+                rate = count / elapsed if elapsed > 0 else 0
+                self.logger.info(f"分词完成: {count} 条, 耗时 {elapsed:.2f} 秒, {rate:.0f} 条/秒")
+
+    def segment_batch(self, texts, with_pos=False):
+        """一次性返回所有文本的分词结果列表"""
+        return list(self.segment(texts, with_pos=with_pos))
+
+    def get_metrics(self):
+        """获取分词吞吐统计"""
+        with self._stats_lock:
+            metrics = dict(self._stats)
+        metrics['workers'] = self.workers
+        metrics['chunk_size'] = self.chunk_size
+        metrics['messages_per_sec'] = (
+            metrics['messages'] / metrics['seconds'] if metrics['seconds'] > 0 else 0.0
+        )
+        return metrics
+
+    def close(self):
+        """关闭进程池"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+                self.logger.info(f"分词进程池已关闭: {self.get_metrics()}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
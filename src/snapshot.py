@@ -0,0 +1,176 @@
+import os
+import logging
+
+# 快照查询结果的列，pyarrow在使用时才导入，未安装时不影响其他功能
+_COLUMNS = ['msg_id', 'chat_id', 'chat_name', 'chat_type', 'msg_type', 'content', 'sender_name', 'send_ts', 'month']
+
+def _require_pyarrow():
+    """导入pyarrow，未安装时给出提示"""
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.dataset
+        import pyarrow.fs
+    except ImportError:
+        raise ValueError("Parquet快照需要安装pyarrow: pip install pyarrow")
+    return pyarrow
+
+class ParquetSnapshot:
+    """按 chat_id 和月份分区的Parquet消息快照
+
+    目录结构为 hive 风格：<base_dir>/chat_id=<id>/month=<YYYY-MM>/part-N.parquet
+    - sender_name、chat_name 使用字典编码，读回时为pandas的category类型
+    - send_time 为毫秒精度的timestamp类型，保存的是本地挂钟时间
+    读取时以内存映射方式打开文件，按分区和时间过滤只读取需要的数据。
+    """
+
+    # 快照查询，列顺序与 _COLUMNS 一致；调用方可追加 AND 条件和 ORDER BY
+    QUERY = """
+        SELECT
+            m.msg_id,
+            m.chat_id,
+            c.chat_name,
+            c.chat_type,
+            m.msg_type,
+            m.content,
+            m.sender_name,
+            m.send_ts,
+            strftime('%Y-%m', m.send_ts / 1000, 'unixepoch') as month
+        FROM messages m
+        JOIN chats c ON m.chat_id = c.chat_id
+        WHERE m.send_ts IS NOT NULL
+    """
+
+    def __init__(self, base_dir):
+        """
+        :param base_dir: 快照目录
+        """
+        self.base_dir = base_dir
+        self.logger = logging.getLogger(__name__)
+
+    def _schema(self, pa):
+        """快照的Arrow schema"""
+        return pa.schema([
+            ('msg_id', pa.string()),
+            ('chat_id', pa.string()),
+            ('chat_name', pa.dictionary(pa.int32(), pa.string())),
+            ('chat_type', pa.int8()),
+            ('msg_type', pa.int8()),
+            ('content', pa.string()),
+            ('sender_name', pa.dictionary(pa.int32(), pa.string())),
+            ('send_time', pa.timestamp('ms')),
+            ('month', pa.string()),
+        ])
+
+    def _partitioning(self, pa):
+        """chat_id/month 两级hive分区，显式指定为字符串避免读取时被推断成数字"""
+        return pa.dataset.partitioning(
+            pa.schema([('chat_id', pa.string()), ('month', pa.string())]),
+            flavor='hive'
+        )
+
+    def _to_batch(self, pa, schema, rows):
+        """把一批查询结果转换为RecordBatch"""
+        columns = list(zip(*rows))
+        data = dict(zip(_COLUMNS, columns))
+        arrays = [
+            pa.array(data['msg_id'], pa.string()),
+            pa.array(data['chat_id'], pa.string()),
+            pa.array(data['chat_name'], pa.string()).dictionary_encode(),
+            pa.array(data['chat_type'], pa.int8()),
+            pa.array(data['msg_type'], pa.int8()),
+            pa.array(data['content'], pa.string()),
+            pa.array(data['sender_name'], pa.string()).dictionary_encode(),
+            pa.array(data['send_ts'], pa.int64()).cast(pa.timestamp('ms')),
+            pa.array(data['month'], pa.string()),
+        ]
+        return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+    def write(self, cursor, chunk_size=50000, progress_callback=None):
+        """把执行了 QUERY 的游标按批次写成分区的Parquet文件
+
+        Args:
+            cursor: 已执行 QUERY（可附加WHERE/ORDER BY）的游标
+            chunk_size: 每批读取的行数
+            progress_callback: 进度回调 callback(已写出行数, None)
+
+        Returns:
+            int: 写出的行数
+        """
+        pa = _require_pyarrow()
+        schema = self._schema(pa)
+        written = 0
+
+        def batches():
+            nonlocal written
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield self._to_batch(pa, schema, rows)
+                written += len(rows)
+                if progress_callback:
+                    progress_callback(written, None)
+
+        os.makedirs(self.base_dir, exist_ok=True)
+        pa.dataset.write_dataset(
+            batches(),
+            self.base_dir,
+            schema=schema,
+            format='parquet',
+            partitioning=self._partitioning(pa),
+            existing_data_behavior='overwrite_or_ignore'
+        )
+
+        self.logger.info(f"Parquet快照已写入: {self.base_dir}, 共 {written} 行")
+        return written
+
+    def read(self, chat_id=None, start_ts=None, end_ts=None, columns=None):
+        """读取快照为DataFrame
+
+        Args:
+            chat_id: 只读取指定聊天的分区
+            start_ts: 起始send_ts（含）
+            end_ts: 结束send_ts（含）
+            columns: 需要的列，None表示全部
+
+        Returns:
+            DataFrame: 按send_time排序，附带与数据库一致的send_ts列
+        """
+        pa = _require_pyarrow()
+        ds = pa.dataset
+        if not os.path.isdir(self.base_dir):
+            raise ValueError(f"快照目录不存在: {self.base_dir}")
+
+        dataset = ds.dataset(
+            self.base_dir,
+            format='parquet',
+            partitioning=self._partitioning(pa),
+            filesystem=pa.fs.LocalFileSystem(use_mmap=True)
+        )
+
+        conditions = []
+        if chat_id:
+            conditions.append(ds.field('chat_id') == chat_id)
+        if start_ts is not None:
+            conditions.append(ds.field('send_time') >= pa.scalar(start_ts, pa.timestamp('ms')))
+        if end_ts is not None:
+            conditions.append(ds.field('send_time') <= pa.scalar(end_ts, pa.timestamp('ms')))
+        condition = None
+        for item in conditions:
+            condition = item if condition is None else condition & item
+
+        table = dataset.to_table(columns=columns, filter=condition)
+        if 'send_time' in table.column_names:
+            # 在Arrow中直接取毫秒数：pandas 2起to_pandas保留datetime64[ms]，按纳秒换算会差1e6倍
+            table = table.append_column('send_ts', pa.compute.cast(table['send_time'], pa.int64()))
+        frame = table.to_pandas()
+
+        # 过滤后去掉没有出现的分类，避免groupby产生空组
+        for name in frame.columns:
+            if str(frame[name].dtype) == 'category':
+                frame[name] = frame[name].cat.remove_unused_categories()
+
+        if 'send_time' in frame.columns:
+            frame = frame.sort_values('send_time', kind='mergesort').reset_index(drop=True)
+        return frame
@@ -0,0 +1,278 @@
+import os
+import re
+import hashlib
+import logging
+from collections import defaultdict
+from src.segmenter import segment_texts, get_tokenizer
+
+_URL_PATTERN = re.compile(r'http[s]?://\S+')
+_EMOJI_PATTERN = re.compile(r'\[.*?\]')
+
+# 词之间、词与词性之间的分隔符，不会出现在聊天文本中
+_WORD_SEP = '\x1f'
+_FLAG_SEP = '\x1e'
+
+# 单条SQL绑定的msg_id上限，低于旧版SQLite每条语句999个变量的限制
+_SQL_BATCH = 900
+
+def normalize_text(content):
+    """分词前的统一清洗：去掉链接和[表情]代码"""
+    if not content or not isinstance(content, str):
+        return ''
+    text = _URL_PATTERN.sub('', content)
+    text = _EMOJI_PATTERN.sub('', text)
+    return text.strip()
+
+class TokenStore:
+    """按msg_id缓存分词结果
+
+    message_tokens 表保存每条消息的jieba分词和词性标注，并记录生成时的词典版本。
+    自定义词典内容变化后版本号改变，旧记录在下次使用时重新分词覆盖。
+    """
+
+    def __init__(self, db, dict_path="data/custom_dict.txt", segmenter=None):
+        """
+        :param db: DatabaseHandler实例
+        :param dict_path: 自定义词典路径，用于计算词典版本
+        :param segmenter: 可选的ParallelSegmenter，缓存未命中的消息交给多进程分词
+        """
+        self.db = db
+        self.dict_path = dict_path
+        self.segmenter = segmenter
+        self.logger = logging.getLogger(__name__)
+
+        self._version = None
+        self._version_stamp = None
+
+        self.init_store()
+
+    def init_store(self):
+        """创建分词缓存表"""
+        conn = self.db.get_connection()
+        try:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS message_tokens (
+                msg_id VARCHAR(32) PRIMARY KEY,
+                dict_version VARCHAR(32),
+                tokens TEXT,
+                pos_tags TEXT
+            )
+            ''')
+            conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS message_tokens_delete
+            AFTER DELETE ON messages
+            BEGIN
+                DELETE FROM message_tokens WHERE msg_id = old.msg_id;
+            END
+            ''')
+            conn.commit()
+        except Exception as e:
+            self.logger.error(f"初始化分词缓存失败: {e}")
+        finally:
+            self.db.release_connection(conn)
+
+    def dict_version(self):
+        """自定义词典的内容哈希，文件修改时间或大小不变时直接复用"""
+        try:
+            stat = os.stat(self.dict_path)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return 'none'
+
+        if stamp != self._version_stamp:
+            with open(self.dict_path, 'rb') as f:
+                self._version = hashlib.md5(f.read()).hexdigest()
+            self._version_stamp = stamp
+        return self._version
+
+    def tokenizer(self):
+        """当前词典版本的独立分词器，词典变化后重新构建"""
+        return get_tokenizer(self.dict_path)
+
+    def segment(self, text):
+        """对单条文本分词，不经过缓存"""
+        return [w for w in self.tokenizer().cut(normalize_text(text)) if w.strip()]
+
+    def iter_tokens(self, rows, with_pos=False, chunk_size=None):
+        """按输入顺序逐条返回分词结果
+
+        Args:
+            rows: (msg_id, content) 的可迭代对象
+            with_pos: 为True时返回 [(词, 词性), ...]，否则返回 [词, ...]
+            chunk_size: 每次查询/写入缓存的条数，默认500；使用多进程分词时
+                        默认为能填满所有在途任务的条数
+
+        Yields:
+            list: 每条消息的分词结果
+        """
+        if chunk_size is None:
+            chunk_size = 500
+            if self.segmenter:
+                chunk_size = max(chunk_size, self.segmenter.chunk_size * self.segmenter.max_pending)
+
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield from self._resolve_chunk(chunk, with_pos)
+                chunk = []
+        if chunk:
+            yield from self._resolve_chunk(chunk, with_pos)
+
+    def get_tokens(self, rows, with_pos=False):
+        """一次性返回所有消息的分词结果列表"""
+        return list(self.iter_tokens(rows, with_pos=with_pos))
+
+    def _segment_many(self, texts, with_pos, version):
+        """对缓存未命中的文本分词，有多进程分词服务时交给它处理"""
+        if self.segmenter:
+            return self.segmenter.segment_batch(texts, with_pos=with_pos)
+        return segment_texts(texts, with_pos, self.tokenizer())
+
+    def _resolve_chunk(self, chunk, with_pos):
+        """命中缓存的直接解码，未命中的分词后整批写回"""
+        version = self.dict_version()
+        msg_ids = list({msg_id for msg_id, _ in chunk})
+
+        conn = self.db.get_connection()
+        try:
+            # 在途块可能很大（随分词进程数增长），按批查询避免超出SQL变量数限制
+            cached = {}
+            for start in range(0, len(msg_ids), _SQL_BATCH):
+                batch = msg_ids[start:start + _SQL_BATCH]
+                placeholders = ','.join('?' * len(batch))
+                cached.update(
+                    (row[0], (row[1], row[2]))
+                    for row in conn.execute(f'''
+                    SELECT msg_id, tokens, pos_tags FROM message_tokens
+                    WHERE dict_version = ? AND msg_id IN ({placeholders})
+                    ''', [version] + batch)
+                )
+
+            # 找出需要分词的消息：没有缓存的要分词，需要词性但缓存里没有的要做词性标注
+            need_tokens = {}
+            need_pos = {}
+            for msg_id, content in chunk:
+                entry = cached.get(msg_id)
+                if entry is None:
+                    need_tokens.setdefault(msg_id, normalize_text(content))
+                if with_pos and (entry is None or entry[1] is None):
+                    need_pos.setdefault(msg_id, normalize_text(content))
+
+            updates = []
+            if need_tokens or need_pos:
+                new_tokens = dict(zip(need_tokens, self._segment_many(list(need_tokens.values()), False, version)))
+                new_pos = dict(zip(need_pos, self._segment_many(list(need_pos.values()), True, version)))
+                for msg_id in {**need_tokens, **need_pos}:
+                    if msg_id in new_tokens:
+                        tokens = _WORD_SEP.join(new_tokens[msg_id])
+                    else:
+                        tokens = cached[msg_id][0]
+                    if msg_id in new_pos:
+                        pos_tags = _WORD_SEP.join(f"{word}{_FLAG_SEP}{flag}" for word, flag in new_pos[msg_id])
+                    else:
+                        pos_tags = cached[msg_id][1] if msg_id in cached else None
+                    cached[msg_id] = (tokens, pos_tags)
+                    updates.append((msg_id, version, tokens, pos_tags))
+
+            results = {}
+            for msg_id, _ in chunk:
+                if msg_id in results:
+                    continue
+                tokens, pos_tags = cached[msg_id]
+                if with_pos:
+                    results[msg_id] = [tuple(item.split(_FLAG_SEP, 1)) for item in pos_tags.split(_WORD_SEP)] if pos_tags else []
+                else:
+                    results[msg_id] = tokens.split(_WORD_SEP) if tokens else []
+
+            if updates:
+                for start in range(0, len(updates), _SQL_BATCH):
+                    with conn:
+                        conn.executemany('''
+                        INSERT OR REPLACE INTO message_tokens (msg_id, dict_version, tokens, pos_tags)
+                        VALUES (?, ?, ?, ?)
+                        ''', updates[start:start + _SQL_BATCH])
+                self.logger.debug(f"新增分词缓存 {len(updates)} 条")
+        finally:
+            self.db.release_connection(conn)
+
+        return [results[msg_id] for msg_id, _ in chunk]
+
+    def purge_stale(self):
+        """删除旧词典版本的缓存记录"""
+        conn = self.db.get_connection()
+        try:
+            with conn:
+                cursor = conn.execute(
+                    "DELETE FROM message_tokens WHERE dict_version != ?",
+                    (self.dict_version(),)
+                )
+            return cursor.rowcount
+        finally:
+            self.db.release_connection(conn)
+
+def extract_tags_from_tokens(token_lists, top_k=20, with_weight=False, allow_pos=None):
+    """基于缓存分词结果的TF-IDF关键词提取，与jieba.analyse.extract_tags的打分方式一致
+
+    Args:
+        token_lists: 分词结果列表；指定allow_pos时元素为 (词, 词性)
+        allow_pos: 允许的词性，None表示不过滤
+    """
+    # jieba.analyse 导入时会加载IDF词表，只在提取关键词时导入
+    import jieba.analyse
+    tfidf = jieba.analyse.default_tfidf
+    allow_pos = frozenset(allow_pos) if allow_pos else None
+
+    freq = defaultdict(float)
+    for tokens in token_lists:
+        for token in tokens:
+            if allow_pos:
+                word, flag = token
+                if flag not in allow_pos:
+                    continue
+            else:
+                word = token
+            if len(word.strip()) < 2 or word.lower() in tfidf.stop_words:
+                continue
+            freq[word] += 1.0
+
+    total = sum(freq.values())
+    if not total:
+        return []
+    for word in freq:
+        freq[word] *= tfidf.idf_freq.get(word, tfidf.median_idf) / total
+
+    tags = sorted(freq.items(), key=lambda x: x[1], reverse=True)[:top_k]
+    return tags if with_weight else [word for word, _ in tags]
+
+def textrank_from_tokens(pos_lists, top_k=20, with_weight=False, allow_pos=('ns', 'n', 'vn', 'v'), span=5):
+    """基于缓存词性标注的TextRank关键词提取，与jieba.analyse.textrank的打分方式一致
+
+    Args:
+        pos_lists: 每条消息的 [(词, 词性), ...]
+    """
+    import jieba.analyse
+    from jieba.analyse.textrank import UndirectWeightedGraph
+    stop_words = jieba.analyse.default_textrank.stop_words
+    allow_pos = frozenset(allow_pos)
+
+    def keep(word, flag):
+        return flag in allow_pos and len(word.strip()) >= 2 and word.lower() not in stop_words
+
+    cooccurrence = defaultdict(int)
+    for pairs in pos_lists:
+        for i, (word, flag) in enumerate(pairs):
+            if not keep(word, flag):
+                continue
+            for j in range(i + 1, min(i + span, len(pairs))):
+                if keep(*pairs[j]):
+                    cooccurrence[(word, pairs[j][0])] += 1
+
+    graph = UndirectWeightedGraph()
+    for (start, end), weight in cooccurrence.items():
+        graph.addEdge(start, end, weight)
+    if not graph.graph:
+        return []
+
+    tags = sorted(graph.rank().items(), key=lambda x: x[1], reverse=True)[:top_k]
+    return tags if with_weight else [word for word, _ in tags]
@@ -0,0 +1,151 @@
+import json
+import time
+import logging
+from datetime import datetime
+
+def snapshot_control(control):
+    """递归序列化控件子树为 {'ControlType', 'Name', 'children'}"""
+    return {
+        'ControlType': control.ControlType,
+        'Name': control.Name,
+        'children': [snapshot_control(child) for child in control.GetChildren()],
+    }
+
+class ControlRecorder:
+    """把每次扫描到的"消息"列表子树追加写入JSONL文件
+
+    每行对应一次扫描：{"captured_at": ISO时间, "items": [控件子树, ...]}。
+    录制本身需要额外遍历整个子树，只在需要采集回放语料时开启。
+    """
+
+    def __init__(self, path):
+        """
+        :param path: JSONL文件路径，已存在时追加
+        """
+        self.path = path
+        self.logger = logging.getLogger(__name__)
+        self.count = 0
+
+    def record(self, items, captured_at=None):
+        """记录一次扫描的列表项"""
+        line = {
+            'captured_at': (captured_at or datetime.now()).isoformat(),
+            'items': [snapshot_control(item) for item in items],
+        }
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(line, ensure_ascii=False) + '\n')
+        self.count += 1
+
+class FakeControl:
+    """回放用的控件，提供解析代码用到的 uiautomation.Control 接口"""
+
+    def __init__(self, node):
+        self.ControlType = node.get('ControlType')
+        self.Name = node.get('Name') or ''
+        self._children = [FakeControl(child) for child in node.get('children', [])]
+
+    def GetChildren(self):
+        return list(self._children)
+
+    def GetFirstChildControl(self):
+        return self._children[0] if self._children else None
+
+    def GetLastChildControl(self):
+        return self._children[-1] if self._children else None
+
+    def Exists(self, maxSearchSeconds=None, searchIntervalSeconds=None):
+        return True
+
+class FakeWindow:
+    """回放用的微信主窗口，ListControl(Name="消息") 返回当前扫描的列表
+
+    用 advance() 切换到下一次扫描，依次重现录制时的列表变化。
+    """
+
+    def __init__(self, scans):
+        """
+        :param scans: load_recording 返回的扫描列表
+        """
+        self.scans = scans
+        self.index = 0
+
+    @property
+    def current(self):
+        return self.scans[self.index]
+
+    def ListControl(self, Name=None, **kwargs):
+        items = self.current['items'] if Name == "消息" else []
+        return FakeControl({'ControlType': 50008, 'Name': Name, 'children': items})
+
+    def advance(self):
+        """切换到下一次扫描，没有更多扫描时返回False"""
+        if self.index + 1 >= len(self.scans):
+            return False
+        self.index += 1
+        return True
+
+def load_recording(path):
+    """读取录制文件
+
+    Returns:
+        list: [{'captured_at': datetime, 'items': [控件子树, ...]}, ...]
+    """
+    scans = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            scan = json.loads(line)
+            scan['captured_at'] = datetime.fromisoformat(scan['captured_at'])
+            scans.append(scan)
+    return scans
+
+def replay(monitor, scans, last_time=None, incremental=True):
+    """用录制的扫描驱动 monitor.get_messages，解析代码与在线采集完全相同
+
+    monitor 的时钟固定为每次扫描的录制时间，"昨天"、"星期X"等相对时间的解析结果可重现。
+    incremental 与 get_messages 的同名参数相同。
+
+    Returns:
+        list: 每次扫描返回的消息列表
+    """
+    window = FakeWindow(scans)
+    original_window, original_clock = monitor.wx_window, monitor.clock
+    monitor.wx_window = window
+    results = []
+    try:
+        while True:
+            monitor.clock = lambda: window.current['captured_at']
+            results.append(monitor.get_messages(last_time, incremental=incremental))
+            if not window.advance():
+                break
+    finally:
+        monitor.wx_window, monitor.clock = original_window, original_clock
+    return results
+
+def benchmark_parse(monitor, scans, rounds=3):
+    """解析吞吐基准：对录制的每个列表项调用 _parse_message
+
+    Returns:
+        dict: items（每轮解析的列表项数）、seconds（最快一轮耗时）、items_per_sec
+    """
+    controls = [FakeControl(item) for scan in scans for item in scan['items']]
+    anchor = scans[0]['captured_at'] if scans else datetime.now()
+    original_clock = monitor.clock
+    monitor.clock = lambda: anchor
+    best = None
+    try:
+        for _ in range(rounds):
+            started = time.perf_counter()
+            for control in controls:
+                monitor._parse_message(control)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        monitor.clock = original_clock
+    return {
+        'items': len(controls),
+        'seconds': best or 0.0,
+        'items_per_sec': len(controls) / best if best else 0.0,
+    }
@@ -0,0 +1,72 @@
+import logging
+
+class ViewportTracker:
+    """跟踪"消息"列表的可见项，轮询时只把新出现的列表项交给解析
+
+    每个列表项用 (RuntimeId, Name) 作为指纹：RuntimeId 在控件存在期间不变，
+    取不到时（如回放的控件）只用 Name。新快照的开头与上次快照的结尾重叠的部分是已解析过的项，
+    重叠之后的才是新消息；完全没有重叠（切换聊天、向上翻页）时整屏重新解析。
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._keys = []       # 上次快照各项的指纹
+        self.continued = False  # 最近一次diff是否与上次快照重叠（返回的项一定是新消息）
+        self._stats = {
+            'scans': 0,       # 扫描次数
+            'idle_scans': 0,  # 最后一项未变化、直接跳过的扫描次数
+            'parsed': 0,      # 交给解析的列表项数
+            'skipped': 0,     # 与上次快照重叠而跳过的列表项数
+        }
+
+    def fingerprint(self, control):
+        """列表项的指纹，只需一到两次跨进程调用"""
+        try:
+            runtime_id = tuple(control.GetRuntimeId())
+        except Exception:
+            runtime_id = None
+        return (runtime_id, control.Name)
+
+    def is_idle(self, message_list):
+        """最后一项与上次快照相同时列表没有变化，不需要枚举全部子控件"""
+        self._stats['scans'] += 1
+        if not self._keys:
+            return False
+        try:
+            last = message_list.GetLastChildControl()
+        except Exception:
+            return False
+        if last is None or self.fingerprint(last) != self._keys[-1]:
+            return False
+        self._stats['idle_scans'] += 1
+        return True
+
+    def diff(self, children):
+        """对比上次快照，返回需要解析的新列表项"""
+        keys = [self.fingerprint(child) for child in children]
+        previous = self._keys
+
+        # 上次快照的结尾与本次快照的开头最长的重叠部分
+        overlap = 0
+        for size in range(min(len(previous), len(keys)), 0, -1):
+            if previous[-size:] == keys[:size]:
+                overlap = size
+                break
+
+        if previous and not overlap:
+            self.logger.debug("可见消息与上次扫描没有重叠，重新解析整屏")
+
+        self._keys = keys
+        self.continued = bool(overlap)
+        self._stats['parsed'] += len(children) - overlap
+        self._stats['skipped'] += overlap
+        return children[overlap:]
+
+    def reset(self):
+        """切换聊天后清空快照"""
+        self._keys = []
+        self.continued = False
+
+    def get_metrics(self):
+        """获取跟踪统计"""
+        return dict(self._stats)
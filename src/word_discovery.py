@@ -0,0 +1,137 @@
+import re
+import math
+import logging
+from collections import Counter, defaultdict
+import jieba
+
+# 只在连续的中文片段内统计，标点、英文和数字天然把文本切开
+_CJK_RUN = re.compile(r'[\u4e00-\u9fa5]+')
+
+def _entropy(neighbors):
+    """邻接字分布的信息熵，文本边界按互不相同的邻接字计算"""
+    total = sum(neighbors.values())
+    if not total:
+        return 0.0
+    entropy = 0.0
+    for char, count in neighbors.items():
+        if char is None:
+            # 每次出现在边界都视为一个独立的邻接字
+            entropy -= count * (1 / total) * math.log(1 / total)
+        else:
+            p = count / total
+            entropy -= p * math.log(p)
+    return entropy
+
+class WordDiscovery:
+    """基于n-gram统计的新词发现
+
+    对语料中长度不超过max_len的所有片段计数，用三项指标筛选候选词：
+    - 频数: 片段出现次数
+    - 凝固度: 各切分点上 log(P(w) / (P(a)·P(b))) 的最小值（PMI）
+    - 自由度: 左右邻接字信息熵的较小值
+    两遍线性扫描完成统计，耗时与 语料长度 × max_len 成正比。
+    """
+
+    def __init__(self, max_len=6, min_freq=5, min_pmi=3.0, min_entropy=1.0):
+        """
+        :param max_len: 候选词最大长度
+        :param min_freq: 最小出现次数
+        :param min_pmi: 最小凝固度
+        :param min_entropy: 左右邻接熵的最小值
+        """
+        self.max_len = max_len
+        self.min_freq = min_freq
+        self.min_pmi = min_pmi
+        self.min_entropy = min_entropy
+        self.logger = logging.getLogger(__name__)
+
+        self._counts = Counter()
+        self._left = defaultdict(Counter)
+        self._right = defaultdict(Counter)
+        self._total = 0
+
+    def fit(self, texts):
+        """统计语料
+
+        Args:
+            texts: 文本的可迭代对象
+        """
+        runs = [run for text in texts if text for run in _CJK_RUN.findall(text)]
+
+        # 第一遍：所有长度不超过max_len的片段计数
+        counts = Counter()
+        for run in runs:
+            length = len(run)
+            for i in range(length):
+                for n in range(1, min(self.max_len, length - i) + 1):
+                    counts[run[i:i + n]] += 1
+        self._counts = counts
+        self._total = sum(len(run) for run in runs)
+
+        # 第二遍：只为达到频数要求的多字片段统计左右邻接字
+        left = defaultdict(Counter)
+        right = defaultdict(Counter)
+        for run in runs:
+            length = len(run)
+            for i in range(length):
+                for n in range(2, min(self.max_len, length - i) + 1):
+                    word = run[i:i + n]
+                    if counts[word] < self.min_freq:
+                        # 更长的片段频数不会更高
+                        break
+                    left[word][run[i - 1] if i > 0 else None] += 1
+                    right[word][run[i + n] if i + n < length else None] += 1
+        self._left = left
+        self._right = right
+
+        self.logger.info(f"新词发现统计完成: {len(runs)} 个文本片段, {len(left)} 个候选")
+        return self
+
+    def _pmi(self, word):
+        """各切分点上的最小点互信息"""
+        count = self._counts[word]
+        return min(
+            math.log(count * self._total / (self._counts[word[:k]] * self._counts[word[k:]]))
+            for k in range(1, len(word))
+        )
+
+    def candidates(self, top_k=None, exclude_known=True):
+        """返回满足阈值的候选新词
+
+        Args:
+            top_k: 最多返回多少个，None表示全部
+            exclude_known: 是否排除jieba词库中已有的词
+
+        Returns:
+            list: [{'word', 'freq', 'pmi', 'left_entropy', 'right_entropy', 'score'}, ...]，按score降序
+        """
+        if exclude_known:
+            jieba.initialize()
+
+        results = []
+        for word in self._left:
+            if len(set(word)) == 1:  # 哈哈哈、嗯嗯这类叠字
+                continue
+            if exclude_known and jieba.get_FREQ(word):
+                continue
+
+            pmi = self._pmi(word)
+            if pmi < self.min_pmi:
+                continue
+            left_entropy = _entropy(self._left[word])
+            right_entropy = _entropy(self._right[word])
+            if min(left_entropy, right_entropy) < self.min_entropy:
+                continue
+
+            freq = self._counts[word]
+            results.append({
+                'word': word,
+                'freq': freq,
+                'pmi': pmi,
+                'left_entropy': left_entropy,
+                'right_entropy': right_entropy,
+                'score': math.log(freq) * min(left_entropy, right_entropy),
+            })
+
+        results.sort(key=lambda x: x['score'], reverse=True)
+        return results[:top_k] if top_k else results
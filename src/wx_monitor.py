@@ -1,17 +1,75 @@
-import uiautomation as auto
 import time
 from datetime import datetime, timedelta
 import re
 import logging
 import os
 import sys
+from src.ui_replay import ControlRecorder
+from src.viewport_tracker import ViewportTracker
+from src.message_watcher import MessageWatcher
+
+try:
+    import uiautomation as auto
+except ImportError:  # 非Windows环境只能通过 src.ui_replay 回放录制的控件树
+    auto = None
+
+# 媒体消息的控件类型 -> (消息类型, 文件名模板, 内容占位, 日志名称)
+_MEDIA_CONTROLS = {
+    50001: (2, "img_{}.jpg", "[图片]", "图片"),
+    50002: (3, "video_{}.mp4", "[视频]", "视频"),
+    50003: (4, "file_{}", "[文件]", "文件"),
+    50004: (5, "voice_{}.mp3", "[语音]", "语音"),
+    50005: (6, None, "[表情]", "表情"),
+    50006: (7, None, "[转发的聊天记录]", "转发"),
+}
+
+# 微信的四种时间显示格式合并为一个正则：HH:MM、昨天 HH:MM、星期X HH:MM、YYYY年MM月DD日 HH:MM
+_TIME_PATTERN = re.compile(
+    r'^(?:(?P<year>\d{4})年(?P<month>\d{2})月(?P<day>\d{2})日 |(?P<yesterday>昨天) |星期(?P<weekday>[一二三四五六日]) )?'
+    r'(?P<hour>\d{1,2}):(?P<minute>\d{2})$'
+)
+_WEEKDAYS = {'一': 0, '二': 1, '三': 2, '四': 3, '五': 4, '六': 5, '日': 6}
+
+def match_time(text, strict=True):
+    """一次匹配判断文本是否为微信时间格式并提取字段
+    
+    Args:
+        text: 控件名称或消息内容
+        strict: 为True时小时必须是两位数（控件名称），否则允许一位数（消息内容）
+    
+    Returns:
+        re.Match: 匹配结果，不是时间格式时为None
+    """
+    match = _TIME_PATTERN.match(text)
+    if match and strict and len(match.group('hour')) != 2:
+        return None
+    return match
 
 class WeChatMonitor:
-    def __init__(self, log_path="logs", media_path="data/media"):
+    def __init__(self, log_path="logs", media_path="data/media", diagnostics=False):
+        """
+        :param log_path: 日志目录
+        :param media_path: 媒体文件目录
+        :param diagnostics: 为True时解析每条消息都打印完整控件树，仅用于排查控件结构变化
+        """
         self.wx_window = None
         self.chat_window = None
         self.last_time = None
-        auto.SetGlobalSearchTimeout(2)
+        self.clock = datetime.now  # 解析相对时间的当前时间，回放时替换为录制时间
+        self.recorder = None
+        self.viewport = ViewportTracker()  # 只解析上次扫描之后新出现的列表项
+        self.watcher = MessageWatcher(self)  # 事件驱动采集，不可用时自适应轮询
+        self.diagnostics = diagnostics
+        self._scan_anchor = None    # 当前扫描的基准时间，一次扫描内的相对时间都按它解析
+        self._time_cache = {}       # 时间字符串 -> 解析结果，基准日期变化时清空
+        self._time_cache_date = None
+        self.parse_stats = {
+            'messages': 0,     # 已解析的可见列表项数
+            'seconds': 0.0,    # 累计解析耗时
+            'last_scan_ms': 0.0,  # 最近一次扫描平均每条的解析耗时
+        }
+        if auto:
+            auto.SetGlobalSearchTimeout(2)
         
         # 获取程序运行路径
         if getattr(sys, 'frozen', False):
@@ -186,183 +244,124 @@ class WeChatMonitor:
         os.makedirs(folder_path, exist_ok=True)
         return os.path.join(folder_path, file_id)
     
+    def _dump_control_tree(self, control, level=0):
+        """打印完整的控件树结构，仅在开启诊断时使用"""
+        print("  "*level + f"- {control.ControlType}: {control.Name}")
+        for child in control.GetChildren():
+            self._dump_control_tree(child, level + 1)
+    
+    def _walk_message_controls(self, msg_control):
+        """单次遍历消息控件子树，只收集解析需要的字段
+        
+        每个控件的 Name/ControlType/GetChildren 都是一次跨进程调用，因此：
+        - 遇到"查看更多消息"按钮立即结束
+        - 找到发送者后，列表项自身的名称就是完整的消息文本，子控件只是气泡容器，不再继续深入
+        
+        Returns:
+            dict: sender、time_str、original_time、names（非时间文本，按出现顺序）、
+                  media_type（第一个有名称的媒体控件类型）、more（是否为"查看更多消息"）
+        """
+        found = {
+            'sender': None,
+            'time_str': None,
+            'original_time': None,
+            'names': [],
+            'media_type': None,
+            'more': False,
+        }
+        root_name = msg_control.Name
+        stack = [msg_control]
+        while stack:
+            control = stack.pop()
+            try:
+                control_type = control.ControlType
+                name = control.Name
+            except Exception:
+                name = None
+            
+            if name:
+                if self.diagnostics:
+                    self.logger.debug(f"类型: {control_type}, 名称: {name}")
+                
+                if control_type == 50000 and not found['sender']:
+                    if name == "查看更多消息":
+                        found['more'] = True
+                        return found
+                    found['sender'] = name
+                
+                # 检查时间格式
+                if not found['time_str'] and match_time(name):
+                    found['time_str'] = name
+                    found['original_time'] = self._parse_time(name)
+                    if found['original_time']:
+                        self.last_time = found['original_time']
+                else:
+                    found['names'].append(name)
+                
+                if found['media_type'] is None and control_type in _MEDIA_CONTROLS:
+                    found['media_type'] = control_type
+            
+            # 发送者已确定且列表项自身带有消息文本时，剩余子控件不会带来新的信息
+            if found['sender'] and root_name and root_name in found['names']:
+                break
+            
+            # 逆序入栈，保持与递归遍历相同的先序顺序
+            stack.extend(reversed(control.GetChildren()))
+        return found
+    
     def _parse_message(self, msg_control):
         """解析单条消息"""
         try:
-            self.logger.debug("="*50)
-            self.logger.debug(f"正在解析消息控件: {msg_control.Name}")
-            
-            # 打印完整的控件树结构
-            def print_control_tree(control, level=0):
-                self.logger.debug("  "*level + f"- {control.ControlType}: {control.Name}")
-                for child in control.GetChildren():
-                    print_control_tree(child, level + 1)
-            
-            print("\n控件树结构:")
-            print_control_tree(msg_control)
+            if self.diagnostics:
+                self.logger.debug("="*50)
+                self.logger.debug(f"正在解析消息控件: {msg_control.Name}")
+                print("\n控件树结构:")
+                self._dump_control_tree(msg_control)
+            
+            found = self._walk_message_controls(msg_control)
+            if found['more']:
+                # 记录"查看更多消息"，但发送者和发送时间置空
+                self.logger.debug("记录'查看更多消息'控件")
+                return {
+                    "sender_name": None,
+                    "send_time": None,
+                    "content": "查看更多消息",
+                    "msg_type": 1  # 使用默认文本类型
+                }
             
-            # 递归遍历所有子控件
-            def traverse_controls(control):
-                results = []
-                try:
-                    if control.Name:  # 如果控件有名称
-                        results.append((control.ControlType, control.Name))
-                except:
-                    pass
-                    
-                # 递归遍历子控件
-                for child in control.GetChildren():
-                    results.extend(traverse_controls(child))
-                return results
-                
-            # 获取所有控件信息
-            all_controls = traverse_controls(msg_control)
-            self.logger.debug("\n所有控件信息:")
-            for control_type, name in all_controls:
-                self.logger.debug(f"类型: {control_type}, 名称: {name}")
-            
-            # 初始化变量
-            sender = None
-            time_str = None
+            sender = found['sender']
+            time_str = found['time_str']
+            original_time = found['original_time']
             msg_type = 1  # 默认文本类型
             file_id = None
-            original_time = None  # 记录原始时间
-            
-            # 获取所有唯一的名称
-            unique_names = set()
-            sender_name = None
-            
-            # 第一次遍历：找到sender
-            for control_type, name in all_controls:
-                if control_type == 50000 and not sender:
-                    if name == "查看更多消息":
-                        # 记录"查看更多消息"，但发送者和发送时间置空
-                        result = {
-                            "sender_name": None,
-                            "send_time": None,
-                            "content": "查看更多消息",
-                            "msg_type": 1  # 使用默认文本类型
-                        }
-                        self.logger.debug("记录'查看更多消息'控件")
-                        return result
-                    sender = name
-                    sender_name = name
-                    break
-            
-            # 第二次遍历：收集所有唯一名称和处理时间
-            for control_type, name in all_controls:
-                try:
-                    # 跳过空名称
-                    if not name:
-                        continue
-                    
-                    # 检查时间格式
-                    if not time_str and (
-                        re.match(r'^\d{2}:\d{2}$', name) or
-                        re.match(r'^星期[一二三四五六日] \d{2}:\d{2}$', name) or
-                        re.match(r'^\d{4}年\d{2}月\d{2}日 \d{2}:\d{2}$', name) or
-                        re.match(r'^昨天 \d{2}:\d{2}$', name)
-                    ):
-                        time_str = name
-                        original_time = self._parse_time(time_str)
-                        if original_time:
-                            self.last_time = original_time
-                        continue
-                    
-                    # 将所有非时间的文本添加到唯一名称集合
-                    unique_names.add(name)
-                    
-                except Exception as e:
-                    self.logger.error(f"解析控件出错: {e}")
-                    continue
-            
-            # 从唯一名称集合中移除sender_name
-            if sender_name:
-                unique_names.discard(sender_name)
             
-            # 获取content（排序sender后的最长文本）
+            # 获取content（排除sender后的最长文本）
+            unique_names = set(found['names'])
+            if sender:
+                unique_names.discard(sender)
             content = max(unique_names, key=len) if unique_names else None
             
             # 如果content未知，根据控件类型识别消息类型
-            if content == "未知内容" or not content:
-                for control_type, name in all_controls:
-                    try:
-                        if not name:
-                            continue
-                            
-                        # 根据控件类型识别特殊消息类型
-                        if control_type == 50001:  # 图片控件类型
-                            msg_type = 2
-                            file_id = f"img_{int(time.time())}.jpg"
-                            file_path = self._get_media_path(msg_type, file_id)
-                            content = f"[图片]"
-                            self.logger.info(f"图片将保存至: {file_path}")
-                            break
-                        elif control_type == 50002:  # 视频控件类型
-                            msg_type = 3
-                            file_id = f"video_{int(time.time())}.mp4"
-                            file_path = self._get_media_path(msg_type, file_id)
-                            content = f"[视频]"
-                            self.logger.info(f"视频将保存至: {file_path}")
-                            break
-                        elif control_type == 50003:  # 文件控件类型
-                            msg_type = 4
-                            file_id = f"file_{int(time.time())}"
-                            content = f"[文件]"
-                            file_path = self._get_media_path(msg_type, file_id)
-                            self.logger.info(f"文件将保存至: {file_path}")
-                            break
-                        elif control_type == 50004:  # 语音控件类型
-                            msg_type = 5
-                            file_id = f"voice_{int(time.time())}.mp3"
-                            file_path = self._get_media_path(msg_type, file_id)
-                            content = f"[语音]"
-                            self.logger.info(f"语音将保存至: {file_path}")
-                            break
-                        elif control_type == 50005:  # 表情控件类型
-                            msg_type = 6
-                            content = "[表情]"
-                            self.logger.info(f"检测到表情消息")
-                            break
-                        elif control_type == 50006:  # 转发消息控件类型
-                            msg_type = 7
-                            content = "[转发的聊天记录]"
-                            self.logger.info(f"检测到转发消息")
-                            break
-                    except Exception as e:
-                        self.logger.error(f"解析控件出错: {e}")
-                        continue
+            if (content == "未知内容" or not content) and found['media_type']:
+                msg_type, file_pattern, content, label = _MEDIA_CONTROLS[found['media_type']]
+                if file_pattern:
+                    file_id = file_pattern.format(int(time.time()))
+                    file_path = self._get_media_path(msg_type, file_id)
+                    self.logger.info(f"{label}将保存至: {file_path}")
+                else:
+                    self.logger.info(f"检测到{label}消息")
             
-            # 检查是否为时间消息
-            is_time_message = content and (
-                re.match(r'^\d{1,2}:\d{2}$', content) or  # 修改正则以支持单位数小时
-                re.match(r'^星期[一二三四五六日] \d{1,2}:\d{2}$', content) or
-                re.match(r'^\d{4}年\d{2}月\d{2}日 \d{1,2}:\d{2}$', content) or
-                re.match(r'^昨天 \d{1,2}:\d{2}$', content)
-            )
+            # 检查是否为时间消息（内容中的小时允许一位数）
+            is_time_message = content and match_time(content, strict=False)
             
             if sender or content:  # 放宽条件，允许部分信息缺失
                 # 如果找到未知发送者且内容是时间格式，则更新发送时间
                 if (sender == "未知发送者" or not sender) and is_time_message:
-                    # 获取当前日期
-                    current_date = datetime.now().date()
-                    
-                    # 解析时间字符串
-                    if re.match(r'^\d{1,2}:\d{2}$', content):
-                        # 处理纯时间格式 (H:MM 或 HH:MM)
-                        hour, minute = map(int, content.split(':'))
-                        send_time = datetime.combine(current_date, datetime.min.time().replace(hour=hour, minute=minute))
-                    else:
-                        # 其他时间格式使用现有的解析方法
-                        parsed_time = self._parse_time(content)
-                        if parsed_time:
-                            send_time = parsed_time
-                        else:
-                            send_time = original_time or self.last_time or datetime.now()
-                    
+                    parsed_time = self._parse_time(content)
+                    send_time = parsed_time or original_time or self.last_time or self._now()
                     self.last_time = send_time
                 else:
-                    send_time = original_time or self.last_time or datetime.now()
+                    send_time = original_time or self.last_time or self._now()
                 
                 result = {
                     "sender_name": sender or "未知发送者",
@@ -373,7 +372,7 @@ class WeChatMonitor:
                 if file_id:
                     result["file_id"] = file_id
                     
-                self.logger.info(f"解析结果: {result}")
+                self.logger.debug(f"解析结果: {result}")
                 return result
             else:
                 self.logger.warning(f"消息信息不完整: sender={sender}, time={time_str}, content={content}")
@@ -383,46 +382,63 @@ class WeChatMonitor:
             self.logger.error(f"解析消息失败: {e}")
             return None
             
+    def _now(self):
+        """当前扫描的基准时间，不在扫描中时取当前时间"""
+        return self._scan_anchor or self.clock()
+    
     def _parse_time(self, time_str):
-        """解析时间字符串"""
+        """解析时间字符串
+        
+        "昨天"、"星期X"和只有时分的格式依赖当前日期，结果按基准日期缓存，
+        同一天内重复出现的时间字符串只解析一次。
+        """
+        now = self._now()
+        if self._time_cache_date != now.date():
+            self._time_cache.clear()
+            self._time_cache_date = now.date()
+        if time_str in self._time_cache:
+            return self._time_cache[time_str]
+        
         try:
-            now = datetime.now()
+            match = match_time(time_str, strict=False)
+            if not match:
+                self.logger.warning(f"未知的时间格式: {time_str}")
+                return None
             
-            # 如果是"昨天 HH:MM"格式
-            if re.match(r'^昨天 \d{2}:\d{2}$', time_str):
-                hour, minute = map(int, time_str.split(' ')[1].split(':'))
+            hour, minute = int(match.group('hour')), int(match.group('minute'))
+            if match.group('year'):
+                # 完整日期格式 (YYYY年MM月DD日 HH:MM)
+                result = datetime(int(match.group('year')), int(match.group('month')), int(match.group('day')), hour, minute)
+            elif match.group('yesterday'):
+                # "昨天 HH:MM"格式
                 yesterday = now - timedelta(days=1)
-                return datetime(yesterday.year, yesterday.month, yesterday.day, hour, minute)
-            
-            # 如果只有时分格式 (HH:MM)，使用当天日期
-            if re.match(r'^\d{2}:\d{2}$', time_str):
-                hour, minute = map(int, time_str.split(':'))
-                return datetime(now.year, now.month, now.day, hour, minute)
-            
-            # 如果是星期+时分格式 (星期X HH:MM)
-            if re.match(r'^星期[一二三四五六日] \d{2}:\d{2}$', time_str):
-                weekday_map = {'一':0, '二':1, '三':2, '四':3, '五':4, '六':5, '日':6}
-                weekday = weekday_map[time_str[2]]
-                hour, minute = map(int, time_str.split(' ')[1].split(':'))
-                
-                # 计算目标日期
-                days_diff = (weekday - now.weekday()) % 7
+                result = datetime(yesterday.year, yesterday.month, yesterday.day, hour, minute)
+            elif match.group('weekday'):
+                # 星期+时分格式 (星期X HH:MM)，取最近的一个该星期几
+                days_diff = (_WEEKDAYS[match.group('weekday')] - now.weekday()) % 7
                 target_date = now - timedelta(days=days_diff)
-                return datetime(target_date.year, target_date.month, target_date.day, hour, minute)
-            
-            # 如果是完整日期格式 (YYYY年MM月DD日 HH:MM)
-            if re.match(r'^\d{4}年\d{2}月\d{2}日 \d{2}:\d{2}$', time_str):
-                return datetime.strptime(time_str, '%Y年%m月%d日 %H:%M')
-            
-            self.logger.warning(f"未知的时间格式: {time_str}")
-            return None
+                result = datetime(target_date.year, target_date.month, target_date.day, hour, minute)
+            else:
+                # 只有时分格式 (HH:MM)，使用当天日期
+                result = datetime(now.year, now.month, now.day, hour, minute)
             
         except Exception as e:
             self.logger.error(f"解析时间失败: {time_str}, 错误: {e}")
-            return None
+            result = None
+        
+        self._time_cache[time_str] = result
+        return result
 
-    def get_messages(self, last_time=None):
-        """获取聊天消息"""
+    def get_messages(self, last_time=None, sink=None, incremental=True):
+        """获取聊天消息
+        
+        Args:
+            last_time: 只返回晚于该时间的消息；增量扫描与上次扫描衔接时不按时间过滤
+            sink: 可选回调，每解析出一条新消息立即调用sink(message)，
+                  用于边解析边推送到后台写入队列
+            incremental: 为True时只解析上次扫描之后新出现的列表项，列表没有变化时不枚举子控件；
+                  为False时解析整屏
+        """
         if not self.wx_window:
             self.logger.warning("未找到微信窗口")
             return []
@@ -437,8 +453,25 @@ class WeChatMonitor:
                 self.logger.warning("未找到消息列表")
                 return []
             
-            # 遍历消息
-            for msg in message_list.GetChildren():
+            # 空闲的聊天只需比较最后一项（录制时需要每次的完整快照）
+            if incremental and not self.recorder and self.viewport.is_idle(message_list):
+                return []
+            
+            children = message_list.GetChildren()
+            if self.recorder:
+                self.recorder.record(children)
+            if incremental:
+                children = self.viewport.diff(children)
+            else:
+                self.viewport.reset()
+            # 与上次快照衔接时返回的项都是新出现的，同一分钟内的后续消息时间相同，不能再按时间过滤；
+            # 重复入库由msg_id和INSERT OR IGNORE去重
+            filter_by_time = last_time and not (incremental and self.viewport.continued)
+            
+            # 遍历消息，本次扫描的相对时间都以同一个基准时间解析
+            self._scan_anchor = self.clock()
+            scan_started = time.perf_counter()
+            for msg in children:
                 try:
                     content = self._parse_message(msg)
                     if content and content['send_time']:
@@ -451,22 +484,71 @@ class WeChatMonitor:
                             continue
                             
                         # 检查时间
-                        if last_time and content['send_time'] <= last_time:
+                        if filter_by_time and content['send_time'] <= last_time:
                             self.logger.debug(f"跳过旧消息: {content['send_time']}")
                             continue
                             
                         message_hash_set.add(msg_hash)
                         messages.append(content)
+                        if sink:
+                            sink(content)
                 except Exception as e:
                     self.logger.error(f"解析单条消息时出错: {e}")
                     continue
             
+            self._record_parse_latency(len(children), time.perf_counter() - scan_started)
             if messages:
                 self.logger.info(f"获取到 {len(messages)} 条新消息")
             return messages
         except Exception as e:
             self.logger.error(f"获取消息列表时出错: {e}")
             return []
+        finally:
+            self._scan_anchor = None
+    
+    def watch_messages(self, sink, last_time=None, duration=None):
+        """事件驱动地持续采集当前聊天的新消息
+        
+        消息列表有新增子项时立即扫描并把新消息交给sink，空闲时不轮询或按指数退避轮询，
+        详见 src.message_watcher.MessageWatcher。
+        
+        Args:
+            sink: 每条新消息解析出来后立即调用 sink(message)，交付到队列时传入 queue.put
+            last_time: 只交付晚于该时间的消息
+            duration: 最长采集时间（秒），None表示一直采集直到 self.watcher.stop()
+        
+        Returns:
+            datetime: 最后一条有效消息的时间
+        """
+        return self.watcher.run(sink, last_time=last_time, duration=duration)
+    
+    def _record_parse_latency(self, count, elapsed):
+        """记录一次扫描的解析耗时"""
+        if not count:
+            return
+        self.parse_stats['messages'] += count
+        self.parse_stats['seconds'] += elapsed
+        self.parse_stats['last_scan_ms'] = elapsed * 1000 / count
+        self.logger.debug(f"解析 {count} 条可见消息, 耗时 {elapsed * 1000:.1f} ms, 平均 {self.parse_stats['last_scan_ms']:.2f} ms/条")
+    
+    def get_parse_metrics(self):
+        """获取消息解析耗时统计"""
+        metrics = dict(self.parse_stats)
+        metrics['avg_ms'] = (
+            metrics['seconds'] * 1000 / metrics['messages'] if metrics['messages'] else 0.0
+        )
+        return metrics
+    
+    def start_recording(self, path):
+        """开始把每次扫描的消息列表控件树录制到JSONL文件，用于离线回放和解析基准"""
+        self.recorder = ControlRecorder(path)
+        self.logger.info(f"开始录制消息控件树: {path}")
+    
+    def stop_recording(self):
+        """停止录制"""
+        if self.recorder:
+            self.logger.info(f"停止录制, 共 {self.recorder.count} 次扫描: {self.recorder.path}")
+        self.recorder = None
     
     def get_chat_title(self):
         """获取当前聊天窗口标题"""
@@ -565,14 +647,10 @@ class WeChatMonitor:
                 self.logger.error("未能进入聊天界面")
                 return False
             
-            # 4. 向上滚动8次
-            message_list = self.wx_window.ListControl(Name="消息")
-            if message_list.Exists(maxSearchSeconds=2):
-                for _ in range(8):
-                    message_list.WheelUp(wheelTimes=3)  # 每次滚动3个单位
-                    time.sleep(0.4)  # 等待消息加载
+            self.viewport.reset()
             
-            self.logger.info(f"成功打开并滚动聊天窗口: {chat_name}")
+            # 补采停机期间的历史消息由 src.backfill.Backfill 按已入库的进度向上翻页
+            self.logger.info(f"成功打开聊天窗口: {chat_name}")
             return True
             
         except Exception as e: